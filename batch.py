@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+import exchanges
+import pricestore
+from txhistory import match_trades, AssetFifoCostBasis, AssetLifoCostBasis
+
+COSTBASIS_CLASSES = {"fifo": AssetFifoCostBasis, "lifo": AssetLifoCostBasis}
+# sources that come from files in the portfolio, everything else has to be
+# pickled already since the api keys aren't per portfolio
+FILE_SOURCES = {"other": "othertx.txt", "bithumb": "bithumb.txt"}
+
+
+def portfolio_sources(directory):
+    sources = []
+    for src in exchanges.SOURCES:
+        if os.path.exists(os.path.join(directory, f"{src}.pickle")):
+            sources.append(src)
+        elif src in FILE_SOURCES and os.path.exists(os.path.join(directory, FILE_SOURCES[src])):
+            sources.append(src)
+    return sources
+
+
+def init_worker(db_path):
+    pricestore.use_store(pricestore.PriceStore(db_path, readonly=True))
+    pricestore.collect_misses()
+
+
+def summarize(costbasis, deposits):
+    return {
+        "deposits": str(deposits),
+        "costbasis": {
+            sym: {
+                "balance": str(cb.balance),
+                "cost_basis": str(cb.usd_avg_cost_basis * cb.balance),
+                "profit_loss": str(cb.profit_loss),
+            }
+            for sym, cb in sorted(costbasis.items())
+        },
+        "realized_pl": str(sum((cb.profit_loss for cb in costbasis.values()), Decimal(0))),
+    }
+
+
+def run_portfolio(directory, method):
+    """replay one portfolio, returns (directory, result, misses)
+    result is None if any price was missing from the shared store"""
+    pricestore.misses.clear()
+    with open(os.path.join(directory, "ledger.log"), "w") as log, contextlib.redirect_stdout(log):
+        try:
+            costbasis, deposits = match_trades(
+                costbasis_class=COSTBASIS_CLASSES[method],
+                directory=directory,
+                sources=portfolio_sources(directory),
+            )
+        except Exception:
+            # placeholder prices can derail a replay, fetch and retry
+            if pricestore.misses:
+                return directory, None, set(pricestore.misses)
+            raise
+    if pricestore.misses:
+        return directory, None, set(pricestore.misses)
+    result = summarize(costbasis, deposits)
+    with open(os.path.join(directory, "ledger.json"), "w") as f:
+        json.dump(result, f, indent=2)
+    return directory, result, set()
+
+
+def run(portfolios, db_path, method="lifo", workers=None, max_rounds=5):
+    """replay every portfolio in a process pool sharing one read-only
+    price store, fetching the prices they were missing centrally between
+    rounds. returns {directory: result or error}"""
+    store = pricestore.PriceStore(db_path)
+    pricestore.use_store(store)
+    store.migrate_pickles()
+    results = {}
+    todo = list(portfolios)
+    for attempt in range(max_rounds):
+        if not todo:
+            break
+        misses = set()
+        retry = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(db_path,)) as pool:
+            futures = [pool.submit(run_portfolio, d, method) for d in todo]
+            for d, future in zip(todo, futures):
+                try:
+                    directory, result, missing = future.result()
+                except Exception as e:
+                    results[d] = {"error": f"{type(e).__name__}: {e}"}
+                    continue
+                if missing:
+                    misses |= missing
+                    retry.append(d)
+                else:
+                    results[d] = result
+        print(f"round {attempt + 1}: {len(todo) - len(retry)} done, {len(misses)} prices to fetch", file=sys.stderr)
+        failed = exchanges.fetch_misses(store, misses)
+        for key, error in failed.items():
+            print(f"can't fetch {key[0]} {key[1]} {key[2]}: {error}", file=sys.stderr)
+        if failed and len(failed) == len(misses):
+            break
+        todo = retry
+    for d in todo:
+        results.setdefault(d, {"error": "prices missing after the last round"})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay many portfolio directories in parallel")
+    parser.add_argument("portfolios", nargs="+", help="directories with each account's pickles and exports")
+    parser.add_argument("--db", default=os.environ.get("LEDGER_PRICE_DB", pricestore.DEFAULT_PATH))
+    parser.add_argument("--method", choices=sorted(COSTBASIS_CLASSES), default="lifo")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--json", help="also write every portfolio's result to this file")
+    args = parser.parse_args()
+
+    results = run(args.portfolios, args.db, method=args.method, workers=args.workers)
+    for d, r in results.items():
+        if "error" in r:
+            print(f"{d}: ERROR {r['error']}")
+        else:
+            print(f"{d}: deposits {Decimal(r['deposits']):0.2f} realized p/l {Decimal(r['realized_pl']):0.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
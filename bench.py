@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+from time import perf_counter
+import txgen
+import exchanges
+import txhistory
+from exchanges import get_all_transactions, normalize_txtype, normalize_sym
+from ledger import (
+    AssetLedgerEntry,
+    AssetTradeMatcher,
+    AssetCostBasis,
+    AssetFifoCostBasis,
+    AssetLifoCostBasis,
+)
+
+COSTBASIS_CLASSES = [AssetCostBasis, AssetFifoCostBasis, AssetLifoCostBasis]
+# the average cost class has no lot accessors so it can't take fees,
+# only the lot based classes can replay a whole history
+REPLAY_CLASSES = [AssetFifoCostBasis, AssetLifoCostBasis]
+
+
+@contextlib.contextmanager
+def quiet():
+    """the cost basis classes print every realized p/l line"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+@contextlib.contextmanager
+def chdir(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+class Bench(object):
+
+    def __init__(self):
+        self.results = {}
+
+    @contextlib.contextmanager
+    def time(self, name, items=None):
+        start = perf_counter()
+        yield
+        elapsed = perf_counter() - start
+        self.results[name] = {"seconds": elapsed, "items": items}
+        rate = f"{items / elapsed:12.0f}/s" if items and elapsed else ""
+        print(f"{name:<32} {elapsed:10.3f}s {rate}", file=sys.stderr)
+
+
+def entries(transactions):
+    return [
+        AssetLedgerEntry(
+            date=t[0],
+            exchange=t[1],
+            txtype=normalize_txtype(t[2]),
+            sym=normalize_sym(t[3]),
+            amount=t[4],
+        )
+        for t in transactions
+    ]
+
+
+def priced_trades(ents):
+    """pair up trade legs the way AssetTradeMatcher does and price them,
+    returns (sym, amount, usd_unit_price, date) cost basis operations"""
+    ops = []
+    pending = {}
+    for e in ents:
+        if e.txtype != "trade":
+            continue
+        key = (e.exchange, e.date)
+        if key in pending:
+            a = pending.pop(key)
+            if a.sym == e.sym:
+                continue
+            a_usd, b_usd = exchanges.get_usd_for_pair((a.sym, a.amount), (e.sym, e.amount), a.date)
+            ops.append((a.sym, a.amount, a_usd, a.date))
+            ops.append((e.sym, e.amount, b_usd, e.date))
+        else:
+            pending[key] = e
+    return ops
+
+
+def fill_stream(nlegs, seed):
+    """trade legs the way a busy exchange without order ids reports them,
+    each order filled in a few pieces on each side, a fraction of a second
+    apart"""
+    rnd = random.Random(seed)
+    ts = datetime(2018, 1, 1)
+    legs = []
+    while len(legs) < nlegs:
+        sym = rnd.choice(["BTC", "ETH", "LTC"])
+        qty = Decimal(rnd.randint(1, 10**6)) / 10**4
+        usd = qty * rnd.randint(100, 20000)
+        sign = rnd.choice([1, -1])
+        for leg_sym, amount in [(sym, qty * sign), ("USD", -usd * sign)]:
+            cuts = sorted(rnd.sample(range(1, 10**6), rnd.randint(0, 3)))
+            for lo, hi in zip([0] + cuts, cuts + [10**6]):
+                legs.append(AssetLedgerEntry(leg_sym, amount * (hi - lo) / 10**6, ts, "bench", "trade"))
+        ts += timedelta(milliseconds=rnd.randint(100, 3000))
+    return legs
+
+
+def fill_scaling(bench, sizes, seed):
+    """time matching fill streams of growing size, resolving after every
+    leg like a replay does, the time per leg should stay flat"""
+    for n in sizes:
+        legs = fill_stream(n, seed)
+        tm = AssetTradeMatcher()
+        costbasis = txhistory.keydefaultdict(AssetCostBasis)
+        with quiet(), bench.time(f"fill matcher {n}", len(legs)):
+            for entry in legs:
+                tm.add(entry)
+                tm.resolve(costbasis, entry.date)
+            tm.resolve(costbasis)
+        assert not tm.tx, f"{len(tm.tx)} legs unmatched"
+
+
+def run(nrows, seed, directory):
+    bench = Bench()
+    prices = txgen.StubPriceSource(seed)
+    restore = prices.install()
+    try:
+        with bench.time("generate", nrows):
+            rows = txgen.SyntheticHistory(seed=seed, prices=prices).generate(nrows)
+        txgen.write_pickles(rows, directory)
+        export_dir = os.path.join(directory, "exports")
+        export_lines = txgen.write_exports(rows, export_dir)
+        del rows
+
+        with chdir(directory):
+            with bench.time("ingest", nrows):
+                transactions = get_all_transactions()
+        n = len(transactions)
+        with bench.time("sort", n):
+            transactions = sorted(transactions)
+        with bench.time("normalize", n):
+            ents = entries(transactions)
+
+        calls = prices.calls
+        with bench.time("price lookup", n):
+            ops = priced_trades(ents)
+        bench.results["price lookup"]["calls"] = prices.calls - calls
+
+        for cls in COSTBASIS_CLASSES:
+            costbasis = txhistory.keydefaultdict(cls)
+            with quiet(), bench.time(f"costbasis {cls.__name__}", len(ops)):
+                for sym, amount, usd, date in ops:
+                    costbasis[sym].trade(amount, usd, date)
+
+        resolve_time = [0.0, 0]
+        do_resolve = txhistory.do_resolve
+
+        def timed_resolve(*args):
+            start = perf_counter()
+            try:
+                return do_resolve(*args)
+            finally:
+                resolve_time[0] += perf_counter() - start
+                resolve_time[1] += 1
+
+        txhistory.do_resolve = timed_resolve
+        try:
+            for cls in REPLAY_CLASSES:
+                resolve_time[:] = [0.0, 0]
+                with chdir(directory), quiet(), bench.time(f"match_trades {cls.__name__}", n):
+                    txhistory.match_trades(costbasis_class=cls)
+                name = f"do_resolve {cls.__name__}"
+                bench.results[name] = {"seconds": resolve_time[0], "items": resolve_time[1]}
+                print(f"{name:<32} {resolve_time[0]:10.3f}s {resolve_time[1]:12d} calls", file=sys.stderr)
+        finally:
+            txhistory.do_resolve = do_resolve
+
+        # the staged replay's matching phase, one process per exchange
+        for workers in [1, len(exchanges.SOURCES)]:
+            with chdir(directory), bench.time(f"match_exchanges {workers} workers", n):
+                txhistory.match_exchanges(transactions, transactions[0][0], workers=workers)
+
+        with bench.time("export import", export_lines):
+            for src in exchanges.EXPORTS:
+                exchanges.export_transactions(src, export_dir)
+
+        fill_scaling(bench, [nrows // 10, nrows], seed)
+    finally:
+        restore()
+    return bench.results
+
+
+def per_item(r):
+    return r["seconds"] / r["items"] if r.get("items") else r["seconds"]
+
+
+def compare(results, baseline):
+    """ratio of time per item against an earlier run"""
+    for name, r in results.items():
+        if name not in baseline or not per_item(baseline[name]):
+            continue
+        ratio = per_item(r) / per_item(baseline[name])
+        flag = " REGRESSION" if ratio > 1.2 else ""
+        print(f"{name:<32} {ratio:6.2f}x{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time each stage of the ledger pipeline on synthetic data")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dir", help="where to write the synthetic pickles (default: a temp dir)")
+    parser.add_argument("--json", help="write the timings to this file")
+    parser.add_argument("--compare", help="timings json from an earlier run to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args.rows, args.seed, args.dir or tmp)
+    report = {"rows": args.rows, "seed": args.seed, "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
@@ -4,7 +4,14 @@ import dateutil.parser
 from datetime import datetime
 from datetime import timedelta
 from time import sleep
+from time import monotonic
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import json
 import os.path
+import re
+import sys
 import dateutil.tz
 import pickle
 import apikeys
@@ -15,6 +22,15 @@ from binance.exceptions import BinanceAPIException
 import gdax
 import coinbase.wallet.client as coinbase_client
 from decimal import Decimal
+import stats
+import pricestore
+import txstore
+
+LOCAL_TZ = dateutil.tz.tzlocal()
+# bithumb writes amounts like 1,234,567KRW or 0.5 BTC
+NOT_NUMBER = re.compile(r"[^0-9.]")
+UNQUOTE = str.maketrans("", "", '"')
+BITTREX_DATE = "%m/%d/%Y %I:%M:%S %p"
 
 
 def dp(d):
@@ -27,15 +43,28 @@ def dp(d):
 
 
 def bithumb_dp(d):
-    return addtz(datetime.strptime(d, "%Y-%m-%d%H:%M:%S"))
+    # 2018-01-0212:34:56, the date and time run together
+    return datetime.fromisoformat(f"{d[:10]} {d[10:]}").replace(tzinfo=LOCAL_TZ)
+
+
+def bittrex_dp(d):
+    try:
+        return datetime.strptime(d.strip(), BITTREX_DATE).replace(tzinfo=LOCAL_TZ)
+    except ValueError:
+        return dp(d)
 
 
 def addtz(x):
     if not x.tzinfo:
-        return x.replace(tzinfo=dateutil.tz.tz.tzlocal())
+        return x.replace(tzinfo=LOCAL_TZ)
     return x
 
 
+def number(s):
+    """Decimal of a formatted amount, ignoring separators and units"""
+    return Decimal(NOT_NUMBER.sub("", s))
+
+
 def binance_sym(sym):
     syms = {"BCH": "BCC"}
     if sym in syms.keys():
@@ -88,75 +117,305 @@ def normalize_txtype(txtype):
         raise ValueError(f"no such txtype {txtype}")
 
 
-def get_all_transactions():
+def order_id(t):
+    """the id an exchange gives all legs of one order, None for exchanges
+    whose rows don't carry one"""
+    if len(t) < 6:
+        return None
+    extra = t[5]
+    if t[1] == "gdax" and isinstance(extra, dict):
+        return extra.get("order_id")
+    if t[1] == "coinbase" and isinstance(extra, dict):
+        return extra.get("id")
+    if t[1] == "bittrex" and isinstance(extra, list) and extra:
+        return extra[0]
+    return None
+
+
+SOURCES = ["gdax", "coinbase", "binance", "kraken", "bittrex", "bithumb", "other"]
+# exchange names a source's rows can carry besides its own, None for any
+SOURCE_EXCHANGES = {"coinbase": ["coinbase", "bofa"], "other": None}
+
+
+def source_files(source, directory="."):
+    """the local files get_all_transactions builds source's rows from,
+    None when it would have to call the exchange"""
+    path = os.path.join(directory, f"{source}.pickle")
+    if os.path.exists(path):
+        return [path]
+    files = {
+        "bithumb": ["bithumb.txt", "bithumb.tx.idx"],
+        "bittrex": ["bittrex.txt", "bittrex.tx.idx", "bittrex_transfers.pickle"],
+        "other": ["othertx.txt"],
+    }.get(source)
+    if files and all(os.path.exists(os.path.join(directory, f)) for f in files):
+        return [os.path.join(directory, f) for f in files]
+    return None
+
+
+def sources_for(exchanges, sources=SOURCES):
+    """the sources that can hold rows of any of exchanges"""
+    keep = []
+    for src in sources:
+        names = SOURCE_EXCHANGES.get(src, [src])
+        if names is None or set(names) & set(exchanges):
+            keep.append(src)
+    return keep
+
+
+def get_all_transactions(directory=".", sources=SOURCES):
     transactions = []
-    exchs = ["gdax", "coinbase", "binance", "kraken", "bittrex", "bithumb", "other"]
-    for ex in exchs:
-        if os.path.exists(f"{ex}.pickle"):
+    for ex in sources:
+        path = os.path.join(directory, f"{ex}.pickle")
+        if os.path.exists(path):
             # print(f'unpickling {ex}')
-            with open(f"{ex}.pickle", "rb") as f:
+            with stats.timer("pickle_io", f"{ex}.pickle"), open(path, "rb") as f:
                 t = pickle.load(f)
+        elif ex in EXPORTS and os.path.exists(os.path.join(directory, EXPORTS[ex][0])):
+            # the transaction store is the cache of exports
+            t = get_transactions(ex, directory=directory)
         else:
             # print(f'loading {ex}')
-            t = get_transactions(ex)
-            with open(f"{ex}.pickle", "wb") as f:
+            if pricestore.offline:
+                raise FileNotFoundError(f"{path} missing and running offline")
+            with stats.timer("api_time", ex):
+                t = get_transactions(ex, directory=directory)
+            with stats.timer("pickle_io", f"{ex}.pickle"), open(path, "wb") as f:
                 pickle.dump(t, f)
         transactions += t
     return transactions
 
 
+class RateLimiter(object):
+    """token bucket shared by every thread calling one exchange,
+    allows bursts of burst calls and rate calls per second after that"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            sleep(delay)
+        return delay
+
+
+# public market data limits are 3/s on gdax and 1200 weight/min on
+# binance, the binance account endpoints weigh 5. a kraken ledger query
+# adds 2 to a call counter capped at 15 that decays 0.33/s, coinbase
+# allows 10,000 calls an hour per key
+rate_limits = {
+    "gdax": RateLimiter(3, burst=6),
+    "binance": RateLimiter(4, burst=10),
+    "kraken": RateLimiter(0.33 / 2, burst=7),
+    "coinbase": RateLimiter(10000 / 3600, burst=10),
+}
+
+
+def api_wait(exchange):
+    """block until exchange's rate limit allows another call"""
+    delay = rate_limits[exchange].wait()
+    if stats.enabled:
+        stats.add_time("api_wait", exchange, delay)
+
+
+class SingleFlight(object):
+    """one call per key at a time, a caller asking for a key that is
+    already in flight waits for that call's result instead of repeating it"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, f):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event()}
+        if not leader:
+            if stats.enabled:
+                stats.incr("price_coalesced", f"{key[0]} {key[1]}")
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = f()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+
+price_flights = SingleFlight()
+
+
+class PagedHistory(object):
+    """an api history fetched a page at a time, newest first, into a
+    TxStore. the store's index also records how far each stream's pages
+    got, so an interrupted fetch picks up where it stopped
+
+    a stream's first fetch goes back to its oldest entry, later ones stop
+    at the newest entry the last complete fetch saw. entries already in
+    the store, seen again when new ones shift the pages, are skipped
+    """
+
+    def __init__(self, path, entry_id):
+        self.store = txstore.TxStore(path)
+        self.state = self.store.index["source"] or {}
+        self.seen = {entry_id(t) for t in self.store.rows()}
+        self.lock = threading.Lock()
+
+    def follow(self, stream, fetch_page, rows_of):
+        """fetch_page(cursor) returns ([(id, entry)] newest first, cursor of
+        the next page or None after the last), the first page's cursor is
+        None. rows_of(id, entry) are the rows stored for an entry"""
+        with self.lock:
+            state = self.state.setdefault(stream, {"known": None, "cursor": None, "top": None})
+        while True:
+            entries, following = fetch_page(state["cursor"])
+            with self.lock:
+                if state["top"] is None and entries:
+                    state["top"] = entries[0][0]
+                done = following is None
+                rows = []
+                for entry_id, entry in entries:
+                    if entry_id == state["known"]:
+                        done = True
+                        break
+                    if entry_id not in self.seen:
+                        self.seen.add(entry_id)
+                        rows += rows_of(entry_id, entry)
+                if done:
+                    state.update(known=state["top"] or state["known"], cursor=None, top=None)
+                else:
+                    state["cursor"] = following
+                self.store.append(rows, source=self.state)
+            if done:
+                return
+
+    def rows(self):
+        return self.store.rows()
+
+
+def stored_price(source, market, bucket):
+    """price from the candle store, None if it isn't there"""
+    amt = pricestore.default_store().get(source, market, bucket)
+    if stats.enabled:
+        if amt is not None:
+            stats.incr("price_cache_hit", f"{source} {market}")
+        else:
+            stats.incr("price_cache_miss", f"{source} {market}")
+    return amt
+
+
+def cached_price(source, market, ts, fetch):
+    """price of market in the 1 minute candle containing ts, fetch(start)
+    is called with the candle's start time when no cache has it, at most
+    once at a time per candle"""
+    bucket = pricestore.minute(ts)
+    amt = stored_price(source, market, bucket)
+    if amt is not None:
+        return amt
+    if pricestore.misses is not None:
+        return pricestore.record_miss(source, market, ts)
+    if pricestore.offline:
+        raise pricestore.PriceMiss(source, market, ts)
+
+    def fetch_and_store():
+        # a flight that just finished may have stored it
+        amt = pricestore.default_store().get(source, market, bucket)
+        if amt is not None:
+            return amt
+        if stats.enabled:
+            stats.incr("api_calls", source)
+        amt = fetch(datetime.fromtimestamp(bucket * 60, ts.tzinfo or dateutil.tz.tzutc()))
+        with stats.timer("store_io", source):
+            pricestore.default_store().put(source, market, bucket, amt)
+        return amt
+
+    return price_flights.do((source, market, bucket), fetch_and_store)
+
+
+def fetch_misses(store, misses, max_workers=8):
+    """fetch every missing price once, concurrently, and add it to the store"""
+
+    def fetch(key):
+        source, market, ts = key
+        try:
+            return key, fetch_price(source, market, ts), None
+        except Exception as e:
+            return key, None, e
+
+    failed = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for (source, market, ts), price, error in pool.map(fetch, sorted(misses, key=str)):
+            if error is not None:
+                failed[source, market, ts] = error
+            else:
+                store.put(source, market, pricestore.minute(ts), price)
+    return failed
+
+
+def gdax_candle(data, start):
+    """the low of the candle starting at start, gdax returns every candle
+    overlapping the requested range, newest first, and skips minutes
+    without trades"""
+    t = int(start.timestamp())
+    for candle in data:
+        if candle[0] == t:
+            return Decimal(candle[1])
+    # no trades that minute, use the nearest candle
+    return Decimal(min(data, key=lambda candle: abs(candle[0] - t))[1])
+
+
 def gdax_price(market, ts):
-    if os.path.exists("gdax_price.pickle"):
-        with open("gdax_price.pickle", "rb") as f:
-            p = pickle.load(f)
-    else:
-        p = {}
-    if (market, ts) in p:
-        amt = p[market, ts]
-    else:
+    def fetch(start):
         c = gdax.AuthenticatedClient(
             apikeys.gdax["apiKey"], apikeys.gdax["secret"], apikeys.gdax["password"]
         )
-        data = c.get_product_historic_rates(
-            market, start=ts.isoformat(), end=(ts + timedelta(minutes=1)).isoformat()
-        )
-        sleep(0.5)
-        try:
-            amt = Decimal(data[0][1])
-        except IndexError:
-            print(market, ts, data)
-            raise
-        with open("gdax_price.pickle", "wb") as f:
-            p[market, ts] = amt
-            pickle.dump(p, f)
+        api_wait("gdax")
+        with stats.timer("api_time", "gdax"):
+            data = c.get_product_historic_rates(
+                market, start=start.isoformat(), end=(start + timedelta(minutes=1)).isoformat(), granularity=60
+            )
+        if not data or not isinstance(data, list):
+            raise LookupError(f"no gdax candles for {market} at {start}: {data}")
+        return gdax_candle(data, start)
+
+    amt = cached_price("gdax", market, ts, fetch)
     # print(f"gdax price {market} {amt:0.2f}")
     return amt
 
 
 def binance_price(market, ts):
-    if os.path.exists("binance_price.pickle"):
-        with open("binance_price.pickle", "rb") as f:
-            p = pickle.load(f)
-    else:
-        p = {}
-    if (market, ts) in p:
-        amt = p[market, ts]
-    else:
+    def fetch(start):
         c = binance.client.Client(apikeys.binance["apiKey"], apikeys.binance["secret"])
-        st = ts.replace(second=0, microsecond=0)
-        et = st + timedelta(minutes=1)
-        sleep(0.5)
-        data = c.get_klines(
-            symbol=market,
-            interval="1m",
-            startTime=int(st.timestamp()) * 1000,
-            endTime=int(et.timestamp()) * 1000,
-        )
-        amt = Decimal(data[0][3])
-        with open("binance_price.pickle", "wb") as f:
-            p[market, ts] = amt
-            pickle.dump(p, f)
+        api_wait("binance")
+        with stats.timer("api_time", "binance"):
+            data = c.get_klines(
+                symbol=market,
+                interval="1m",
+                startTime=int(start.timestamp()) * 1000,
+                endTime=int((start + timedelta(minutes=1)).timestamp()) * 1000,
+            )
+        return Decimal(data[0][3])
 
+    amt = cached_price("binance", market, ts, fetch)
     # print(f"binance price {market} {amt:3g}")
     return amt
 
@@ -202,126 +461,284 @@ def get_usd_for_pair(a, b, ts):
     raise ValueError(f"can't get exchange rate for {a} {b} {ts}")
 
 
-def get_current_usd(a, ts=None):
-    if not ts:
-        ts = datetime.now().replace(
-            minute=0, second=0, microsecond=0, tzinfo=dateutil.tz.tz.tzlocal()
-        )
-    if a.sym in ["USD", "USDT"]:
-        return 1
-    if a.sym in ["KRW"]:
-        return 1 / 1165
-    elif a.sym in ["BTC", "LTC", "ETH"]:
-        return gdax_price(f"{a.sym}-USD", ts)
-    elif a.sym == "BCH" and ts > datetime(
+UsdPrice = namedtuple("UsdPrice", ["sym", "price", "error"])
+
+
+def current_ts():
+    return datetime.now().replace(
+        minute=0, second=0, microsecond=0, tzinfo=dateutil.tz.tz.tzlocal()
+    )
+
+
+def usd_legs(sym, ts):
+    """how get_current_usd prices 1 sym at ts: either a constant, or the
+    list of (source, market) prices to multiply together"""
+    if sym in ["USD", "USDT"]:
+        return 1, []
+    if sym in ["KRW"]:
+        return 1 / 1165, []
+    elif sym in ["BTC", "LTC", "ETH"]:
+        return None, [("gdax", f"{sym}-USD")]
+    elif sym == "BCH" and ts > datetime(
         year=2018, month=1, day=25, tzinfo=dateutil.tz.tz.tzlocal()
     ):
-        return gdax_price(f"{a.sym}-USD", ts)
+        return None, [("gdax", f"{sym}-USD")]
     else:
+        return None, [("binance", f"{binance_sym(sym)}BTC"), ("gdax", "BTC-USD")]
+
+
+def fetch_price(source, market, ts):
+    if source == "gdax":
+        return gdax_price(market, ts)
+    elif source == "binance":
+        return binance_price(market, ts)
+    raise ValueError(f"no such price source {source}")
+
+
+def get_current_usd(a, ts=None):
+    if not ts:
+        ts = current_ts()
+    const, legs = usd_legs(a.sym, ts)
+    if const is not None:
+        return const
+    usd_price = 1
+    for source, market in legs:
         try:
-            btc_price = binance_price(f"{binance_sym(a.sym)}BTC", ts)
+            usd_price *= fetch_price(source, market, ts)
         except (TypeError, BinanceAPIException):
+            if source != "binance":
+                raise
             print(f"ERROR can't get price for {a.sym}")
             return 0
-        btcusd_price = gdax_price(f"BTC-USD", ts)
-        usd_price = btc_price * btcusd_price
-        return usd_price
+    return usd_price
+
 
+def get_current_usd_many(symbols, ts=None, max_workers=8):
+    """USD price of each symbol at ts like get_current_usd, but every
+    distinct market (BTC-USD for all the altcoins) is fetched once and the
+    fetches run concurrently within the exchanges' rate limits.
+    returns {sym: UsdPrice}, a failed lookup has price None and the error
+    """
+    if not ts:
+        ts = current_ts()
+    plans = {sym: usd_legs(sym, ts) for sym in symbols}
+    legs = sorted(set(leg for const, ls in plans.values() for leg in ls))
 
-def other_transactions():
+    def fetch(leg):
+        try:
+            return fetch_price(leg[0], leg[1], ts), None
+        except Exception as e:
+            return None, f"{leg[0]} {leg[1]}: {type(e).__name__}: {e}"
+
+    fetched = {}
+    if legs:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(legs))) as pool:
+            fetched = dict(zip(legs, pool.map(fetch, legs)))
+
+    prices = {}
+    for sym, (const, ls) in plans.items():
+        if const is not None:
+            prices[sym] = UsdPrice(sym, const, None)
+            continue
+        usd_price = 1
+        error = None
+        for leg in ls:
+            price, error = fetched[leg]
+            if error:
+                usd_price = None
+                break
+            usd_price *= price
+        prices[sym] = UsdPrice(sym, usd_price, error)
+    return prices
+
+
+def other_rows(line):
+    date, txtype, exchange, amount, sym = line.rstrip().split(",")
+    ts = dp(date)
+    return [[ts, exchange, txtype, sym, Decimal(amount)]]
+
+
+def other_transactions(directory="."):
     transactions = []
-    with open("othertx.txt", encoding="utf-8") as f:
+    with open(os.path.join(directory, "othertx.txt"), encoding="utf-8") as f:
         for line in f:
-            date, txtype, exchange, amount, sym = line.rstrip().split(",")
-            ts = dp(date)
-            transactions.append([ts, exchange, txtype, sym, Decimal(amount)])
+            transactions += other_rows(line)
     return transactions
 
 
-def kraken_transactions():
-    transactions = []
-    apiclient = krakenex.API(
-        key=apikeys.kraken["apiKey"], secret=apikeys.kraken["secret"]
-    )
-    ledgers = apiclient.query_private("Ledgers")
-    for ledgerid, ledger in ledgers["result"]["ledger"].items():
-        # print(ledger)
-        ts = addtz(datetime.fromtimestamp(ledger["time"]))
+def kraken_rows(ledgerid, ledger):
+    ts = addtz(datetime.fromtimestamp(ledger["time"]))
+    transactions = [
+        [ts, "kraken", ledger["type"], ledger["asset"], Decimal(ledger["amount"]), ledgerid]
+    ]
+    if Decimal(ledger["fee"]) > 0.0:
         transactions.append(
-            [ts, "kraken", ledger["type"], ledger["asset"], Decimal(ledger["amount"])]
+            [ts, "kraken", "fee", ledger["asset"], -Decimal(ledger["fee"]), ledgerid]
         )
-        if Decimal(ledger["fee"]) > 0.0:
-            transactions.append(
-                [ts, "kraken", "fee", ledger["asset"], -Decimal(ledger["fee"])]
-            )
+    return transactions
+
 
+def kraken_transactions(directory=".", apiclient=None):
+    """every ledger entry, paged by offset into kraken.tx. the pages are
+    fetched one after another, concurrent private calls would race on the
+    key's nonce"""
+    if apiclient is None:
+        apiclient = krakenex.API(
+            key=apikeys.kraken["apiKey"], secret=apikeys.kraken["secret"]
+        )
+    history = PagedHistory(os.path.join(directory, "kraken.tx"), lambda t: t[5])
+
+    def fetch_page(ofs):
+        ofs = ofs or 0
+        api_wait("kraken")
+        ledgers = apiclient.query_private("Ledgers", {"ofs": ofs})
+        if ledgers.get("error"):
+            raise LookupError(f"kraken Ledgers at offset {ofs}: {ledgers['error']}")
+        result = ledgers["result"]
+        entries = sorted(result["ledger"].items(), key=lambda e: e[1]["time"], reverse=True)
+        ofs += len(entries)
+        return entries, ofs if entries and ofs < int(result["count"]) else None
+
+    history.follow("ledgers", fetch_page, kraken_rows)
+    return history.rows()
+
+
+def parse_lines(rec_rows, lines, lineno=1, errors=None):
+    """rows of a block of export lines, the first of them line lineno.
+    blank lines are skipped, a malformed line is appended to errors as
+    (line number, line, reason), or raises ValueError without errors"""
+    transactions = []
+    for i, line in enumerate(lines, lineno):
+        if not line.strip():
+            continue
+        if '"' in line:
+            line = line.translate(UNQUOTE)
+        try:
+            transactions += rec_rows(line.split("\t"))
+        except (ValueError, IndexError, ArithmeticError) as e:
+            if errors is None:
+                raise ValueError(f"line {i}: {e}") from e
+            errors.append((i, line, f"{type(e).__name__}: {e}"))
     return transactions
 
 
-def bithumb_transactions():
+def bithumb_rec_rows(rec):
     transactions = []
-    with open("bithumb.txt", encoding="utf-8") as f:
-        f.readline().split("\t")
-        for line in f:
-            rec = line.replace('"', "").split("\t")
-            ts = bithumb_dp(rec[0])
-            sym = rec[1]
-            order = rec[2]
-            qty_coin = Decimal("".join([c for c in rec[3] if c.isdigit() or c == "."]))
-            settlement = Decimal(
-                "".join([c for c in rec[7] if c.isdigit() or c == "."])
-            )
-            if rec[6] == "-":
-                fee = Decimal(0)
-                fee_sym = "KRW"
-            else:
-                fee = Decimal("".join([c for c in rec[6] if c.isdigit() or c == "."]))
-                fee_sym = rec[6][-3:]
-
-            # still need to check that all of the transaction directions go the right way
-            if "BUY" in order:
-                transactions.append([ts, "bithumb", order, sym, qty_coin, rec])
-                transactions.append([ts, "bithumb", order, "KRW", -settlement, rec])
-                #transactions.append([ts, "bithumb", "fee", fee_sym, -fee, rec])
-            elif "SELL" in order:
-                transactions.append([ts, "bithumb", order, sym, -qty_coin, rec])
-                transactions.append([ts, "bithumb", order, "KRW", settlement, rec])
-                #transactions.append([ts, "bithumb", "fee", fee_sym, -fee, rec])
-            elif "DEPOSIT" in order:
-                transactions.append([ts, "bithumb", "deposit", sym, qty_coin, rec])
-                transactions.append([ts, "bithumb", "fee", fee_sym, -fee, rec])
-            elif "WITHDRAWAL" in order:
-                transactions.append([ts, "bithumb", "withdrawal", sym, -qty_coin, rec])
-                transactions.append([ts, "bithumb", "fee", fee_sym, -fee, rec])
-            else:
-                print(f"unknown order type {rec}")
+    ts = bithumb_dp(rec[0])
+    sym = rec[1]
+    order = rec[2]
+    qty_coin = number(rec[3])
+    settlement = number(rec[7])
+    if rec[6] == "-":
+        fee = Decimal(0)
+        fee_sym = "KRW"
+    else:
+        fee = number(rec[6])
+        fee_sym = rec[6][-3:]
+
+    # still need to check that all of the transaction directions go the right way
+    if "BUY" in order:
+        transactions.append([ts, "bithumb", order, sym, qty_coin, rec])
+        transactions.append([ts, "bithumb", order, "KRW", -settlement, rec])
+        #transactions.append([ts, "bithumb", "fee", fee_sym, -fee, rec])
+    elif "SELL" in order:
+        transactions.append([ts, "bithumb", order, sym, -qty_coin, rec])
+        transactions.append([ts, "bithumb", order, "KRW", settlement, rec])
+        #transactions.append([ts, "bithumb", "fee", fee_sym, -fee, rec])
+    elif "DEPOSIT" in order:
+        transactions.append([ts, "bithumb", "deposit", sym, qty_coin, rec])
+        transactions.append([ts, "bithumb", "fee", fee_sym, -fee, rec])
+    elif "WITHDRAWAL" in order:
+        transactions.append([ts, "bithumb", "withdrawal", sym, -qty_coin, rec])
+        transactions.append([ts, "bithumb", "fee", fee_sym, -fee, rec])
+    else:
+        raise ValueError(f"unknown order type {order}")
     return transactions
 
 
-def bittrex_transactions():
+def bithumb_chunk(lines, lineno=1, errors=None):
+    return parse_lines(bithumb_rec_rows, lines, lineno, errors)
+
+
+def bithumb_rows(line):
+    return bithumb_chunk([line])
+
+
+def bithumb_transactions(directory="."):
+    return export_transactions("bithumb", directory)
+
+
+def bittrex_rec_rows(rec):
+    transactions = []
+    # uuid = rec[0]
+    base, quote = rec[1].split("-")
+    order = rec[2]
+    qty = Decimal(rec[3])
+    # limit = Decimal(rec[4])
+    commission = Decimal(rec[5])
+    price = Decimal(rec[6])
+    ts = bittrex_dp(rec[8])
+    if "BUY" in order:
+        transactions.append([ts, "bittrex", order, base, -price, rec])
+        transactions.append([ts, "bittrex", "fee", base, -commission, rec])
+        transactions.append([ts, "bittrex", order, quote, qty, rec])
+    elif "SELL" in order:
+        transactions.append([ts, "bittrex", order, base, price, rec])
+        transactions.append([ts, "bittrex", "fee", base, -commission, rec])
+        transactions.append([ts, "bittrex", order, quote, -qty, rec])
+    else:
+        raise ValueError(f"unknown order type {order}")
+    return transactions
+
+
+def bittrex_chunk(lines, lineno=1, errors=None):
+    return parse_lines(bittrex_rec_rows, lines, lineno, errors)
+
+
+def bittrex_rows(line):
+    return bittrex_chunk([line])
+
+
+def bittrex_transactions(directory="."):
+    path = os.path.join(directory, "bittrex_transfers.pickle")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            transfers = pickle.load(f)
+    else:
+        if pricestore.offline:
+            raise FileNotFoundError(f"{path} missing and running offline")
+        transfers = bittrex_transfers()
+        with open(path, "wb") as f:
+            pickle.dump(transfers, f)
+    return export_transactions("bittrex", directory) + transfers
+
+
+# tsv exports, (file name, chunk parser), the first line is a header
+EXPORTS = {
+    "bithumb": ("bithumb.txt", bithumb_chunk),
+    "bittrex": ("bittrex.txt", bittrex_chunk),
+}
+
+
+def export_transactions(source, directory="."):
+    """rows of source's export, imported into {source}.tx as far as the
+    export has grown since the last time"""
+    name, parse_chunk = EXPORTS[source]
+    path = os.path.join(directory, name)
+    store = txstore.TxStore(os.path.join(directory, f"{source}.tx"))
+    errors = []
+    with stats.timer("export_import", source):
+        txstore.import_export(store, path, parse_chunk, header=True, errors=errors)
+    if errors:
+        print(f"{path}: skipped {len(errors)} malformed rows", file=sys.stderr)
+        txstore.report_errors(path, errors)
+    with stats.timer("pickle_io", f"{source}.tx"):
+        return store.rows()
+
+
+def bittrex_transfers():
+    """deposits and withdrawals, the trades only come from the export"""
     transactions = []
-    with open("bittrex.txt", encoding="utf-8") as f:
-        f.readline().split("\t")
-        for line in f:
-            rec = line.split("\t")
-            # uuid = rec[0]
-            base, quote = rec[1].split("-")
-            order = rec[2]
-            qty = Decimal(rec[3])
-            # limit = Decimal(rec[4])
-            commission = Decimal(rec[5])
-            price = Decimal(rec[6])
-            ts = dp(rec[8])
-            if "BUY" in order:
-                transactions.append([ts, "bittrex", order, base, -price, rec])
-                transactions.append([ts, "bittrex", "fee", base, -commission, rec])
-                transactions.append([ts, "bittrex", order, quote, qty, rec])
-            elif "SELL" in order:
-                transactions.append([ts, "bittrex", order, base, price, rec])
-                transactions.append([ts, "bittrex", "fee", base, -commission, rec])
-                transactions.append([ts, "bittrex", order, quote, -qty, rec])
-            else:
-                print(f"unknown order type {rec}")
     apiclient = bittrex.Bittrex(apikeys.bittrex["apiKey"], apikeys.bittrex["secret"])
     dh = apiclient.get_deposit_history()
     wh = apiclient.get_withdrawal_history()
@@ -367,7 +784,7 @@ def binance_transactions():
     for p in pr["data"]:
         if p["baseAsset"] in assets or p["quoteAsset"] in assets:
             for tx in apiclient.get_my_trades(symbol=p["symbol"]):
-                sleep(0.25)
+                api_wait("binance")
                 if p["baseAsset"] not in assets:
                     new_assets.add(p["baseAsset"])
                 if p["quoteAsset"] not in assets:
@@ -447,110 +864,149 @@ def gdax_transactions():
     return transactions
 
 
-def coinbase_transactions():
+def coinbase_rows(txid, tx):
     transactions = []
-    apiclient = coinbase_client.Client(
-        apikeys.coinbase["apiKey"], apikeys.coinbase["secret"]
-    )
-    c = apiclient
-    for a in c.get_accounts()["data"]:
-        for tx in c.get_transactions(a["id"])["data"]:
-            created = dp(tx["created_at"])
-            if tx["type"] in ["fiat_deposit", "fiat_withdrawal"]:
-                transactions.append(
-                    [
-                        created,
-                        "coinbase",
-                        tx["type"],
-                        tx["native_amount"]["currency"],
-                        Decimal(tx["native_amount"]["amount"]),
-                        tx,
-                    ]
-                )
-                transactions.append(
-                    [
-                        created,
-                        "bofa",
-                        tx["type"],
-                        tx["native_amount"]["currency"],
-                        -Decimal(tx["native_amount"]["amount"]),
-                        tx,
-                    ]
-                )
-            elif (
-                tx["type"] == "buy"
-                and "Bank of" in tx["details"]["payment_method_name"]
-            ):
-                # for a credit card payment, create 2 ledger entries transferring usd from the bank
-                transactions.append(
-                    [
-                        created,
-                        "bofa",
-                        "fiat_deposit",
-                        tx["native_amount"]["currency"],
-                        -Decimal(tx["native_amount"]["amount"]),
-                        tx,
-                    ]
-                )
-                transactions.append(
-                    [
-                        created,
-                        "coinbase",
-                        "fiat_deposit",
-                        tx["native_amount"]["currency"],
-                        Decimal(tx["native_amount"]["amount"]),
-                        tx,
-                    ]
-                )
-                # now debit the USD from the coinbase account as a buy
-                transactions.append(
-                    [
-                        created,
-                        "coinbase",
-                        tx["type"],
-                        tx["native_amount"]["currency"],
-                        -Decimal(tx["native_amount"]["amount"]),
-                        tx,
-                    ]
-                )
-                # and credit the cryptocurrency bought as a buy
-                transactions.append(
-                    [
-                        created,
-                        "coinbase",
-                        tx["type"],
-                        tx["amount"]["currency"],
-                        Decimal(tx["amount"]["amount"]),
-                        tx,
-                    ]
-                )
-            else:
-                transactions.append(
-                    [
-                        created,
-                        "coinbase",
-                        tx["type"],
-                        tx["amount"]["currency"],
-                        Decimal(tx["amount"]["amount"]),
-                        tx,
-                    ]
-                )
-
+    created = dp(tx["created_at"])
+    if tx["type"] in ["fiat_deposit", "fiat_withdrawal"]:
+        transactions.append(
+            [
+                created,
+                "coinbase",
+                tx["type"],
+                tx["native_amount"]["currency"],
+                Decimal(tx["native_amount"]["amount"]),
+                tx,
+            ]
+        )
+        transactions.append(
+            [
+                created,
+                "bofa",
+                tx["type"],
+                tx["native_amount"]["currency"],
+                -Decimal(tx["native_amount"]["amount"]),
+                tx,
+            ]
+        )
+    elif (
+        tx["type"] == "buy"
+        and "Bank of" in tx["details"]["payment_method_name"]
+    ):
+        # for a credit card payment, create 2 ledger entries transferring usd from the bank
+        transactions.append(
+            [
+                created,
+                "bofa",
+                "fiat_deposit",
+                tx["native_amount"]["currency"],
+                -Decimal(tx["native_amount"]["amount"]),
+                tx,
+            ]
+        )
+        transactions.append(
+            [
+                created,
+                "coinbase",
+                "fiat_deposit",
+                tx["native_amount"]["currency"],
+                Decimal(tx["native_amount"]["amount"]),
+                tx,
+            ]
+        )
+        # now debit the USD from the coinbase account as a buy
+        transactions.append(
+            [
+                created,
+                "coinbase",
+                tx["type"],
+                tx["native_amount"]["currency"],
+                -Decimal(tx["native_amount"]["amount"]),
+                tx,
+            ]
+        )
+        # and credit the cryptocurrency bought as a buy
+        transactions.append(
+            [
+                created,
+                "coinbase",
+                tx["type"],
+                tx["amount"]["currency"],
+                Decimal(tx["amount"]["amount"]),
+                tx,
+            ]
+        )
+    else:
+        transactions.append(
+            [
+                created,
+                "coinbase",
+                tx["type"],
+                tx["amount"]["currency"],
+                Decimal(tx["amount"]["amount"]),
+                tx,
+            ]
+        )
     return transactions
 
 
-def get_transactions(exchange):
+def coinbase_pages(get):
+    """a fetch_page for PagedHistory over a coinbase list endpoint, items
+    come back as plain dicts"""
+
+    def fetch_page(after):
+        api_wait("coinbase")
+        page = get(limit=100, starting_after=after)
+        items = [json.loads(json.dumps(item)) for item in page["data"]]
+        more = items and page.pagination and page.pagination.get("next_uri")
+        return [(item["id"], item) for item in items], items[-1]["id"] if more else None
+
+    return fetch_page
+
+
+def coinbase_accounts(apiclient):
+    accounts = []
+    fetch_page = coinbase_pages(apiclient.get_accounts)
+    after = None
+    while True:
+        page, after = fetch_page(after)
+        accounts += [account for account_id, account in page]
+        if after is None:
+            return accounts
+
+
+def coinbase_transactions(directory=".", apiclient=None, max_workers=4):
+    """every transaction of every account, paged by cursor into
+    coinbase.tx with the accounts fetched concurrently"""
+    if apiclient is None:
+        apiclient = coinbase_client.Client(
+            apikeys.coinbase["apiKey"], apikeys.coinbase["secret"]
+        )
+    history = PagedHistory(os.path.join(directory, "coinbase.tx"), lambda t: t[5]["id"])
+
+    def fetch(account):
+        def get(**params):
+            return apiclient.get_transactions(account["id"], **params)
+
+        history.follow(account["id"], coinbase_pages(get), coinbase_rows)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # list() so a failed account raises here
+        list(pool.map(fetch, coinbase_accounts(apiclient)))
+    return history.rows()
+
+
+def get_transactions(exchange, directory="."):
     if exchange == "gdax":
         return gdax_transactions()
     elif exchange == "coinbase":
-        return coinbase_transactions()
+        return coinbase_transactions(directory)
     elif exchange == "binance":
         return binance_transactions()
     elif exchange == "kraken":
-        return kraken_transactions()
+        return kraken_transactions(directory)
     elif exchange == "bittrex":
-        return bittrex_transactions()
+        return bittrex_transactions(directory)
     elif exchange == "bithumb":
-        return bithumb_transactions()
+        return bithumb_transactions(directory)
     elif exchange == "other":
-        return other_transactions()
+        return other_transactions(directory)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import queue
+import sys
+import threading
+import zipfile
+from time import perf_counter
+import pricestore
+
+BLOCK_SIZE = 1 << 22
+
+# which column of each dump format holds the price we cache, both live
+# fetchers use the candle low
+FORMATS = {
+    # open_time(ms or us), open, high, low, close, volume, close_time, ...
+    "binance": {"time": 0, "price": 3},
+    # time(s), low, high, open, close, volume as returned by get_product_historic_rates
+    "gdax": {"time": 0, "price": 1},
+}
+
+
+def parse_name(path):
+    """market and interval from a Binance dump name like XRPBTC-1m-2018-01.zip"""
+    name = os.path.basename(path).split(".")[0]
+    parts = name.split("-")
+    if len(parts) >= 2 and parts[1][-1:] in "smhdwM" and parts[1][:-1].isdigit():
+        return parts[0], parts[1]
+    return None, None
+
+
+def open_binary(path):
+    """yield byte streams for a csv or for every csv inside a zip"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            for name in z.namelist():
+                if name.endswith(".csv"):
+                    with z.open(name) as f:
+                        yield f
+    else:
+        with open(path, "rb") as f:
+            yield f
+
+
+def read_candles(f, fmt="binance", block_size=BLOCK_SIZE, errors=None):
+    """yield lists of (minute, price) from a binary candle csv stream
+    the stream is read in blocks so memory stays bounded whatever the file
+    size, header rows are skipped and malformed rows are appended to errors
+    as (line number, line) when a list is given"""
+    col_time = FORMATS[fmt]["time"]
+    col_price = FORMATS[fmt]["price"]
+    width = max(col_time, col_price) + 1
+    div = None
+    lineno = 0
+    rest = ""
+    while True:
+        block = f.read(block_size)
+        if not block:
+            lines = [rest] if rest.strip() else []
+        else:
+            lines = (rest + block.decode("utf-8")).split("\n")
+            rest = lines.pop()
+        chunk = []
+        append = chunk.append
+        for line in lines:
+            lineno += 1
+            parts = line.split(",", width)
+            try:
+                t = int(parts[col_time])
+                price = parts[col_price].strip()
+            except (ValueError, IndexError):
+                if errors is not None and line.strip() and lineno > 1:
+                    errors.append((lineno, line))
+                continue
+            if div is None:
+                # epoch seconds, milliseconds or (newer dumps) microseconds
+                div = 60000000 if t > 10**14 else 60000 if t > 10**11 else 60
+            append((t // div, price))
+        if chunk:
+            yield chunk
+        if not block:
+            return
+
+
+def prefetch(it, depth=4):
+    """run a generator in a thread so parsing overlaps with the inserts,
+    at most depth items are buffered"""
+    q = queue.Queue(maxsize=depth)
+    done = object()
+
+    def worker():
+        try:
+            for item in it:
+                q.put(item)
+        except BaseException as e:
+            q.put(e)
+        q.put(done)
+
+    threading.Thread(target=worker, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def import_file(store, path, source="binance", market=None, fmt=None, errors=None):
+    """stream one dump into the store, returns the number of candles"""
+    fmt = fmt or source
+    name_market, interval = parse_name(path)
+    market = market or name_market
+    if not market:
+        raise ValueError(f"can't tell the market of {path}, pass one explicitly")
+    if interval and interval != "1m":
+        raise ValueError(f"{path} has {interval} candles, prices are cached per minute")
+    n = 0
+    for f in open_binary(path):
+        for chunk in prefetch(read_candles(f, fmt=fmt, errors=errors)):
+            store.put_many(source, market, chunk)
+            n += len(chunk)
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load historical candle dumps into the price store")
+    parser.add_argument("files", nargs="+", help="csv or zip candle dumps")
+    parser.add_argument("--db", default=os.environ.get("LEDGER_PRICE_DB", pricestore.DEFAULT_PATH))
+    parser.add_argument("--source", default="binance", choices=sorted(FORMATS), help="exchange the prices are looked up under")
+    parser.add_argument("--market", help="market name, e.g. BTC-USD, if the file name doesn't say")
+    parser.add_argument(
+        "--format",
+        choices=sorted(FORMATS),
+        help="column layout of the dump if it differs from --source, e.g. Binance BTCUSDT dumps as gdax BTC-USD",
+    )
+    args = parser.parse_args()
+
+    store = pricestore.PriceStore(args.db)
+    total = 0
+    start = perf_counter()
+    for path in args.files:
+        errors = []
+        n = import_file(store, path, source=args.source, market=args.market, fmt=args.format, errors=errors)
+        total += n
+        print(f"{path}: {n} candles")
+        for lineno, line in errors[:10]:
+            print(f"  {path}:{lineno}: malformed row {line.rstrip()!r}", file=sys.stderr)
+        if len(errors) > 10:
+            print(f"  {path}: {len(errors) - 10} more malformed rows", file=sys.stderr)
+    elapsed = perf_counter() - start
+    print(f"{total} candles in {elapsed:0.1f}s ({total / max(elapsed, 1e-9) * 60:0.0f}/min)")
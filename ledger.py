@@ -1,21 +1,33 @@
 #!/usr/bin/env python
 
+import decimal
+from bisect import bisect_left
+from bisect import insort
 from decimal import Decimal
+from datetime import date
 from datetime import timedelta
 from exchanges import get_usd_for_pair
 from itertools import permutations
 from exchanges import get_current_usd
-from collections import deque
+
+# traps the additions that would round, merging two lots is only lossless
+# when their amounts add up exactly
+EXACT = decimal.Context(prec=decimal.getcontext().prec, traps=[decimal.Inexact])
+# wide enough that relieving lots doesn't round for amounts and prices of
+# up to 28 digits, so relieving a merged lot and the lots it was made of
+# add up to the same p/l
+RELIEF = decimal.Context(prec=120)
 
 
 class AssetLedgerEntry(object):
 
-    def __init__(self, sym=None, amount=None, date=None, exchange=None, txtype=None):
+    def __init__(self, sym=None, amount=None, date=None, exchange=None, txtype=None, order=None):
         self.sym = sym
         self.exchange = exchange
         self.amount = amount
         self.date = date
         self.txtype = txtype
+        self.order = order
 
     def __repr__(self):
         return (
@@ -37,6 +49,9 @@ class AssetLedger(object):
         self.tx = []
         self.amount_tolerance = amount_tolerance
         self.time_tolerance = time_tolerance
+        # the entries left by the last resolve, none of which match each
+        # other, only new entries can make a match
+        self.settled = 0
 
     def can_resolve(self):
         # TODO delete?
@@ -50,6 +65,16 @@ class AssetLedger(object):
     def order_tx(self):
         return sorted(self.tx, key=lambda x: abs(x.amount))
 
+    def expire(self, cutoff):
+        """drop and return the entries dated before cutoff, they are past
+        the point where a match is plausible"""
+        expired = [tx for tx in self.tx if tx.date < cutoff]
+        if expired:
+            unchanged = len(self.tx) == self.settled
+            self.tx = [tx for tx in self.tx if tx.date >= cutoff]
+            self.settled = len(self.tx) if unchanged else 0
+        return expired
+
     def __repr__(self):
         return f"{type(self).__name__}(tx={self.order_tx()})"
 
@@ -75,7 +100,8 @@ class AssetTransferMatcher(AssetLedger):
     def resolve(self, costbasis):
         network_fee = Decimal(0)
         matched = []
-        if len(self.tx) < 2:
+        checked_all = True
+        if len(self.tx) < 2 or len(self.tx) == self.settled:
             return len(self.tx)
         for a, b in permutations(sorted(self.tx, key=lambda x: abs(x.amount)), r=2):
             amount_delta = abs(
@@ -98,80 +124,454 @@ class AssetTransferMatcher(AssetLedger):
                 costbasis[src.sym].fee(dst.amount+src.amount, src.date, txtype="network_fee")
 
                 if len(matched) == len(self.tx):
+                    checked_all = False
                     break
         for a, b in matched:
             self.tx = list(filter(lambda x: x not in (a, b), self.tx))
+        self.settled = len(self.tx) if checked_all else 0
         return len(self.tx)
 
 
+def split_fills(a_legs, b_legs):
+    """pair up the two sides of a trade that were filled in different
+    pieces, cutting a leg wherever the other side's fill ends at the
+    trade's overall rate. the last piece takes what's left of both sides
+    so each side still adds up exactly. returns [(a, a_amount, b, b_amount)]
+    """
+    rate = sum(b.amount for b in b_legs) / sum(a.amount for a in a_legs)
+    last_a = len(a_legs) - 1
+    last_b = len(b_legs) - 1
+    i = j = 0
+    ra = a_legs[0].amount
+    rb = b_legs[0].amount
+    trades = []
+    while i < last_a or j < last_b:
+        a, b = a_legs[i], b_legs[j]
+        if i < last_a and (j == last_b or abs(ra * rate) <= abs(rb)):
+            cut = ra * rate
+            trades.append((a, ra, b, cut))
+            rb -= cut
+            i += 1
+            ra = a_legs[i].amount
+            if rb == 0 and j < last_b:
+                j += 1
+                rb = b_legs[j].amount
+        else:
+            cut = rb / rate
+            trades.append((a, cut, b, rb))
+            ra -= cut
+            j += 1
+            rb = b_legs[j].amount
+            if ra == 0 and i < last_a:
+                i += 1
+                ra = a_legs[i].amount
+    trades.append((a_legs[i], ra, b_legs[j], rb))
+    return trades
+
+
+class TradeGroup(object):
+    """the legs of one order, or of one instant on an exchange that gives
+    no order id"""
+
+    def __init__(self):
+        self.legs = []
+        self.first = None
+        self.last = None
+        # sym -> [positive legs, negative legs]
+        self.counts = {}
+
+    def add(self, entry):
+        self.legs.append(entry)
+        if self.first is None or entry.date < self.first:
+            self.first = entry.date
+        if self.last is None or entry.date > self.last:
+            self.last = entry.date
+        counts = self.counts.setdefault(entry.sym, [0, 0])
+        counts[entry.amount < 0] += 1
+
+    def sides(self):
+        """the two syms if one was only bought and the other only sold"""
+        if len(self.counts) != 2:
+            return None
+        (a, (a_pos, a_neg)), (b, (b_pos, b_neg)) = sorted(self.counts.items())
+        if (a_pos and a_neg) or (b_pos and b_neg) or bool(a_pos) == bool(b_pos):
+            return None
+        return a, b
+
+    def balanced(self):
+        sides = self.sides()
+        return sides is not None and sum(self.counts[sides[0]]) == sum(self.counts[sides[1]])
+
+    def legs_of(self, sym, key):
+        return sorted((leg for leg in self.legs if leg.sym == sym), key=key)
+
+    def solve(self):
+        """[(a, a_amount, b, b_amount)] trades that account for every leg,
+        or None if the legs can't be told apart. legs from more than one
+        instant are taken as one trade per instant when that works out"""
+        by_date = {}
+        for leg in self.legs:
+            by_date.setdefault(leg.date, TradeGroup()).add(leg)
+        if len(by_date) > 1:
+            trades = []
+            for group in by_date.values():
+                solved = group.solve()
+                if solved is None:
+                    break
+                trades += solved
+            else:
+                return trades
+        sides = self.sides()
+        if sides is None:
+            return None
+        if self.balanced():
+            key = lambda x: abs(x.amount)
+            a_legs, b_legs = self.legs_of(sides[0], key), self.legs_of(sides[1], key)
+            return [(a, a.amount, b, b.amount) for a, b in zip(a_legs, b_legs)]
+        key = lambda x: (x.date, abs(x.amount))
+        return split_fills(self.legs_of(sides[0], key), self.legs_of(sides[1], key))
+
+
 class AssetTradeMatcher(AssetLedger):
-    """Attempts to match a list ef trades to what makes the most sense
-    Closest time-wise ordered by ascending value (distance from zero)
-    Raises an error if the lists are different sizes.
+    """Matches the legs of trades on one exchange. Legs are grouped by
+    order id where the exchange has one, otherwise by instant. Once the
+    instant of its last leg is over, a group with one sym bought and one
+    sold is settled, its legs paired up by size or split where the fills
+    don't line up. Groups without an order id that aren't a trade on their
+    own are merged with their neighbours within time_tolerance, whatever
+    still can't be solved is left pending until it expires.
     """
 
-    def resolve(self, costbasis):
-        if not self.can_resolve():
-            return len(self.tx)
-        syms = list(set([tx.sym for tx in self.tx]))
-        sd = {}
-        for sym in syms:
-            sd[sym] = sorted(
-                [tx for tx in self.tx if tx.sym == sym], key=lambda x: abs(x.amount)
-            )
+    @property
+    def tx(self):
+        return [leg for group in self.unsolved() for leg in group.legs]
+
+    @tx.setter
+    def tx(self, entries):
+        self.groups = {}
+        # groups without an order id that couldn't be solved yet, and the
+        # ones given up on
+        self.loose = None
+        self.stuck = []
+        for entry in entries:
+            self.add(entry)
+
+    def unsolved(self):
+        loose = [self.loose] if self.loose else []
+        return self.stuck + loose + list(self.groups.values())
+
+    def add(self, entry):
+        key = ("order", entry.order) if entry.order is not None else ("time", entry.date)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = TradeGroup()
+        group.add(entry)
+
+    def pending(self):
+        return sum(len(group.legs) for group in self.unsolved())
+
+    def resolve(self, costbasis, now=None, sealed=False):
+        """settle the groups that are complete. legs dated before now are
+        all in, and with sealed the ones dated now are too. with now=None
+        every group is complete"""
+        for key, group in list(self.groups.items()):
+            closed = now is None or now - group.last > self.time_tolerance
+            over = closed or group.last < now or (sealed and group.last <= now)
+            if not (closed or (over and group.sides())):
+                continue
+            del self.groups[key]
+            trades = group.solve()
+            if trades is None and key[0] == "time":
+                trades = self.merge(group)
+            elif trades is None:
+                self.stuck.append(group)
+            self.settle(costbasis, trades or [])
+        return self.pending()
+
+    def quiet_until(self, now, horizon=None):
+        """the last date resolve, and expire with horizon, can be given
+        without changing anything, once resolved at now and as long as no
+        legs are added. None when that's never"""
+        until = []
+        for group in self.groups.values():
+            # a group still open at now is over after it, one that's over
+            # but no trade on its own waits to be closed
+            until.append(group.last if group.last >= now else group.last + self.time_tolerance)
+        if horizon:
+            until += [group.last + horizon for group in self.unsolved()]
+        return min(until, default=None)
+
+    def merge(self, group):
+        """add a group that isn't a trade on its own to the loose legs
+        before it, and solve them together"""
+        if self.loose is not None and group.first - self.loose.last < self.time_tolerance:
+            for leg in group.legs:
+                self.loose.add(leg)
+            trades = self.loose.solve()
+            if trades is not None:
+                self.loose = None
+            return trades
+        if self.loose is not None:
+            self.stuck.append(self.loose)
+        self.loose = group
+        return None
+
+    def settle(self, costbasis, trades):
+        for a, a_amount, b, b_amount in trades:
+            a_usd, b_usd = get_usd_for_pair((a.sym, a_amount), (b.sym, b_amount), a.date)
+            costbasis[a.sym].trade(a_amount, a_usd, a.date)
+            costbasis[b.sym].trade(b_amount, b_usd, b.date)
+
+    def expire(self, cutoff):
+        expired = []
+        for group in self.unsolved():
+            if group.last < cutoff:
+                expired += group.legs
+        self.stuck = [group for group in self.stuck if group.last >= cutoff]
+        if self.loose is not None and self.loose.last < cutoff:
+            self.loose = None
+        for key, group in list(self.groups.items()):
+            if group.last < cutoff:
+                del self.groups[key]
+        return expired
+
+
+def long_term_cutoff(day):
+    """lots acquired before this day are long-term when sold on day, they
+    have to be held for more than a year"""
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        # sold on feb 29, a lot bought on feb 28 the year before is long-term
+        return date(day.year - 1, 3, 1)
+
+
+class LotBook(object):
+    """lots held, oldest first, as parallel lists of amounts, usd unit
+    prices and acquisition dates, with the running totals of amount and
+    cost. lots before head are used up and get dropped once they're half
+    the lists. by_day indexes the amount held by the day it was acquired,
+    days keeps those days sorted for bisecting
+
+    a lot added next to one at the same price acquired the same day is
+    merged into it when the amounts add up exactly, relief only ever looks
+    at a lot's amount, price and acquisition day so it can't tell the
+    merged lot from the two
+    """
 
-        newtx = []
-        for a, b in zip(sd[syms[0]], sd[syms[1]]):
-            time_diff = max(a.date, b.date) - min(a.date, b.date)
-            if time_diff < self.time_tolerance:
-                a_usd, b_usd = get_usd_for_pair(
-                    (a.sym, a.amount), (b.sym, b.amount), a.date
-                )
-                # print(f"matched trade: {a.date.ctime()} {time_diff} {a.amount:0.2f} {a.sym} ${a_usd:0.2f} <-> {b.amount:0.2f} {b.sym} ${b_usd:0.2f}")
-
-                costbasis[a.sym].trade(a.amount, a_usd, a.date)
-                costbasis[b.sym].trade(b.amount, b_usd, b.date)
-            else:
-                newtx.append(a)
-                newtx.append(b)
-        self.tx = newtx
-        return len(self.tx)
+    def __init__(self, lots=(), merge=True):
+        self.amounts = []
+        self.prices = []
+        self.dates = []
+        self.head = 0
+        self.merge = merge
+        self.amount = Decimal(0)
+        self.cost = Decimal(0)
+        self.by_day = {}
+        self.days = []
+        for lot in lots:
+            self.append(lot)
+
+    def __len__(self):
+        return len(self.amounts) - self.head
+
+    def __iter__(self):
+        return zip(self.amounts[self.head :], self.prices[self.head :], self.dates[self.head :])
+
+    def total(self, amount, price, acquired):
+        self.amount += amount
+        self.cost += amount * price
+        if self.head == len(self.amounts):
+            self.amount = Decimal(0)
+            self.cost = Decimal(0)
+        self.hold(acquired.date(), amount)
+
+    def hold(self, day, amount):
+        held = RELIEF.add(self.by_day.get(day, Decimal(0)), amount)
+        if held:
+            if day not in self.by_day:
+                insort(self.days, day)
+            self.by_day[day] = held
+        elif day in self.by_day:
+            del self.by_day[day]
+            del self.days[bisect_left(self.days, day)]
+
+    def append(self, lot):
+        amount, price, acquired = lot
+        if self.merge and len(self) and self.prices[-1] == price and self.dates[-1].date() == acquired.date():
+            try:
+                self.amounts[-1] = EXACT.add(self.amounts[-1], amount)
+                self.total(amount, price, acquired)
+                return
+            except decimal.Inexact:
+                pass
+        self.amounts.append(amount)
+        self.prices.append(price)
+        self.dates.append(acquired)
+        self.total(amount, price, acquired)
+
+    def appendleft(self, lot):
+        amount, price, acquired = lot
+        if self.head:
+            self.head -= 1
+            self.amounts[self.head] = amount
+            self.prices[self.head] = price
+            self.dates[self.head] = acquired
+        else:
+            self.amounts.insert(0, amount)
+            self.prices.insert(0, price)
+            self.dates.insert(0, acquired)
+        self.total(amount, price, acquired)
+
+    def pop(self):
+        if not len(self):
+            raise IndexError("pop from an empty LotBook")
+        lot = self.amounts.pop(), self.prices.pop(), self.dates.pop()
+        self.total(-lot[0], lot[1], lot[2])
+        return lot
+
+    def popleft(self):
+        if not len(self):
+            raise IndexError("pop from an empty LotBook")
+        i = self.head
+        lot = self.amounts[i], self.prices[i], self.dates[i]
+        self.head += 1
+        self.total(-lot[0], lot[1], lot[2])
+        if self.head > 32 and self.head * 2 > len(self.amounts):
+            del self.amounts[: self.head]
+            del self.prices[: self.head]
+            del self.dates[: self.head]
+            self.head = 0
+        return lot
+
+    def avg_price(self):
+        return self.cost / self.amount
+
+    def long_term(self, when):
+        """amount that would be long-term if sold at when"""
+        i = bisect_left(self.days, long_term_cutoff(when.date()))
+        return sum((self.by_day[day] for day in self.days[:i]), Decimal(0))
+
+    def turning_long_term(self, start, end):
+        """amount that is short-term if sold at start but long-term by end"""
+        lo = bisect_left(self.days, long_term_cutoff(start.date()))
+        hi = bisect_left(self.days, long_term_cutoff(end.date()))
+        return sum((self.by_day[day] for day in self.days[lo:hi]), Decimal(0))
+
+    def compact_long_term(self, when):
+        """merge neighbouring lots at the same price that are long-term at
+        when, no sale from then on can tell their acquisition days apart.
+        the merged lot keeps the earliest date, so the days held that
+        relief reports for it are a lower bound"""
+        cutoff = long_term_cutoff(when.date())
+        amounts, prices, dates = self.amounts, self.prices, self.dates
+        i = self.head
+        out = self.head
+        while i < len(amounts):
+            if dates[i].date() >= cutoff:
+                break
+            if out > self.head and prices[out - 1] == prices[i] and dates[out - 1].date() < cutoff:
+                try:
+                    merged = EXACT.add(amounts[out - 1], amounts[i])
+                except decimal.Inexact:
+                    merged = None
+                if merged is not None:
+                    self.hold(dates[i].date(), -amounts[i])
+                    self.hold(dates[out - 1].date(), amounts[i])
+                    amounts[out - 1] = merged
+                    i += 1
+                    continue
+            amounts[out], prices[out], dates[out] = amounts[i], prices[i], dates[i]
+            out += 1
+            i += 1
+        if out < i:
+            del amounts[out:i]
+            del prices[out:i]
+            del dates[out:i]
+
+    def __repr__(self):
+        if not len(self):
+            return "LotBook()"
+        return f"LotBook({len(self)} lots, {self.amount:0.8f} at ${self.avg_price():0.2f})"
 
 
 class AssetCostBasis(object):
+    # merge lots that relieve the same, see LotBook
+    compact_lots = True
+    # also merge lots once they're long-term, at the cost of the exact days
+    # held relief reports for them
+    compact_long_term = False
+
     def __init__(self, sym):
         self.balance = Decimal(0)
         self.usd_avg_cost_basis = Decimal(0)
-        self.lots = deque()
+        self.lots = LotBook(merge=self.compact_lots)
+        # what is held by acquisition date, the average cost method keeps
+        # lots as one lot at the average cost so it tracks the dates here
+        self.held = LotBook(merge=self.compact_lots)
         self.sym = sym
         self.profit_loss = Decimal(0)
+        # the part of profit_loss realized from lots by holding period
+        self.short_term_pl = Decimal(0)
+        self.long_term_pl = Decimal(0)
+        # (amount, acquired, days held, long-term, p/l) for each lot the
+        # last sale or loss took from
+        self.relief = []
+        self.compacted_on = None
         self.pending_fees = Decimal(0)
         if sym == "USD":
             self.usd_avg_cost_basis = Decimal(1.0)
 
+    def realize(self, amount, acquired, date, pl):
+        long_term = acquired.date() < long_term_cutoff(date.date())
+        self.relief.append((amount, acquired, (date.date() - acquired.date()).days, long_term, pl))
+        return long_term
+
+    def add_term_pl(self):
+        """add up the p/l of the last relief by holding period"""
+        short_term = long_term = Decimal(0)
+        with decimal.localcontext(RELIEF):
+            for amount, acquired, days, is_long, pl in self.relief:
+                if is_long:
+                    long_term += pl
+                else:
+                    short_term += pl
+        self.short_term_pl += short_term
+        self.long_term_pl += long_term
+
     def loss(self, amount, date, txtype="loss"):
         profitloss = Decimal(0)
         loss_remaining = amount
-        while loss_remaining < 0 and self.lots:
-            try:
-                lot_amount, lot_usd_price = self.get_tx()
-                loss_amount = min(abs(loss_remaining), lot_amount)
-                loss_remaining += loss_amount
-                if loss_amount != lot_amount:
-                    self.insert_tx((lot_amount-loss_amount,lot_usd_price))
-                profitloss -= (loss_amount * lot_usd_price)
-            except IndexError:
-                print(f"IndexError {self} {amount} {date}")
-                raise
+        relieved = False
+        self.relief = []
+        with decimal.localcontext(RELIEF):
+            while loss_remaining < 0 and self.lots:
+                try:
+                    lot_amount, lot_usd_price, acquired = self.get_tx()
+                    loss_amount = min(abs(loss_remaining), lot_amount)
+                    loss_remaining += loss_amount
+                    if loss_amount != lot_amount:
+                        self.insert_tx((lot_amount-loss_amount,lot_usd_price,acquired))
+                    pl = -(loss_amount * lot_usd_price)
+                    profitloss += pl
+                    self.realize(loss_amount, acquired, date, pl)
+                except IndexError:
+                    print(f"IndexError {self} {amount} {date}")
+                    raise
+                relieved = True
+        # once per loss, not per lot it takes, or the result would depend
+        # on how the lots happen to be split
+        if relieved:
             self.balance += amount
             self.profit_loss += profitloss
+            self.add_term_pl()
         if loss_remaining < 0:
             profitloss += loss_remaining
             usd_price = get_current_usd(AssetLedgerEntry(sym=self.sym), ts=date)
             print(f"{date.ctime()},{txtype},{self.sym},{abs(amount):0.3f},{profitloss:0.2f}")
             self.balance += loss_remaining
         if self.lots:
-            self.usd_avg_cost_basis = sum([a*u for a,u in self.lots]) / sum([a for a, u in self.lots])
+            self.usd_avg_cost_basis = self.lots.avg_price()
         elif self.sym != "USD":
             self.usd_avg_cost_basis = Decimal(0)
 
@@ -194,20 +594,24 @@ class AssetCostBasis(object):
                 print(f"{date.ctime()},{txtype},{self.sym},{abs(amount):0.3f},{pl:0.2f}")
         self.balance += amount
         if not self.sym == "USD" and self.lots:
-            self.usd_avg_cost_basis = sum([a*u for a,u in self.lots]) / sum([a for a, u in self.lots])
+            self.usd_avg_cost_basis = self.lots.avg_price()
         else:
             self.usd_avg_cost_basis = Decimal(1)
         return pl
 
     def buy(self, amount, usd_unit_price, date, txtype="buy"):
-        self.lots.append((amount, usd_unit_price))
-        total = sum([a for a,u in self.lots])
-        avg_cost = sum([a*u for a,u in self.lots]) / total
-        self.lots = deque([(total, avg_cost)])
+        self.lots.append((amount, usd_unit_price, date))
+        total = self.lots.amount
+        avg_cost = self.lots.cost / total
+        self.lots = LotBook([(total, avg_cost, date)], merge=self.compact_lots)
+        self.held.append((amount, usd_unit_price, date))
         return Decimal(0)
 
     def buy_lot(self, amount, usd_unit_price, date, txtype="buy"):
-        self.lots.append((amount, usd_unit_price))
+        self.lots.append((amount, usd_unit_price, date))
+        if self.compact_long_term and date.date() != self.compacted_on:
+            self.compacted_on = date.date()
+            self.lots.compact_long_term(date)
         return Decimal(0)
 
     def sell(self, amount, usd_unit_price, date, txtype="sell"):
@@ -217,8 +621,24 @@ class AssetCostBasis(object):
             abs(amount) * self.usd_avg_cost_basis
         )
         self.profit_loss += profitloss
-        total = sum([a for a,u in self.lots])
-        self.lots = deque([(total + amount, self.usd_avg_cost_basis)])
+        total = self.lots.amount
+        self.lots = LotBook([(total + amount, self.usd_avg_cost_basis, date)], merge=self.compact_lots)
+        # every unit sells at the average cost, the holding period is that
+        # of the oldest units held
+        sell_remaining = amount
+        self.relief = []
+        with decimal.localcontext(RELIEF):
+            while sell_remaining < 0 and self.held:
+                lot_amount, lot_usd_price, acquired = self.held.popleft()
+                sell_amount = min(abs(sell_remaining), lot_amount)
+                sell_remaining += sell_amount
+                if sell_amount != lot_amount:
+                    self.held.appendleft((lot_amount - sell_amount, lot_usd_price, acquired))
+                self.realize(sell_amount, acquired, date, sell_amount * (usd_unit_price - self.usd_avg_cost_basis))
+        self.add_term_pl()
+        if sell_remaining < 0:
+            # no lot to date it by
+            self.short_term_pl += profitloss - sum((r[4] for r in self.relief), Decimal(0))
         # print(f"{date.ctime()} sell {abs(amount):0.2f} {self.sym} p/l ${profitloss:0.2f} balance {self.balance:0.2f}")
         return Decimal(profitloss)
 
@@ -229,27 +649,40 @@ class AssetCostBasis(object):
         if self.sym == "USD":
             return profitloss
         sell_remaining = amount
-        while sell_remaining < 0 and self.lots:
-            try:
-                lot_amount, lot_usd_price = self.get_tx()
-                sell_amount = min(abs(sell_remaining), lot_amount)
-                sell_remaining += sell_amount
-                if sell_amount != lot_amount:
-                    self.insert_tx((lot_amount-sell_amount,lot_usd_price))
-                profitloss += (sell_amount * usd_unit_price) - (sell_amount * lot_usd_price)
-            except IndexError:
-                print(f"IndexError {self} {amount} {date}")
-                raise
+        self.relief = []
+        with decimal.localcontext(RELIEF):
+            while sell_remaining < 0 and self.lots:
+                try:
+                    lot_amount, lot_usd_price, acquired = self.get_tx()
+                    sell_amount = min(abs(sell_remaining), lot_amount)
+                    sell_remaining += sell_amount
+                    if sell_amount != lot_amount:
+                        self.insert_tx((lot_amount-sell_amount,lot_usd_price,acquired))
+                    pl = (sell_amount * usd_unit_price) - (sell_amount * lot_usd_price)
+                    profitloss += pl
+                    self.realize(sell_amount, acquired, date, pl)
+                except IndexError:
+                    print(f"IndexError {self} {amount} {date}")
+                    raise
+        self.add_term_pl()
 
         if sell_remaining < 0:
             usd_price = get_current_usd(AssetLedgerEntry(sym=self.sym), ts=date)
             print(f"WARNING deducting unmatched sale of {sell_remaining:0.2f} {self.sym} from P/L")
-            profitloss += Decimal(usd_price) * Decimal(sell_remaining)
+            unmatched = Decimal(usd_price) * Decimal(sell_remaining)
+            profitloss += unmatched
+            # no lot to date it by
+            self.short_term_pl += unmatched
             self.balance += sell_remaining
 
         self.profit_loss += profitloss
         return profitloss
 
+    @property
+    def holding(self):
+        """the lots held with their acquisition dates, for holding periods"""
+        return self.held
+
     def transfer(self, amount, date):
         # if self.balance > 0 and amount + self.balance < 0:
         # print(f"{date.ctime()} WARNING! transfer amount {amount:0.2f} exceeds balance {self.balance:0.2f} of {self.sym}")
@@ -265,6 +698,10 @@ class AssetCostBasis(object):
 
 
 class AssetFifoCostBasis(AssetCostBasis):
+    @property
+    def holding(self):
+        return self.lots
+
     def insert_tx(self, tx):
         self.lots.appendleft(tx)
 
@@ -279,6 +716,10 @@ class AssetFifoCostBasis(AssetCostBasis):
     
 
 class AssetLifoCostBasis(AssetCostBasis):
+    @property
+    def holding(self):
+        return self.lots
+
     def insert_tx(self, tx):
         self.lots.append(tx)
 
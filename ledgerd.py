@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+import argparse
+import bisect
+import copy
+import json
+import os
+import pickle
+import socketserver
+import sys
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from time import monotonic
+from time import sleep
+import exchanges
+from txhistory import LedgerReplay, AssetLifoCostBasis, AssetFifoCostBasis
+
+# sources whose rows come from an export we can tail, (file, line parser,
+# has a header line)
+FILE_SOURCES = {
+    "other": ("othertx.txt", exchanges.other_rows, False),
+    "bithumb": ("bithumb.txt", exchanges.bithumb_rows, True),
+    "bittrex": ("bittrex.txt", exchanges.bittrex_rows, True),
+}
+# sources polled through their apis, bittrex only for deposits/withdrawals
+API_SOURCES = ["gdax", "coinbase", "binance", "kraken", "bittrex"]
+
+
+def row_key(t):
+    return tuple(t[:5])
+
+
+class FileTail(object):
+    """reads the complete lines appended to a file since the last poll"""
+
+    def __init__(self, path, parse, header=False):
+        self.path = path
+        self.parse = parse
+        self.header = header
+        self.offset = 0
+        self.lineno = 0
+
+    def poll(self):
+        if not os.path.exists(self.path):
+            return []
+        if os.path.getsize(self.path) < self.offset:
+            raise RuntimeError(f"{self.path} was truncated, restart to reload it")
+        rows = []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                self.offset += len(raw)
+                self.lineno += 1
+                if self.header and self.lineno == 1:
+                    continue
+                line = raw.decode("utf-8")
+                if not line.strip():
+                    continue
+                try:
+                    rows += self.parse(line)
+                except (ValueError, IndexError) as e:
+                    print(f"{self.path}:{self.lineno}: skipping bad line: {e}", file=sys.stderr)
+        return rows
+
+
+class LedgerDaemon(object):
+    """keeps a LedgerReplay current as rows arrive
+
+    rows are applied in the same sorted order match_trades uses. A row that
+    sorts before something already applied rewinds to the last checkpoint
+    taken before it and replays forward, so the state always equals a full
+    replay of every row seen so far.
+    """
+
+    def __init__(self, costbasis_class=AssetLifoCostBasis, checkpoint_every=5000, max_checkpoints=32):
+        self.costbasis_class = costbasis_class
+        self.checkpoint_every = checkpoint_every
+        self.max_checkpoints = max_checkpoints
+        self.replay = LedgerReplay(costbasis_class=costbasis_class)
+        self.rows = []
+        self.applied = 0
+        self.checkpoints = []
+        self.known = {}
+        self.tails = {src: FileTail(*spec) for src, spec in FILE_SOURCES.items()}
+        self.lock = threading.RLock()
+        self.rewinds = 0
+
+    def checkpoint(self):
+        # the copy includes the pending matchers, so any point between two
+        # applied rows is a safe place to resume from
+        self.checkpoints.append((self.applied, copy.deepcopy(self.replay)))
+        if len(self.checkpoints) > self.max_checkpoints:
+            # thin out the older half, keep the recent ones dense
+            del self.checkpoints[0 : len(self.checkpoints) // 2 : 2]
+
+    def apply_pending(self):
+        since = self.applied % self.checkpoint_every
+        while self.applied < len(self.rows):
+            self.replay.apply(self.rows[self.applied])
+            self.applied += 1
+            since += 1
+            if since >= self.checkpoint_every:
+                since = 0
+                self.checkpoint()
+        self.replay.resolve()
+
+    def rewind(self, index):
+        """restore the newest checkpoint taken before rows[index]"""
+        while self.checkpoints and self.checkpoints[-1][0] > index:
+            self.checkpoints.pop()
+        if self.checkpoints:
+            self.applied, replay = self.checkpoints[-1]
+            self.replay = copy.deepcopy(replay)
+        else:
+            self.applied = 0
+            self.replay = LedgerReplay(costbasis_class=self.costbasis_class)
+        self.rewinds += 1
+
+    def add(self, rows):
+        """merge new rows into the history and bring the replay up to date"""
+        if not rows:
+            return
+        with self.lock:
+            earliest = len(self.rows)
+            for t in sorted(rows):
+                i = bisect.bisect_right(self.rows, t)
+                self.rows.insert(i, t)
+                earliest = min(earliest, i)
+            if earliest < self.applied:
+                self.rewind(earliest)
+            self.apply_pending()
+
+    def new_rows(self, source, rows):
+        """rows from a full refetch of source that we haven't seen yet,
+        duplicates are compared as multisets so repeated identical fills
+        are kept"""
+        counts = Counter(row_key(t) for t in rows)
+        known = self.known.setdefault(source, Counter())
+        new = []
+        for t in rows:
+            k = row_key(t)
+            if counts[k] > known[k]:
+                new.append(t)
+                counts[k] -= 1
+        known.update(row_key(t) for t in new)
+        return new
+
+    def api_rows(self, source, fetch=False):
+        """every row of source, from its pickle at startup and from the
+        api afterwards"""
+        if source in FILE_SOURCES:
+            # the tailed export already covers the trades
+            rows = exchanges.bittrex_transfers() if fetch else self.load_pickle(source)
+            return [t for t in rows if t[2] in ["deposit", "withdrawal"]]
+        if fetch or not os.path.exists(f"{source}.pickle"):
+            rows = exchanges.get_transactions(source)
+            # keep the pickle current for batch runs
+            with open(f"{source}.pickle", "wb") as f:
+                pickle.dump(rows, f)
+            return rows
+        return self.load_pickle(source)
+
+    def load_pickle(self, source):
+        if not os.path.exists(f"{source}.pickle"):
+            return exchanges.get_transactions(source)
+        with open(f"{source}.pickle", "rb") as f:
+            return pickle.load(f)
+
+    def poll_files(self):
+        rows = []
+        for src, tail in self.tails.items():
+            rows += tail.poll()
+        self.add(rows)
+        return len(rows)
+
+    def poll_apis(self, fetch=True):
+        rows = []
+        for src in API_SOURCES:
+            try:
+                rows += self.new_rows(src, self.api_rows(src, fetch=fetch))
+            except Exception as e:
+                print(f"polling {src} failed: {type(e).__name__}: {e}", file=sys.stderr)
+        self.add(rows)
+        return len(rows)
+
+    def start(self):
+        self.poll_apis(fetch=False)
+        self.poll_files()
+
+    def snapshot(self):
+        with self.lock:
+            replay = self.replay
+            return {
+                "events": self.applied,
+                "last_date": replay.last_date.isoformat() if replay.last_date else None,
+                "pending": replay.pending(),
+                "rewinds": self.rewinds,
+                "deposits": str(replay.deposits),
+                "unresolved": replay.unresolved.as_dict(),
+                "costbasis": {
+                    sym: {
+                        "balance": str(cb.balance),
+                        "cost_basis": str(cb.usd_avg_cost_basis * cb.balance),
+                        "profit_loss": str(cb.profit_loss),
+                        "short_term_pl": str(cb.short_term_pl),
+                        "long_term_pl": str(cb.long_term_pl),
+                    }
+                    for sym, cb in replay.costbasis.items()
+                },
+                "balances": {
+                    exch: {sym: str(b.balance) for sym, b in bal.items()}
+                    for exch, bal in replay.exch_balance.items()
+                },
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    ledger = None
+
+    def do_GET(self):
+        snap = self.ledger.snapshot()
+        path = self.path.rstrip("/")
+        if path in ["", "/status"]:
+            body = {k: v for k, v in snap.items() if k not in ["costbasis", "balances", "unresolved"]}
+        elif path == "/unresolved":
+            body = snap["unresolved"]
+        elif path == "/balances":
+            body = snap["balances"]
+        elif path in ["/pl", "/costbasis"]:
+            body = snap["costbasis"]
+        elif path == "/all":
+            body = snap
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body, indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(daemon, port=None, socket_path=None):
+    handler = type("LedgerHandler", (Handler,), {"ledger": daemon})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, handler)
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="keep the ledger up to date and serve balances and P/L")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--socket", help="serve on this unix socket instead of a tcp port")
+    parser.add_argument("--file-interval", type=float, default=2, help="seconds between export file polls")
+    parser.add_argument("--api-interval", type=float, default=300, help="seconds between exchange api polls")
+    parser.add_argument("--fifo", action="store_true")
+    args = parser.parse_args()
+
+    daemon = LedgerDaemon(costbasis_class=AssetFifoCostBasis if args.fifo else AssetLifoCostBasis)
+    daemon.start()
+    serve(daemon, port=args.port, socket_path=args.socket)
+    print(f"ledger at {args.socket or f'http://127.0.0.1:{args.port}'}, {daemon.applied} events", file=sys.stderr)
+    next_api = monotonic() + args.api_interval
+    while True:
+        sleep(args.file_interval)
+        daemon.poll_files()
+        if monotonic() >= next_api:
+            daemon.poll_apis()
+            next_api = monotonic() + args.api_interval
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+import os
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+
+DEFAULT_PATH = "prices.db"
+# seconds a writer waits for another process's transaction to finish
+BUSY_TIMEOUT = 60
+# the pickle caches the price lookups used before the store
+LEGACY_PICKLES = {"gdax": "gdax_price.pickle", "binance": "binance_price.pickle"}
+
+# when set, a price that isn't in a local cache raises PriceMiss instead
+# of going to the network
+offline = bool(os.environ.get("LEDGER_OFFLINE"))
+# when a set, prices missing from the store are recorded here and a
+# placeholder is returned, so a batch worker can list everything it
+# needs in one pass and leave the fetching to its parent
+misses = None
+PLACEHOLDER = Decimal(1)
+
+
+class PriceMiss(LookupError):
+    def __init__(self, source, market, ts):
+        super().__init__(f"no cached {source} price for {market} at {ts} (offline)")
+        self.source = source
+        self.market = market
+        self.ts = ts
+
+
+def set_offline(value=True):
+    global offline
+    offline = value
+
+
+def collect_misses():
+    global misses
+    misses = set()
+
+
+def record_miss(source, market, ts):
+    misses.add((source, market, ts))
+    return PLACEHOLDER
+
+
+def minute(ts):
+    """candle bucket of a timestamp, minutes since the epoch"""
+    return int(ts.timestamp()) // 60
+
+
+def pickle_prices(path):
+    """{market: [(minute, price)]} from a legacy {(market, ts): price} pickle"""
+    with open(path, "rb") as f:
+        p = pickle.load(f)
+    by_market = {}
+    for (market, ts), amt in p.items():
+        by_market.setdefault(market, []).append((minute(ts), str(amt)))
+    return by_market
+
+
+class LRUCache(object):
+    """bounded dict that drops the least recently used key when full"""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+class PriceStore(object):
+    """1 minute candle prices keyed by (source, market, minute)
+    prices are kept as the exchange's decimal strings so they round trip
+    exactly into Decimal
+
+    the database is in WAL mode, so any number of processes can read while
+    one writes, and writers queue on the lock for up to BUSY_TIMEOUT instead
+    of failing. every put is its own synced transaction, a crash loses at
+    most the price being written
+
+    recently used prices are also kept in memory, a trade's legs and the
+    fills around it ask for the same few candles over and over
+    """
+
+    def __init__(self, path=DEFAULT_PATH, readonly=False, mmap_size=1 << 34, hot_size=4096):
+        self.path = path
+        self.readonly = readonly
+        self.mmap_size = mmap_size
+        self.hot = LRUCache(hot_size)
+        self.local = threading.local()
+        self.market_ids = {}
+        if readonly:
+            return
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS markets (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                market TEXT NOT NULL,
+                UNIQUE (source, market)
+            );
+            CREATE TABLE IF NOT EXISTS candles (
+                market_id INTEGER NOT NULL,
+                minute INTEGER NOT NULL,
+                price TEXT NOT NULL,
+                PRIMARY KEY (market_id, minute)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            INSERT OR IGNORE INTO meta VALUES ('version', '0');
+            """
+        )
+
+    @property
+    def conn(self):
+        # sqlite connections can't be shared between threads
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            if self.readonly:
+                # pages are read straight out of a shared mapping of the
+                # file, so any number of reader processes cost one copy
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+                conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+                conn.execute("PRAGMA cache_size = -1024")
+            else:
+                conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute("PRAGMA synchronous = FULL")
+            self.local.conn = conn
+        return conn
+
+    def market_id(self, source, market, create=False):
+        key = (source, market)
+        if key in self.market_ids:
+            return self.market_ids[key]
+        row = self.conn.execute(
+            "SELECT id FROM markets WHERE source = ? AND market = ?", key
+        ).fetchone()
+        if row is None:
+            if not create:
+                return None
+            conn = self.conn
+            # don't commit a transaction the caller has open
+            outer = conn.in_transaction
+            conn.execute("INSERT OR IGNORE INTO markets (source, market) VALUES (?, ?)", key)
+            if not outer:
+                conn.commit()
+            return self.market_id(source, market)
+        self.market_ids[key] = row[0]
+        return row[0]
+
+    def get(self, source, market, minute):
+        key = (source, market, minute)
+        amt = self.hot.get(key)
+        if amt is not None:
+            return amt
+        market_id = self.market_id(source, market)
+        if market_id is None:
+            return None
+        row = self.conn.execute(
+            "SELECT price FROM candles WHERE market_id = ? AND minute = ?",
+            (market_id, minute),
+        ).fetchone()
+        if row is None:
+            # not cached, another process may store it later
+            return None
+        amt = Decimal(row[0])
+        self.hot.put(key, amt)
+        return amt
+
+    def version(self):
+        """counter bumped by every write, results computed from the store
+        are stale once it moves"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def bump_version(self):
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def put(self, source, market, minute, price):
+        market_id = self.market_id(source, market, create=True)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO candles VALUES (?, ?, ?)",
+                (market_id, minute, str(price)),
+            )
+            self.bump_version()
+        self.hot.put((source, market, minute), Decimal(price))
+
+    def put_many(self, source, market, rows):
+        """bulk insert (minute, price) rows of one market in one transaction"""
+        market_id = self.market_id(source, market, create=True)
+        conn = self.conn
+        conn.execute("PRAGMA synchronous = OFF")
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO candles VALUES ({int(market_id)}, ?, ?)", rows
+                )
+                self.bump_version()
+        finally:
+            conn.execute("PRAGMA synchronous = FULL")
+        # rows may have replaced prices we are holding
+        self.hot.clear()
+
+    def import_pickle(self, path, source):
+        """copy a {(market, ts): price} pickle cache into the store,
+        entries already in the store win"""
+        by_market = pickle_prices(path)
+        with self.conn:
+            self.bump_version()
+            return self._insert_ignore(source, by_market)
+
+    def _insert_ignore(self, source, by_market):
+        n = 0
+        for market, rows in by_market.items():
+            market_id = self.market_id(source, market, create=True)
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO candles VALUES ({int(market_id)}, ?, ?)", rows
+            )
+            n += len(rows)
+        return n
+
+    def migrate_pickles(self, directory="."):
+        """import the legacy price pickles in directory once, returns the
+        number of prices imported. the check and the import happen under
+        the write lock, so processes starting together import each file
+        exactly once"""
+        todo = {}
+        for source, name in LEGACY_PICKLES.items():
+            path = os.path.abspath(os.path.join(directory, name))
+            if os.path.exists(path):
+                todo[source] = path
+        if not todo:
+            return 0
+        conn = self.conn
+        n = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for source, path in todo.items():
+                key = f"migrated {path}"
+                if conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                    continue
+                n += self._insert_ignore(source, pickle_prices(path))
+                conn.execute("INSERT INTO meta VALUES (?, ?)", (key, str(os.path.getmtime(path))))
+                self.bump_version()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return n
+
+    def markets(self):
+        return self.conn.execute(
+            "SELECT source, market, count(minute), min(minute), max(minute) FROM markets"
+            " LEFT JOIN candles ON candles.market_id = markets.id GROUP BY markets.id"
+        ).fetchall()
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def use_store(store):
+    global _store
+    _store = store
+
+
+def default_store():
+    """the store set with use_store, else the one at $LEDGER_PRICE_DB
+    (default prices.db), created and seeded from the legacy price pickles
+    on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            store = PriceStore(os.environ.get("LEDGER_PRICE_DB", DEFAULT_PATH))
+            store.migrate_pickles()
+            _store = store
+    return _store
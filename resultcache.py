@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import pickle
+import zlib
+
+DEFAULT_DIR = ".ledger_cache"
+DEFAULT_MAX_BYTES = 256 << 20
+
+
+def watermark(path):
+    """cheap stand-in for a content hash, files are replaced or appended
+    to, never edited in place keeping size and mtime"""
+    st = os.stat(path)
+    return [os.path.basename(path), st.st_size, st.st_mtime_ns]
+
+
+def code_version(paths):
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """results stored under a hash of everything they were computed from,
+    as zlib compressed pickles in directory
+
+    a hit refreshes the entry's mtime, and once the entries take more than
+    max_bytes the least recently used are removed
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(**parts):
+        """hex digest of json serializable parts"""
+        data = json.dumps(parts, sort_keys=True, default=str).encode()
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pickle.z")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.loads(zlib.decompress(f.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+        os.replace(tmp, path)
+        self.evict()
+
+    def entries(self):
+        """[(mtime, size, path)] oldest first"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pickle.z"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for mtime, size, path in self.entries():
+                os.remove(path)
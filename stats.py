@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+import contextlib
+import functools
+import json
+import sys
+from collections import Counter
+from collections import defaultdict
+from time import perf_counter
+
+# hot paths check this flag inline before calling anything in here, so
+# collection costs one global lookup when it is off
+enabled = False
+sample_every = 1000
+
+counters = defaultdict(Counter)
+timers = defaultdict(lambda: defaultdict(float))
+samples = {}
+
+
+class Sample(object):
+    """running count/mean/max of a value plus a downsampled series"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.series = []
+
+    def add(self, value):
+        if self.count % sample_every == 0:
+            self.series.append((self.count, value))
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0,
+            "max": self.max,
+            "series": self.series,
+        }
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    counters.clear()
+    timers.clear()
+    samples.clear()
+
+
+def incr(name, key=None, n=1):
+    if enabled:
+        counters[name][key] += n
+
+
+def add_time(name, key, seconds):
+    if enabled:
+        timers[name][key] += seconds
+
+
+def sample(name, value):
+    if enabled:
+        if name not in samples:
+            samples[name] = Sample()
+        samples[name].add(value)
+
+
+@contextlib.contextmanager
+def timer(name, key=None):
+    if not enabled:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timers[name][key] += perf_counter() - start
+
+
+def timed(name, key, f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            timers[name][key] += perf_counter() - start
+            counters[name][key] += 1
+
+    wrapper.__wrapped_by_stats__ = True
+    return wrapper
+
+
+def instrument(cls, methods, name="costbasis"):
+    """wrap cls methods with timers, done at startup instead of decorating
+    so the classes pay nothing when stats are off"""
+    for m in methods:
+        f = getattr(cls, m, None)
+        if f is None or getattr(f, "__wrapped_by_stats__", False):
+            continue
+        setattr(cls, m, timed(name, f"{cls.__name__}.{m}", f))
+
+
+def as_dict():
+    return {
+        "counters": {
+            name: {str(k): v for k, v in c.most_common()} for name, c in counters.items()
+        },
+        "timers": {
+            name: {str(k): v for k, v in sorted(t.items(), key=lambda x: -x[1])}
+            for name, t in timers.items()
+        },
+        "samples": {name: s.as_dict() for name, s in samples.items()},
+    }
+
+
+def snapshot():
+    """what has been collected so far in a picklable form, for a worker
+    process to hand to merge() in its parent"""
+    return {
+        "counters": {name: dict(c) for name, c in counters.items()},
+        "timers": {name: dict(t) for name, t in timers.items()},
+        "samples": dict(samples),
+    }
+
+
+def merge(snap):
+    """add a snapshot() from another process to the stats collected here"""
+    for name, c in snap["counters"].items():
+        counters[name].update(c)
+    for name, t in snap["timers"].items():
+        for key, seconds in t.items():
+            timers[name][key] += seconds
+    for name, s in snap["samples"].items():
+        mine = samples.setdefault(name, Sample())
+        mine.series += [(mine.count + i, value) for i, value in s.series]
+        mine.count += s.count
+        mine.total += s.total
+        mine.max = max(mine.max, s.max)
+
+
+def dump(path):
+    with open(path, "w") as f:
+        json.dump(as_dict(), f, indent=2)
+
+
+def report(file=None, limit=15):
+    file = file or sys.stderr
+    for name, c in sorted(counters.items()):
+        print(f"{name}: {sum(c.values())}", file=file)
+        for k, v in c.most_common(limit):
+            if k is not None:
+                print(f"  {k:<32} {v:>10}", file=file)
+    for name, t in sorted(timers.items()):
+        print(f"{name}: {sum(t.values()):0.3f}s", file=file)
+        for k, v in sorted(t.items(), key=lambda x: -x[1])[:limit]:
+            if k is not None:
+                calls = counters[name][k] if name in counters else ""
+                print(f"  {k:<32} {v:>10.3f}s {calls:>10}", file=file)
+    for name, s in sorted(samples.items()):
+        d = s.as_dict()
+        print(f"{name}: n={d['count']} mean={d['mean']:0.1f} max={d['max']}", file=file)
+
+
+@contextlib.contextmanager
+def profile(kind="cprofile", path=None, file=None):
+    """run the block under cProfile or pyinstrument (if installed)
+    and print the hottest functions, optionally saving the raw profile"""
+    file = file or sys.stderr
+    if kind == "pyinstrument":
+        try:
+            import pyinstrument
+        except ImportError:
+            print("pyinstrument not installed, falling back to cProfile", file=file)
+        else:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            try:
+                yield profiler
+            finally:
+                profiler.stop()
+                print(profiler.output_text(unicode=True), file=file)
+                if path:
+                    with open(path, "w") as f:
+                        f.write(profiler.output_html())
+            return
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        pstats.Stats(profiler, stream=file).sort_stats("cumulative").print_stats(25)
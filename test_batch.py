@@ -0,0 +1,75 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+import batch
+import exchanges
+import pricestore
+import txgen
+import txhistory
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp.name, "prices.db")
+        self.prices = txgen.StubPriceSource(0)
+        self.portfolios = []
+        for seed in [1, 2]:
+            d = os.path.join(self.tmp.name, f"p{seed}")
+            txgen.write_pickles(txgen.SyntheticHistory(seed=seed, prices=self.prices).generate(1500), d)
+            self.portfolios.append(d)
+        self.fetched = []
+        self.saved = exchanges.fetch_price
+
+    def tearDown(self):
+        exchanges.fetch_price = self.saved
+        pricestore.default_store().close()
+        pricestore.use_store(None)
+        self.tmp.cleanup()
+
+    def fetch_price(self, source, market, ts):
+        self.fetched.append((source, market, ts))
+        return {"gdax": self.prices.gdax_price, "binance": self.prices.binance_price}[source](market, ts)
+
+    def run_batch(self):
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            results = batch.run(self.portfolios, self.db, method="fifo", workers=2)
+        return results, err.getvalue()
+
+    def test_misses_fetched_between_rounds(self):
+        exchanges.fetch_price = self.fetch_price
+        results, log = self.run_batch()
+        # the first round only lists the prices the replays need
+        assert "round 1: 0 done" in log
+        assert "round 2: 2 done, 0 prices to fetch" in log
+        assert self.fetched
+        for d in self.portfolios:
+            with open(os.path.join(d, "ledger.json")) as f:
+                assert json.load(f) == results[d]
+
+        restore = self.prices.install()
+        try:
+            for d in self.portfolios:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    costbasis, deposits = txhistory.match_trades(
+                        costbasis_class=txhistory.AssetFifoCostBasis,
+                        directory=d,
+                        sources=batch.portfolio_sources(d),
+                    )
+                assert results[d] == batch.summarize(costbasis, deposits)
+        finally:
+            restore()
+
+    def test_failed_fetch_is_an_error(self):
+        def fetch_price(source, market, ts):
+            raise ConnectionError("exchange down")
+
+        exchanges.fetch_price = fetch_price
+        results, log = self.run_batch()
+        assert "can't fetch" in log
+        assert set(results) == set(self.portfolios)
+        assert all(r == {"error": "prices missing after the last round"} for r in results.values())
@@ -0,0 +1,228 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from datetime import datetime
+from decimal import Decimal
+from time import sleep
+from time import perf_counter
+import dateutil.tz
+import coinbase.wallet.client
+import krakenex
+import requests
+import exchanges
+import pricestore
+from ledger import AssetLedgerEntry
+
+
+class TestGetCurrentUsdMany(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.saved = exchanges.gdax_price, exchanges.binance_price
+
+        def gdax_price(market, ts):
+            self.calls.append(market)
+            sleep(0.2)
+            return {"BTC-USD": Decimal(10000), "ETH-USD": Decimal(500)}[market]
+
+        def binance_price(market, ts):
+            self.calls.append(market)
+            sleep(0.2)
+            if market == "NOPEBTC":
+                raise TypeError("no such market")
+            return Decimal("0.001")
+
+        exchanges.gdax_price = gdax_price
+        exchanges.binance_price = binance_price
+
+    def tearDown(self):
+        exchanges.gdax_price, exchanges.binance_price = self.saved
+
+    def test_dedup_and_errors(self):
+        ts = datetime(2018, 6, 1, tzinfo=dateutil.tz.tzutc())
+        syms = ["USD", "KRW", "BTC", "ETH", "XRP", "ADA", "NEO", "NOPE"]
+        start = perf_counter()
+        prices = exchanges.get_current_usd_many(syms, ts=ts)
+        elapsed = perf_counter() - start
+        assert self.calls.count("BTC-USD") == 1
+        assert len(self.calls) == 6
+        assert elapsed < 0.6
+        assert prices["USD"].price == 1
+        assert prices["ETH"] == exchanges.UsdPrice("ETH", Decimal(500), None)
+        assert prices["XRP"].price == Decimal(10)
+        assert prices["NOPE"].price is None
+        assert "NOPEBTC" in prices["NOPE"].error
+        # the serial path agrees
+        for sym in syms[:-1]:
+            usd = exchanges.get_current_usd(AssetLedgerEntry(sym=sym), ts=ts)
+            assert usd == prices[sym].price
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_burst_then_rate(self):
+        rl = exchanges.RateLimiter(20, burst=3)
+        assert [rl.wait() for i in range(3)] == [0, 0, 0]
+        assert rl.wait() > 0
+
+
+class TestCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        pricestore.use_store(pricestore.PriceStore(os.path.join(self.tmp.name, "prices.db")))
+        self.requests = []
+        test = self
+
+        class Client(object):
+            def __init__(self, *args):
+                pass
+
+            def get_product_historic_rates(self, market, start, end, granularity):
+                test.requests.append((market, start))
+                sleep(0.2)
+                t = int(datetime.fromisoformat(start).timestamp())
+                # newest first, and the next minute overlaps the range
+                return [[t + 60, 2, 3, 2, 2, 1], [t, 1, 3, 2, 2, 1]]
+
+        self.saved = exchanges.gdax.AuthenticatedClient
+        exchanges.gdax.AuthenticatedClient = Client
+
+    def tearDown(self):
+        exchanges.gdax.AuthenticatedClient = self.saved
+        pricestore.default_store().close()
+        pricestore.use_store(None)
+        self.tmp.cleanup()
+
+    def test_one_flight_per_candle(self):
+        ts = datetime(2018, 1, 2, 3, 4, tzinfo=dateutil.tz.tzutc())
+        prices = []
+        threads = [
+            threading.Thread(target=lambda s=s: prices.append(exchanges.gdax_price("BTC-USD", ts.replace(second=s))))
+            for s in range(0, 60, 5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert prices == [Decimal(1)] * 12
+        assert self.requests == [("BTC-USD", ts.isoformat())]
+        assert exchanges.gdax_price("BTC-USD", ts.replace(second=59)) == 1
+        assert len(self.requests) == 1
+        assert pricestore.default_store().hot.hits > 0
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """answers with server.app(method, path, params), a (status, body) pair"""
+
+    def respond(self, method, params):
+        url = urlparse(self.path)
+        status, body = self.server.app(method, url.path, {k: v[0] for k, v in params.items()})
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.respond("GET", parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        self.respond("POST", parse_qs(body))
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPagedHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+        self.server.app = self.app
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.uri = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.requests = []
+        self.fail_at = None
+        self.saved = dict(exchanges.rate_limits)
+        for name in ["kraken", "coinbase"]:
+            exchanges.rate_limits[name] = exchanges.RateLimiter(1000, burst=1000)
+        t0 = datetime(2018, 1, 1).timestamp()
+        self.ledger = {
+            f"L{i:04d}": {"time": t0 + i * 60, "type": "trade", "asset": "XXBT", "amount": "0.1", "fee": "0.0001"}
+            for i in range(120)
+        }
+        self.accounts = [{"id": f"A{i}", "currency": "BTC"} for i in range(3)]
+        self.txs = {
+            a["id"]: [
+                {
+                    "id": f"{a['id']}-{i:04d}",
+                    "created_at": f"2018-01-{1 + i // 24:02d}T{i % 24:02d}:00:00Z",
+                    "type": "send",
+                    "amount": {"amount": "0.01", "currency": "BTC"},
+                }
+                for i in range(230, 0, -1)
+            ]
+            for a in self.accounts
+        }
+
+    def tearDown(self):
+        exchanges.rate_limits.update(self.saved)
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def app(self, method, path, params):
+        self.requests.append((path, params))
+        if len(self.requests) == self.fail_at:
+            return 500, {}
+        if path == "/0/private/Ledgers":
+            ofs = int(params.get("ofs", 0))
+            newest = sorted(self.ledger.items(), key=lambda e: e[1]["time"], reverse=True)
+            return 200, {"error": [], "result": {"ledger": dict(newest[ofs : ofs + 50]), "count": len(newest)}}
+        parts = path.strip("/").split("/")
+        items = self.txs[parts[2]] if len(parts) == 4 else self.accounts
+        limit = min(int(params["limit"]), 2 if len(parts) == 2 else 100)
+        ids = [item["id"] for item in items]
+        start = ids.index(params["starting_after"]) + 1 if "starting_after" in params else 0
+        more = start + limit < len(items)
+        return 200, {"pagination": {"next_uri": "/more" if more else None}, "data": items[start : start + limit]}
+
+    def kraken(self):
+        client = krakenex.API(key="k", secret="czNjcmV0")
+        client.uri = self.uri
+        return exchanges.kraken_transactions(self.tmp.name, apiclient=client)
+
+    def test_kraken_resumes(self):
+        self.fail_at = 2
+        with self.assertRaises(requests.HTTPError):
+            self.kraken()
+        rows = self.kraken()
+        assert [int(params["ofs"]) for path, params in self.requests] == [0, 50, 50, 100]
+        assert len({t[5] for t in rows}) == 120
+        assert len(rows) == 240
+        assert rows[0][2:5] == ["trade", "XXBT", Decimal("0.1")]
+        # a new entry, the next fetch stops at the newest one it had
+        self.ledger["L9999"] = dict(self.ledger["L0119"], time=self.ledger["L0119"]["time"] + 60)
+        del self.requests[:]
+        rows = self.kraken()
+        assert len(self.requests) == 1
+        assert len({t[5] for t in rows}) == 121
+
+    def test_coinbase_accounts(self):
+        with warnings.catch_warnings():
+            # the stand-in is plain http
+            warnings.simplefilter("ignore")
+            client = coinbase.wallet.client.Client("k", "s", base_api_uri=self.uri + "/")
+        rows = exchanges.coinbase_transactions(self.tmp.name, apiclient=client)
+        assert len(rows) == 3 * 230
+        assert len({t[5]["id"] for t in rows}) == 3 * 230
+        assert sum(path == "/v2/accounts" for path, params in self.requests) == 2
+        self.txs["A1"].insert(0, dict(self.txs["A1"][0], id="A1-new"))
+        del self.requests[:]
+        rows = exchanges.coinbase_transactions(self.tmp.name, apiclient=client)
+        assert len(rows) == 3 * 230 + 1
+        assert len(self.requests) == 2 + 3
@@ -1,8 +1,60 @@
+import contextlib
+import io
+import random
 import unittest
+from datetime import date
 from datetime import datetime
+from datetime import timedelta
 from decimal import Decimal
 import ledger
 
+
+class UncompactedFifo(ledger.AssetFifoCostBasis):
+    compact_lots = False
+
+
+class UncompactedLifo(ledger.AssetLifoCostBasis):
+    compact_lots = False
+
+
+def replay(cls, ops):
+    cb = cls("BTC")
+    results = []
+    cb.peak_lots = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for op, amount, price in ops:
+            if op == "trade":
+                cb.trade(amount, price, datetime(2018, 1, 1))
+            else:
+                cb.fee(amount, datetime(2018, 1, 1))
+            results.append((cb.balance, cb.profit_loss))
+            cb.peak_lots = max(cb.peak_lots, len(cb.lots))
+    return cb, results
+
+
+def dusty_ops(seed, n=3000):
+    """micro-buys at a handful of prices, rewards at a fixed price, and
+    sales and fees of every size"""
+    rnd = random.Random(seed)
+    ops = []
+    held = Decimal(0)
+    for i in range(n):
+        r = rnd.random()
+        if r < 0.6:
+            op = ("trade", Decimal(rnd.randint(1, 10**6)) / 10**8, Decimal(rnd.choice([9000, 9000, 9500, "9999.99"])))
+        elif r < 0.8:
+            op = ("trade", Decimal("0.00001"), Decimal(1) / 3)
+        elif r < 0.95:
+            op = ("trade", -min(held, Decimal(rnd.randint(1, 10**6)) / 10**7), Decimal(rnd.randint(5000, 15000)) / 7)
+        else:
+            op = ("fee", -min(held, Decimal(rnd.randint(1, 10**4)) / 10**8), None)
+        if op[1]:
+            # never more than is held, that would price the rest online
+            held += op[1]
+            ops.append(op)
+    return ops
+
+
 class TestAssetFifoCostBasis(unittest.TestCase):
     def test_tx(self):
         cb = ledger.AssetFifoCostBasis("BTC")
@@ -29,3 +81,97 @@ class TestAssetLifoCostBasis(unittest.TestCase):
         assert cb.usd_avg_cost_basis == Decimal(10000)
         assert cb.profit_loss == Decimal(10000)
 
+
+class TestLotCompaction(unittest.TestCase):
+    def test_same_results_as_uncompacted(self):
+        for compacted, uncompacted in [
+            (ledger.AssetFifoCostBasis, UncompactedFifo),
+            (ledger.AssetLifoCostBasis, UncompactedLifo),
+        ]:
+            for seed in range(3):
+                ops = dusty_ops(seed)
+                cb, results = replay(compacted, ops)
+                ref, ref_results = replay(uncompacted, ops)
+                assert results == ref_results
+                assert cb.lots.amount == ref.lots.amount
+                assert list(cb.lots) == list(ledger.LotBook(ref.lots))
+                assert cb.peak_lots < ref.peak_lots
+
+    def test_dust_merges_into_one_lot(self):
+        cb = ledger.AssetFifoCostBasis("BTC")
+        for i in range(1000):
+            cb.trade(Decimal("0.00000123"), Decimal(9000), datetime(2018, 1, 1))
+        assert len(cb.lots) == 1
+        assert list(cb.lots) == [(Decimal("0.00123000"), Decimal(9000), datetime(2018, 1, 1))]
+        assert "1 lots" in str(cb)
+
+
+class TestHoldingPeriods(unittest.TestCase):
+    def trade(self, cb, amount, price, day):
+        with contextlib.redirect_stdout(io.StringIO()):
+            cb.trade(Decimal(amount), Decimal(price), datetime(*day))
+
+    def test_short_and_long_term(self):
+        cb = ledger.AssetFifoCostBasis("BTC")
+        self.trade(cb, 1, 1000, (2017, 1, 1))
+        self.trade(cb, 1, 2000, (2017, 12, 1))
+        self.trade(cb, "-1.5", 3000, (2018, 1, 2))
+        assert (cb.long_term_pl, cb.short_term_pl) == (2000, 500)
+        assert cb.short_term_pl + cb.long_term_pl == cb.profit_loss
+        assert [(amount, days, long_term) for amount, acquired, days, long_term, pl in cb.relief] == [
+            (1, 366, True),
+            (Decimal("0.5"), 32, False),
+        ]
+        # exactly a year is still short-term
+        self.trade(cb, "-0.5", 3000, (2018, 12, 1))
+        assert cb.relief[0][3] is False
+        assert ledger.long_term_cutoff(date(2024, 2, 29)) == date(2023, 3, 1)
+
+    def test_average_cost(self):
+        cb = ledger.AssetCostBasis("BTC")
+        self.trade(cb, 1, 1000, (2017, 1, 1))
+        self.trade(cb, 1, 2000, (2017, 12, 1))
+        self.trade(cb, "-1.5", 3000, (2018, 1, 2))
+        # sold at the average cost of 1500, the oldest units first
+        assert cb.profit_loss == 2250
+        assert (cb.long_term_pl, cb.short_term_pl) == (1500, 750)
+        assert [(amount, days, long_term) for amount, acquired, days, long_term, pl in cb.relief] == [
+            (1, 366, True),
+            (Decimal("0.5"), 32, False),
+        ]
+        assert cb.holding.turning_long_term(datetime(2018, 1, 2), datetime(2018, 12, 31)) == Decimal("0.5")
+        assert list(cb.lots) == [(Decimal("0.5"), Decimal(1500), datetime(2018, 1, 2))]
+
+    def test_turning_long_term(self):
+        rnd = random.Random(0)
+        cb = ledger.AssetFifoCostBasis("BTC")
+        start = datetime(2017, 1, 1)
+        for i in range(2000):
+            self.trade(cb, Decimal(rnd.randint(1, 10**4)) / 10**4, rnd.choice([900, 1000]), (start + timedelta(hours=8 * i)).timetuple()[:4])
+            if i % 7 == 0:
+                self.trade(cb, -Decimal(rnd.randint(1, 10**4)) / 10**4, 1100, (start + timedelta(hours=8 * i)).timetuple()[:4])
+        now = datetime(2018, 7, 1)
+        month = datetime(2018, 8, 1)
+
+        def scan(when):
+            cutoff = ledger.long_term_cutoff(when.date())
+            return sum(a for a, p, acquired in cb.lots if acquired.date() < cutoff)
+
+        assert cb.lots.long_term(now) == scan(now)
+        assert cb.lots.turning_long_term(now, month) == scan(month) - scan(now) > 0
+        assert sum(cb.lots.by_day.values()) == cb.lots.amount
+
+    def test_long_term_compaction(self):
+        class Compacting(ledger.AssetFifoCostBasis):
+            compact_long_term = True
+
+        cbs = [ledger.AssetFifoCostBasis("BTC"), Compacting("BTC")]
+        for cb in cbs:
+            for day in range(1, 29):
+                self.trade(cb, "0.1", 1000, (2017, 2, day))
+            self.trade(cb, "0.1", 1000, (2018, 3, 1))
+            self.trade(cb, "-2", 1500, (2018, 3, 2))
+        full, compacted = cbs
+        assert len(compacted.lots) == 2 < len(full.lots)
+        assert (compacted.profit_loss, compacted.long_term_pl) == (full.profit_loss, full.long_term_pl)
+        assert sum(compacted.lots.by_day.values()) == compacted.lots.amount == full.lots.amount
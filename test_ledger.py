@@ -1,9 +1,71 @@
 import unittest
+from collections import defaultdict
 from datetime import datetime
+from datetime import timedelta
 from decimal import Decimal
 import ledger
 
 
+def leg(sym, amount, seconds, order=None):
+    return ledger.AssetLedgerEntry(
+        sym=sym,
+        amount=Decimal(amount),
+        date=datetime(2018, 1, 1) + timedelta(seconds=seconds),
+        exchange="gdax",
+        txtype="trade",
+        order=order,
+    )
+
+
+class Trades(object):
+    def __init__(self):
+        self.trades = []
+
+    def trade(self, amount, usd, date):
+        self.trades.append((amount, usd))
+
+
+class TestAssetTradeMatcher(unittest.TestCase):
+    def setUp(self):
+        self.tm = ledger.AssetTradeMatcher()
+        self.costbasis = defaultdict(Trades)
+
+    def add(self, *legs):
+        for entry in legs:
+            self.tm.add(entry)
+
+    def test_unequal_partial_fills(self):
+        self.add(leg("USD", -100, 0), leg("USD", -50, 0), leg("BTC", "0.004", 0), leg("BTC", "0.006", 0), leg("BTC", "0.005", 0))
+        assert self.tm.resolve(self.costbasis, now=datetime(2018, 1, 1)) == 5
+        assert self.tm.resolve(self.costbasis, now=datetime(2018, 1, 1), sealed=True) == 0
+        usd = self.costbasis["USD"].trades
+        btc = self.costbasis["BTC"].trades
+        assert sum(a for a, u in usd) == -150
+        assert sum(a for a, u in btc) == Decimal("0.015")
+        assert {u for a, u in btc} == {Decimal(10000)}
+
+    def test_balanced_group_settles_after_its_instant(self):
+        self.add(leg("BTC", "0.02", 0), leg("USD", -200, 0), leg("BTC", "0.01", 0), leg("USD", -100, 0))
+        assert self.tm.resolve(self.costbasis, now=datetime(2018, 1, 1)) == 4
+        assert self.tm.resolve(self.costbasis, now=datetime(2018, 1, 1, 0, 0, 1)) == 0
+        assert self.costbasis["BTC"].trades == [(Decimal("0.01"), 10000), (Decimal("0.02"), 10000)]
+
+    def test_instants_of_a_cluster(self):
+        self.add(leg("USD", -100, 0), leg("BTC", "0.01", 0), leg("USDT", -50, 1), leg("ETH", "0.1", 1))
+        self.add(leg("USD", -30, 3), leg("LTC", "1", 4))
+        assert self.tm.resolve(self.costbasis, now=datetime(2018, 1, 1, 0, 0, 5)) == 2
+        assert self.tm.resolve(self.costbasis) == 0
+        assert self.costbasis["ETH"].trades == [(Decimal("0.1"), 500)]
+        assert self.costbasis["LTC"].trades == [(Decimal(1), 30)]
+
+    def test_order_id_groups_distant_legs(self):
+        self.add(leg("USD", -100, 0, order="a"), leg("ETH", "-1", 0), leg("BTC", "0.01", 30, order="a"))
+        assert self.tm.resolve(self.costbasis, now=datetime(2018, 1, 1, 0, 1)) == 1
+        assert self.costbasis["BTC"].trades == [(Decimal("0.01"), 10000)]
+        assert [e.sym for e in self.tm.expire(datetime(2018, 1, 2))] == ["ETH"]
+        assert self.tm.tx == []
+
+
 class TestAssetCostBasis(unittest.TestCase):
     def test_tx(self):
         cb = ledger.AssetCostBasis("BTC")
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+import dateutil.tz
+import ledgerd
+import txhistory
+
+
+def history():
+    t0 = datetime(2018, 1, 1, tzinfo=dateutil.tz.tzutc())
+    rows = [[t0, "bofa", "fiat_deposit", "USD", Decimal(-10000)], [t0, "gdax", "transfer", "USD", Decimal(10000)]]
+    for i in range(1, 60):
+        ts = t0 + timedelta(minutes=i)
+        price = Decimal(1000 + 10 * (i % 7))
+        size = Decimal(i % 3 + 1) / 10 * (1 if i % 4 else -2)
+        rows.append([ts, "gdax", "match", "BTC", size])
+        rows.append([ts, "gdax", "match", "USD", -size * price])
+        rows.append([ts, "gdax", "fee", "USD", Decimal("-0.25")])
+    return sorted(rows)
+
+
+def state(replay):
+    return {sym: (cb.balance, cb.profit_loss) for sym, cb in replay.costbasis.items()}
+
+
+class TestLedgerDaemon(unittest.TestCase):
+    def test_out_of_order_matches_full_replay(self):
+        rows = history()
+        full = txhistory.LedgerReplay(costbasis_class=txhistory.AssetFifoCostBasis)
+        for t in rows:
+            full.apply(t)
+        full.resolve()
+
+        d = ledgerd.LedgerDaemon(costbasis_class=txhistory.AssetFifoCostBasis, checkpoint_every=10)
+        late = rows[60:66] + rows[150:153]
+        d.add([t for t in rows if t not in late])
+        d.add(late)
+        assert d.rewinds == 1
+        assert state(d.replay) == state(full)
+        assert d.replay.deposits == full.deposits
+
+    def test_new_rows_multiset(self):
+        d = ledgerd.LedgerDaemon()
+        rows = history()[:5]
+        assert d.new_rows("gdax", rows) == rows
+        assert d.new_rows("gdax", rows) == []
+        again = rows + [list(rows[-1])]
+        assert d.new_rows("gdax", again) == [rows[-1]]
+
+
+class TestFileTail(unittest.TestCase):
+    def test_partial_lines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "othertx.txt")
+            tail = ledgerd.FileTail(path, lambda line: [line.rstrip().split(",")])
+            assert tail.poll() == []
+            with open(path, "w") as f:
+                f.write("a,1\nb,2\nc,")
+            assert tail.poll() == [["a", "1"], ["b", "2"]]
+            with open(path, "a") as f:
+                f.write("3\n")
+            assert tail.poll() == [["c", "3"]]
+
+
+class TestServe(unittest.TestCase):
+    def test_endpoints(self):
+        d = ledgerd.LedgerDaemon(costbasis_class=txhistory.AssetFifoCostBasis)
+        d.add(history())
+        server = ledgerd.serve(d, port=0)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            status = json.load(urllib.request.urlopen(f"{url}/status"))
+            assert status["events"] == len(history())
+            pl = json.load(urllib.request.urlopen(f"{url}/pl"))
+            assert Decimal(pl["BTC"]["balance"]) == d.replay.costbasis["BTC"].balance
+            balances = json.load(urllib.request.urlopen(f"{url}/balances"))
+            assert "gdax" in balances
+        finally:
+            server.shutdown()
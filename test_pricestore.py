@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import pickle
+import tempfile
+import unittest
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+import dateutil.tz
+import klines
+import pricestore
+
+
+def write_prices(path, worker, n):
+    store = pricestore.PriceStore(path)
+    for i in range(n):
+        # every worker writes its own market and the shared one
+        store.put("gdax", f"W{worker}-USD", i, Decimal(i))
+        store.put("gdax", "BTC-USD", i * 4 + worker, Decimal(worker))
+    store.migrate_pickles(os.path.dirname(path))
+    store.close()
+
+
+class TestPriceStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = pricestore.PriceStore(os.path.join(self.tmp.name, "prices.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_put_get(self):
+        ts = datetime(2018, 1, 2, 3, 4, 30, tzinfo=dateutil.tz.tzutc())
+        m = pricestore.minute(ts)
+        assert m == pricestore.minute(ts.replace(second=0))
+        assert self.store.get("gdax", "BTC-USD", m) is None
+        self.store.put("gdax", "BTC-USD", m, Decimal("13500.01"))
+        assert self.store.get("gdax", "BTC-USD", m) == Decimal("13500.01")
+        assert self.store.get("binance", "BTC-USD", m) is None
+
+    def test_hot_tier_is_bounded(self):
+        store = pricestore.PriceStore(os.path.join(self.tmp.name, "hot.db"), hot_size=2)
+        for m in range(3):
+            store.put("gdax", "BTC-USD", m, Decimal(m))
+        assert len(store.hot) == 2
+        assert store.hot.get(("gdax", "BTC-USD", 0)) is None
+        assert store.get("gdax", "BTC-USD", 0) == 0
+        assert store.hot.get(("gdax", "BTC-USD", 1)) is None
+        store.close()
+
+    def test_import_binance_zip(self):
+        t0 = 1514764800000
+        lines = [f"{t0 + i * 60000},1.0,1.2,0.{i + 1:08d},1.1,10,{t0 + i * 60000 + 59999},0,0,0,0,0\n" for i in range(50)]
+        lines.insert(10, "garbage\n")
+        path = os.path.join(self.tmp.name, "XRPBTC-1m-2018-01.zip")
+        with zipfile.ZipFile(path, "w") as z:
+            z.writestr("XRPBTC-1m-2018-01.csv", "".join(lines))
+        errors = []
+        n = klines.import_file(self.store, path, errors=errors)
+        assert n == 50
+        assert errors == [(11, "garbage")]
+        assert self.store.get("binance", "XRPBTC", t0 // 60000 + 3) == Decimal("0.00000004")
+
+    def test_import_microseconds_as_other_market(self):
+        t0 = 1735689600000000
+        path = os.path.join(self.tmp.name, "btc.csv")
+        with open(path, "w") as f:
+            f.write("open_time,open,high,low,close\n")
+            f.write(f"{t0},93000.1,93100,92900.5,93050\n")
+        klines.import_file(self.store, path, source="gdax", market="BTC-USD", fmt="binance")
+        assert self.store.get("gdax", "BTC-USD", t0 // 60000000) == Decimal("92900.5")
+
+    def test_non_minute_dump(self):
+        with self.assertRaises(ValueError):
+            klines.import_file(self.store, "XRPBTC-1h-2018-01.zip")
+
+    def test_concurrent_writers(self):
+        path = os.path.join(self.tmp.name, "prices.db")
+        ts = datetime(2018, 1, 2, 3, 4, 30, tzinfo=dateutil.tz.tzutc())
+        with open(os.path.join(self.tmp.name, "binance_price.pickle"), "wb") as f:
+            pickle.dump({("XRPBTC", ts): Decimal("0.0001")}, f)
+        procs = [multiprocessing.Process(target=write_prices, args=(path, w, 200)) for w in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            assert p.exitcode == 0
+        for w in range(4):
+            assert self.store.get("gdax", f"W{w}-USD", 199) == Decimal(199)
+        rows = self.store.conn.execute("SELECT count(*) FROM candles").fetchone()[0]
+        assert rows == 4 * 200 + 4 * 200 + 1
+        assert self.store.get("binance", "XRPBTC", pricestore.minute(ts)) == Decimal("0.0001")
+        assert self.store.migrate_pickles(self.tmp.name) == 0
@@ -0,0 +1,146 @@
+import contextlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+import dateutil.tz
+import pricestore
+import resultcache
+import txhistory
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lru_eviction(self):
+        cache = resultcache.ResultCache(self.tmp.name, max_bytes=3500)
+        blob = os.urandom(1000)
+        for i in range(3):
+            cache.put(cache.key(i=i), blob)
+            os.utime(cache.path(cache.key(i=i)), ns=(i * 10**9, i * 10**9))
+        assert cache.get(cache.key(i=0)) == blob
+        cache.put(cache.key(i=3), blob)
+        assert cache.get(cache.key(i=1)) is None
+        assert cache.get(cache.key(i=0)) == blob
+        assert cache.get(cache.key(i=3)) == blob
+
+    def test_match_trades(self):
+        t0 = datetime(2018, 1, 1, tzinfo=dateutil.tz.tzutc())
+        path = os.path.join(self.tmp.name, "other.pickle")
+        with open(path, "wb") as f:
+            pickle.dump([[t0 + timedelta(days=i), "wallet", "gift", "BTC", Decimal(1)] for i in range(5)], f)
+        pricestore.use_store(pricestore.PriceStore(os.path.join(self.tmp.name, "prices.db")))
+        cache = resultcache.ResultCache(os.path.join(self.tmp.name, "cache"))
+
+        def run(**kwargs):
+            costbasis, deposits = txhistory.match_trades(
+                directory=self.tmp.name, sources=["other"], cache=cache, **kwargs
+            )
+            return costbasis["BTC"].balance
+
+        try:
+            assert run() == 5
+            assert (cache.hits, cache.misses) == (0, 1)
+            assert run() == 5
+            assert cache.hits == 1
+            assert run(cutoff_date=t0 + timedelta(days=1)) == 2
+            with open(path, "wb") as f:
+                pickle.dump([[t0, "wallet", "gift", "BTC", Decimal(7)]], f)
+            assert run() == 7
+            pricestore.default_store().put("gdax", "BTC-USD", 0, Decimal(1))
+            assert run() == 7
+            assert cache.hits == 1
+            assert run() == 7
+            assert cache.hits == 2
+        finally:
+            pricestore.default_store().close()
+            pricestore.use_store(None)
+
+    def test_hit_replays_output(self):
+        t0 = datetime(2018, 1, 1, tzinfo=dateutil.tz.tzutc())
+        portfolio = os.path.join(self.tmp.name, "a")
+        os.makedirs(portfolio)
+        with open(os.path.join(portfolio, "other.pickle"), "wb") as f:
+            pickle.dump(
+                [
+                    [t0, "wallet", "gift", "USD", Decimal(10000)],
+                    [t0 + timedelta(days=1), "wallet", "buy", "BTC", Decimal(1)],
+                    [t0 + timedelta(days=1), "wallet", "buy", "USD", Decimal(-5000)],
+                    [t0 + timedelta(days=9), "wallet", "sell", "BTC", Decimal("-0.01")],
+                    [t0 + timedelta(days=9), "wallet", "sell", "USD", Decimal(50)],
+                    # never deposited anywhere
+                    [t0 + timedelta(days=10), "wallet", "withdrawal", "BTC", Decimal("-0.5")],
+                ],
+                f,
+            )
+        pricestore.use_store(pricestore.PriceStore(os.path.join(self.tmp.name, "prices.db")))
+        cache = resultcache.ResultCache(os.path.join(self.tmp.name, "cache"))
+        unresolved_path = os.path.join(portfolio, "unresolved.jsonl")
+
+        def run(directory=portfolio):
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                txhistory.match_trades(directory=directory, sources=["other"], cache=cache)
+            return out.getvalue()
+
+        try:
+            first = run()
+            assert ",sell,BTC," in first
+            with open(unresolved_path) as f:
+                unresolved = f.read()
+            assert unresolved
+            os.remove(unresolved_path)
+            assert run() == first
+            assert cache.hits == 1
+            with open(unresolved_path) as f:
+                assert f.read() == unresolved
+            # a copy keeping the mtimes is a different portfolio
+            shutil.copytree(portfolio, os.path.join(self.tmp.name, "b"))
+            run(os.path.join(self.tmp.name, "b"))
+            assert (cache.hits, cache.misses) == (1, 2)
+        finally:
+            pricestore.default_store().close()
+            pricestore.use_store(None)
+
+    def test_sources_changing_during_a_run(self):
+        t0 = datetime(2018, 1, 1, tzinfo=dateutil.tz.tzutc())
+        path = os.path.join(self.tmp.name, "other.pickle")
+
+        def write(n):
+            with open(path, "wb") as f:
+                pickle.dump([[t0 + timedelta(days=i), "wallet", "gift", "BTC", Decimal(1)] for i in range(n)], f)
+
+        write(5)
+        pricestore.use_store(pricestore.PriceStore(os.path.join(self.tmp.name, "prices.db")))
+        cache = resultcache.ResultCache(os.path.join(self.tmp.name, "cache"))
+        read = txhistory.get_all_transactions
+
+        def read_then_grow(**kwargs):
+            rows = read(**kwargs)
+            write(7)
+            return rows
+
+        def run():
+            costbasis, deposits = txhistory.match_trades(directory=self.tmp.name, sources=["other"], cache=cache)
+            return costbasis["BTC"].balance
+
+        try:
+            txhistory.get_all_transactions = read_then_grow
+            assert run() == 5
+            txhistory.get_all_transactions = read
+            # the result of the old rows isn't served for the new ones
+            assert run() == 7
+            assert cache.hits == 0
+        finally:
+            txhistory.get_all_transactions = read
+            pricestore.default_store().close()
+            pricestore.use_store(None)
@@ -0,0 +1,134 @@
+import contextlib
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+import dateutil.tz
+import exchanges
+import pricestore
+import stats
+import txgen
+import txhistory
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        stats.reset()
+
+    def tearDown(self):
+        stats.disable()
+        stats.reset()
+
+    def record(self):
+        stats.incr("calls", "a")
+        stats.add_time("io", "read", 0.5)
+        stats.sample("pending", 3)
+        with stats.timer("block"):
+            pass
+
+    def test_only_while_enabled(self):
+        self.record()
+        assert not stats.counters and not stats.timers and not stats.samples
+        stats.enable()
+        self.record()
+        assert stats.counters["calls"]["a"] == 1
+        assert stats.timers["io"]["read"] == 0.5
+        assert None in stats.timers["block"]
+        assert stats.samples["pending"].count == 1
+
+    def test_instrument_once(self):
+        class Counted(object):
+            def f(self, x):
+                return x + 1
+
+        stats.instrument(Counted, ["f", "missing"])
+        wrapped = Counted.f
+        stats.instrument(Counted, ["f"])
+        assert Counted.f is wrapped
+        assert Counted().f(1) == 2
+        assert stats.counters["costbasis"]["Counted.f"] == 1
+
+    def test_dump(self):
+        stats.enable()
+        self.record()
+        stats.sample("pending", 5)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "stats.json")
+            stats.dump(path)
+            with open(path) as f:
+                d = json.load(f)
+        assert sorted(d) == ["counters", "samples", "timers"]
+        assert d["counters"] == {"calls": {"a": 1}}
+        assert d["timers"]["io"] == {"read": 0.5}
+        assert list(d["timers"]["block"]) == ["None"]
+        assert d["samples"]["pending"] == {"count": 2, "mean": 4, "max": 5, "series": [[0, 3]]}
+
+    def test_merge_snapshot(self):
+        stats.enable()
+        self.record()
+        snap = pickle.loads(pickle.dumps(stats.snapshot()))
+        stats.sample("pending", 7)
+        stats.merge(snap)
+        assert stats.counters["calls"]["a"] == 2
+        assert stats.timers["io"]["read"] == 1.0
+        pending = stats.samples["pending"]
+        assert (pending.count, pending.total, pending.max) == (3, 13, 7)
+
+    def test_match_trades(self):
+        # a subclass, instrumenting wraps the methods for good
+        class Fifo(txhistory.AssetFifoCostBasis):
+            pass
+
+        prices = txgen.StubPriceSource(4)
+        restore = prices.install()
+        tmp = tempfile.TemporaryDirectory()
+        pricestore.use_store(pricestore.PriceStore(os.path.join(tmp.name, "prices.db")))
+        try:
+            txgen.write_pickles(txgen.SyntheticHistory(seed=4, prices=prices).generate(1000), tmp.name)
+            stats.enable()
+            with contextlib.redirect_stdout(io.StringIO()):
+                txhistory.match_trades(costbasis_class=Fifo, directory=tmp.name)
+        finally:
+            restore()
+            pricestore.default_store().close()
+            pricestore.use_store(None)
+            tmp.cleanup()
+        assert stats.counters["do_resolve"][None] > 0
+        assert stats.samples["pending_trades"].count == stats.counters["do_resolve"][None]
+        assert stats.timers["costbasis"]["Fifo.trade"] > 0
+        assert stats.counters["costbasis"]["Fifo.trade"] > 0
+        assert set(stats.timers["matcher"]) == {"trade", "transfer"}
+
+
+class TestCommandLine(unittest.TestCase):
+    def test_stats_json_and_profile(self):
+        t0 = datetime(2018, 1, 1, tzinfo=dateutil.tz.tzutc())
+        with tempfile.TemporaryDirectory() as tmp:
+            for src in exchanges.SOURCES:
+                rows = []
+                if src == "other":
+                    rows = [[t0 + timedelta(minutes=i), "wallet", "gift", "USD", Decimal(10)] for i in range(5)]
+                with open(os.path.join(tmp, f"{src}.pickle"), "wb") as f:
+                    pickle.dump(rows, f)
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+            script = os.path.join(os.path.dirname(os.path.abspath(txhistory.__file__)), "txhistory.py")
+            args = ["--offline", "--no-cache", "--stats", "--stats-json=stats.json", "--profile", "--profile-out=replay.prof"]
+            subprocess.run(
+                [sys.executable, script] + args,
+                cwd=tmp,
+                env=env,
+                check=True,
+                capture_output=True,
+            )
+            with open(os.path.join(tmp, "stats.json")) as f:
+                d = json.load(f)
+            assert d["counters"]["do_resolve"]["None"] > 0
+            assert "pickle_io" in d["timers"]
+            assert os.path.getsize(os.path.join(tmp, "replay.prof")) > 0
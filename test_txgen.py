@@ -0,0 +1,34 @@
+import unittest
+from decimal import Decimal
+import txgen
+from exchanges import normalize_txtype, normalize_sym
+
+
+class TestSyntheticHistory(unittest.TestCase):
+    def test_seeded(self):
+        a = txgen.generate(2000, seed=7)
+        b = txgen.generate(2000, seed=7)
+        assert a == b
+        assert a != txgen.generate(2000, seed=8)
+
+    def test_row_shapes(self):
+        rows = txgen.generate(5000, seed=1)
+        assert sum(len(t) for t in rows.values()) >= 5000
+        for src, t in rows.items():
+            assert t, src
+            for row in t:
+                assert row[0].tzinfo is not None
+                normalize_txtype(row[2])
+                assert isinstance(row[4], Decimal)
+        syms = set(normalize_sym(row[3]) for row in rows["kraken"])
+        assert syms <= {"BTC", "ETH"}
+        # cross exchange transfers produce both legs
+        assert any(row[2] == "withdraw" for row in rows["binance"])
+        assert any(row[2] == "deposit" for row in rows["binance"])
+
+    def test_stub_prices(self):
+        p = txgen.StubPriceSource()
+        ts = txgen.SyntheticHistory().ts
+        assert p.gdax_price("BTC-USD", ts) > 0
+        assert p.binance_price("XRPBTC", ts) < 1
+        assert p.gdax_price("BTC-USD", ts) == p.gdax_price("BTC-USD", ts.replace(second=30))
@@ -0,0 +1,174 @@
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+import dateutil.tz
+import exchanges
+import pricestore
+import stats
+import txgen
+import txhistory
+
+
+class TestLedgerReplay(unittest.TestCase):
+    def test_expired_entries_are_logged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "unresolved.jsonl")
+            replay = txhistory.LedgerReplay(
+                costbasis_class=txhistory.AssetFifoCostBasis,
+                unresolved=txhistory.UnresolvedLog(path),
+            )
+            t0 = datetime(2018, 1, 1, tzinfo=dateutil.tz.tzutc())
+            replay.apply([t0, "other", "deposit", "BTC", Decimal(1)])
+            # withdrawal to a wallet we don't track
+            replay.apply([t0 + timedelta(days=1), "gdax", "withdrawal", "BTC", Decimal("-0.5")])
+            for day in range(2, 100):
+                replay.apply([t0 + timedelta(days=day), "other", "gift", "BTC", Decimal("0.01")])
+                assert replay.pending() <= 2
+            assert replay.pending() == 0
+            replay.finish()
+            assert len(replay.unresolved) == 2
+            with open(path) as f:
+                recs = [json.loads(line) for line in f]
+            assert [r["exchange"] for r in recs] == ["other", "gdax"]
+            assert recs[1]["amount"] == "-0.5"
+            assert recs[1]["reason"] == "expired"
+            report = replay.unresolved.as_dict()
+            assert [(r["kind"], r["exchange"], r["count"]) for r in report] == [
+                ("transfer", "gdax", 1),
+                ("transfer", "other", 1),
+            ]
+
+    def test_no_horizon_keeps_pending(self):
+        replay = txhistory.LedgerReplay(transfer_horizon=None)
+        t0 = datetime(2018, 1, 1, tzinfo=dateutil.tz.tzutc())
+        replay.apply([t0, "gdax", "withdrawal", "BTC", Decimal("-0.5")])
+        replay.apply([t0 + timedelta(days=400), "other", "gift", "BTC", Decimal("0.01")])
+        assert replay.pending() == 1
+        replay.finish()
+        assert replay.pending() == 0
+        assert replay.unresolved.as_dict()[0]["count"] == 1
+
+
+class TestStagedReplay(unittest.TestCase):
+    def test_same_as_serial(self):
+        prices = txgen.StubPriceSource(3)
+        restore = prices.install()
+        tmp = tempfile.TemporaryDirectory()
+        pricestore.use_store(pricestore.PriceStore(os.path.join(tmp.name, "prices.db")))
+        try:
+            rows = txgen.SyntheticHistory(seed=3, prices=prices).generate(3000)
+            # lose some legs so there are trades to expire and leave unmatched
+            rnd = random.Random(3)
+            rows = {src: [t for t in rows[src] if rnd.random() > 0.03] for src in rows}
+            txgen.write_pickles(rows, tmp.name)
+
+            def run(workers):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    costbasis, deposits = txhistory.match_trades(
+                        directory=tmp.name,
+                        costbasis_class=txhistory.AssetFifoCostBasis,
+                        workers=workers,
+                    )
+                with open(os.path.join(tmp.name, "unresolved.jsonl")) as f:
+                    unresolved = [json.loads(line) for line in f]
+                lots = {sym: (cb.balance, cb.profit_loss, list(cb.lots)) for sym, cb in costbasis.items()}
+                return deposits, lots, unresolved
+
+            serial = run(None)
+            assert {(r["kind"], r["reason"]) for r in serial[2]} >= {("trade", "expired"), ("trade", "unmatched")}
+            assert run(3) == serial
+        finally:
+            restore()
+            pricestore.default_store().close()
+            pricestore.use_store(None)
+            tmp.cleanup()
+
+    def test_prices_fetched_by_the_parent(self):
+        prices = txgen.StubPriceSource(5)
+        parent = os.getpid()
+        fetched = []
+
+        def stored(source, price):
+            def lookup(market, ts):
+                def fetch(start):
+                    # the workers only list what they miss
+                    assert os.getpid() == parent
+                    fetched.append((source, market, start))
+                    return price(market, start)
+
+                return exchanges.cached_price(source, market, ts, fetch)
+
+            return lookup
+
+        saved = exchanges.gdax_price, exchanges.binance_price
+        exchanges.gdax_price = stored("gdax", prices.gdax_price)
+        exchanges.binance_price = stored("binance", prices.binance_price)
+        tmp = tempfile.TemporaryDirectory()
+        pricestore.use_store(pricestore.PriceStore(os.path.join(tmp.name, "prices.db")))
+        try:
+            txgen.write_pickles(txgen.SyntheticHistory(seed=5, prices=prices).generate(1500), tmp.name)
+
+            def run(workers):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    costbasis, deposits = txhistory.match_trades(
+                        directory=tmp.name,
+                        costbasis_class=txhistory.AssetFifoCostBasis,
+                        workers=workers,
+                    )
+                return deposits, {sym: (cb.balance, cb.profit_loss, list(cb.lots)) for sym, cb in costbasis.items()}
+
+            stats.enable()
+            staged = run(3)
+            assert fetched
+            assert len(set(fetched)) == len(fetched)
+            # the workers' lookups are counted along with the parent's
+            assert sum(stats.counters["price_cache_miss"].values()) >= 2 * len(fetched)
+            stats.disable()
+            assert run(None) == staged
+
+            pricestore.default_store().close()
+            pricestore.use_store(pricestore.PriceStore(os.path.join(tmp.name, "empty.db")))
+            pricestore.set_offline()
+            with self.assertRaises(pricestore.PriceMiss):
+                run(3)
+        finally:
+            exchanges.gdax_price, exchanges.binance_price = saved
+            pricestore.set_offline(False)
+            stats.disable()
+            stats.reset()
+            pricestore.default_store().close()
+            pricestore.use_store(None)
+            tmp.cleanup()
+
+
+class TestScope(unittest.TestCase):
+    def test_scope_keeps_counter_legs(self):
+        t0 = datetime(2018, 1, 1, tzinfo=dateutil.tz.tzutc())
+        s = timedelta(seconds=1)
+        rows = [
+            [t0, "binance", "BUY", "XRP", Decimal(100)],
+            [t0 + s, "binance", "BUY", "BTC", Decimal("-0.01")],
+            [t0 + s, "binance", "commission", "BNB", Decimal("-0.1")],
+            [t0 + 60 * s, "gdax", "match", "ETH", Decimal(1)],
+            [t0 + 60 * s, "gdax", "match", "USD", Decimal(-500)],
+            [t0 + 90 * s, "kraken", "withdrawal", "XXBT", Decimal("-0.5")],
+            [t0 + 99 * s, "binance", "SELL", "NEO", Decimal(-1)],
+            [t0 + 99 * s, "binance", "SELL", "BTC", Decimal("0.001")],
+        ]
+        scoped = txhistory.scope_transactions(rows, symbols=["XRP"])
+        assert scoped == rows[:2]
+        scoped = txhistory.scope_transactions(rows, symbols=["BTC"])
+        assert scoped == sorted(rows[:2] + rows[5:])
+        assert txhistory.scope_transactions(rows, exchanges=["gdax"]) == rows[3:5]
+        assert txhistory.scope_transactions(rows, symbols=["BTC"], exchanges=["kraken"]) == [rows[5]]
+
+    def test_sources_for(self):
+        assert txhistory.sources_for(["kraken"]) == ["kraken", "other"]
+        assert txhistory.sources_for(["bofa"]) == ["coinbase", "other"]
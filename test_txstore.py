@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+import exchanges
+import txstore
+
+HEADER = "Date\tCurrency\tType\tUnits\tPrice\tAmount\tFee\tSettlement\n"
+LINES = [
+    '"2018-01-0212:34:56"\t"BTC"\t"BUY"\t"0.5 BTC"\t"20,000,000KRW"\t"10,000,000KRW"\t"-"\t"10,000,000KRW"\n',
+    "2018-01-0212:40:00\tXRP\tSELL\t1,000 XRP\t3,000KRW\t3,000,000KRW\t1.5XRP\t2,998,500KRW\n",
+    "2018-01-0212:41:00\tXRP\tTRANSFER\t1 XRP\t-\t-\t-\t0KRW\n",
+    "2018-01-03\tETH\n",
+]
+
+
+class TestTxStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.export = os.path.join(self.tmp.name, "bithumb.txt")
+        self.store = txstore.TxStore(os.path.join(self.tmp.name, "bithumb.tx"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_bithumb_numbers(self):
+        rows = exchanges.bithumb_chunk(LINES[:2])
+        assert [r[3:5] for r in rows] == [
+            ["BTC", Decimal("0.5")],
+            ["KRW", Decimal(-10000000)],
+            ["XRP", Decimal(-1000)],
+            ["KRW", Decimal(2998500)],
+        ]
+        assert rows[0][0].hour == 12 and rows[0][0].tzinfo is not None
+
+    def test_incremental_import(self):
+        with open(self.export, "w") as f:
+            f.write(HEADER + "".join(LINES) + LINES[1][:40])
+        errors = []
+        n = txstore.import_export(self.store, self.export, exchanges.bithumb_chunk, header=True, chunk_lines=2, errors=errors)
+        assert n == 4
+        assert [(lineno, reason.split(":")[0]) for lineno, line, reason in errors] == [(4, "ValueError"), (5, "ValueError")]
+        # the unfinished last line is picked up once it's complete
+        with open(self.export, "a") as f:
+            f.write(LINES[1][40:] + LINES[0])
+        store = txstore.TxStore(self.store.path)
+        assert txstore.import_export(store, self.export, exchanges.bithumb_chunk, header=True) == 4
+        assert len(store) == 8
+        assert store.rows()[:4] == exchanges.bithumb_chunk(LINES[:2])
+        assert txstore.import_export(store, self.export, exchanges.bithumb_chunk, header=True) == 0
+
+    def test_export_without_final_newline(self):
+        with open(self.export, "w") as f:
+            f.write(HEADER + LINES[0] + LINES[1].rstrip("\n"))
+        assert txstore.import_export(self.store, self.export, exchanges.bithumb_chunk, header=True) == 4
+        assert self.store.rows() == exchanges.bithumb_chunk([LINES[0], LINES[1].rstrip("\n")])
+        assert txstore.import_export(self.store, self.export, exchanges.bithumb_chunk, header=True) == 0
+        # once the export grows past it the last line is read again
+        with open(self.export, "a") as f:
+            f.write("\n" + LINES[0])
+        store = txstore.TxStore(self.store.path)
+        assert txstore.import_export(store, self.export, exchanges.bithumb_chunk, header=True) == 2
+        assert store.rows() == exchanges.bithumb_chunk(LINES[:2] + LINES[:1])
+
+    def test_rewritten_export_is_reimported(self):
+        with open(self.export, "w") as f:
+            f.write(HEADER + LINES[0])
+        txstore.import_export(self.store, self.export, exchanges.bithumb_chunk, header=True)
+        with open(self.export, "w") as f:
+            f.write(HEADER.lower() + LINES[1] + LINES[1])
+        txstore.import_export(self.store, self.export, exchanges.bithumb_chunk, header=True)
+        assert [r[3] for r in self.store.rows()] == ["XRP", "KRW", "XRP", "KRW"]
+
+    def test_interrupted_append(self):
+        self.store.append(exchanges.bithumb_chunk(LINES[:1]))
+        with open(self.store.path, "ab") as f:
+            f.write(b"half a chunk")
+        self.store.append(exchanges.bithumb_chunk(LINES[1:2]))
+        assert len(txstore.TxStore(self.store.path).rows()) == 4
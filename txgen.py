@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+
+import argparse
+import math
+import os
+import pickle
+import random
+import zlib
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+import dateutil.tz
+
+SOURCES = ["gdax", "coinbase", "binance", "kraken", "bittrex", "bithumb", "other"]
+
+# rough USD prices the stub random walk oscillates around
+BASE_USD = {
+    "BTC": 8000,
+    "ETH": 500,
+    "LTC": 120,
+    "BCH": 900,
+    "XRP": 0.6,
+    "ADA": 0.2,
+    "NEO": 60,
+    "TRX": 0.04,
+    "BNB": 10,
+    "OMG": 9,
+}
+
+GDAX_MARKETS = [("BTC", "USD"), ("ETH", "USD"), ("LTC", "USD"), ("ETH", "BTC"), ("LTC", "BTC")]
+BINANCE_ALTS = ["XRP", "ADA", "NEO", "TRX", "BNB", "OMG"]
+BITTREX_ALTS = ["XRP", "ADA", "NEO", "OMG"]
+BITHUMB_SYMS = ["BTC", "ETH", "XRP"]
+KRAKEN_SYMS = {"BTC": "XXBT", "ETH": "XETH"}
+KRW_PER_USD = 1165
+
+Q8 = Decimal("0.00000001")
+Q2 = Decimal("0.01")
+
+
+class StubPriceSource(object):
+    """deterministic offline stand-in for gdax_price/binance_price
+    prices are a smooth function of (symbol, minute) so repeated runs with
+    the same data always see the same prices
+    """
+
+    def __init__(self, seed=0):
+        rnd = random.Random(seed)
+        self.phase = {sym: rnd.uniform(0, 2 * math.pi) for sym in BASE_USD}
+        self.calls = 0
+
+    def usd(self, sym, ts):
+        if sym in ["USD", "USDT"]:
+            return 1.0
+        if sym == "KRW":
+            return 1 / KRW_PER_USD
+        minute = int(ts.timestamp()) // 60
+        phase = self.phase.get(sym, zlib.crc32(sym.encode()) % 628 / 100)
+        base = BASE_USD.get(sym, 1.0)
+        swing = 0.3 * math.sin(minute / 43200 + phase) + 0.05 * math.sin(minute / 720 + phase)
+        return base * math.exp(swing)
+
+    def gdax_price(self, market, ts):
+        self.calls += 1
+        base, quote = market.split("-")
+        return Decimal(self.usd(base, ts) / self.usd(quote, ts)).quantize(Q2)
+
+    def binance_price(self, market, ts):
+        self.calls += 1
+        for quote in ["BTC", "ETH", "USDT", "BNB"]:
+            if market.endswith(quote) and len(market) > len(quote):
+                base = market[: -len(quote)]
+                break
+        else:
+            raise ValueError(f"unknown binance market {market}")
+        if base == "BCC":
+            base = "BCH"
+        return Decimal(self.usd(base, ts) / self.usd(quote, ts)).quantize(Q8)
+
+    def install(self):
+        """point the exchanges price functions at this stub
+        returns a callable that restores the originals"""
+        import exchanges
+
+        saved = exchanges.gdax_price, exchanges.binance_price
+        exchanges.gdax_price = self.gdax_price
+        exchanges.binance_price = self.binance_price
+
+        def restore():
+            exchanges.gdax_price, exchanges.binance_price = saved
+
+        return restore
+
+
+class SyntheticHistory(object):
+    """seeded generator of multi-exchange transaction histories
+    rows have the same shape as the ones built by the *_transactions
+    functions in exchanges.py, keyed by source name like get_transactions
+    """
+
+    def __init__(self, seed=0, start=None, prices=None):
+        self.rnd = random.Random(seed)
+        self.prices = prices or StubPriceSource(seed)
+        self.ts = start or datetime(2017, 1, 1, tzinfo=dateutil.tz.tzutc())
+        self.rows = {src: [] for src in SOURCES}
+        self.nrows = 0
+        self.seq = 0
+        self.holdings = {
+            "coinbase": {},
+            "gdax": {},
+            "binance": {},
+            "kraken": {},
+            "bittrex": {},
+            "bithumb": {},
+        }
+
+    def _id(self):
+        self.seq += 1
+        return f"{self.seq:012x}"
+
+    def _add(self, src, row):
+        self.rows[src].append(row)
+        self.nrows += 1
+
+    def _hold(self, exch, sym, amount):
+        h = self.holdings[exch]
+        h[sym] = h.get(sym, Decimal(0)) + amount
+
+    def _held(self, exch, sym):
+        return self.holdings[exch].get(sym, Decimal(0))
+
+    def _usd_amount(self, lo, hi):
+        return Decimal(self.rnd.uniform(lo, hi)).quantize(Q2)
+
+    def _qty(self, usd, sym):
+        return (Decimal(usd) / Decimal(self.prices.usd(sym, self.ts))).quantize(Q8)
+
+    def _local(self, ts):
+        return ts.astimezone(dateutil.tz.tzlocal())
+
+    def _portion(self, exch, sym, lo=0.1, hi=0.6):
+        return (self._held(exch, sym) * Decimal(self.rnd.uniform(lo, hi))).quantize(Q8)
+
+    def coinbase_bank_buy(self):
+        sym = self.rnd.choice(["BTC", "ETH", "LTC"])
+        usd = self._usd_amount(50, 2500)
+        qty = self._qty(usd, sym)
+        tx = {
+            "id": self._id(),
+            "type": "buy",
+            "created_at": self.ts.isoformat(),
+            "amount": {"amount": str(qty), "currency": sym},
+            "native_amount": {"amount": str(usd), "currency": "USD"},
+            "details": {"payment_method_name": "Bank of America - Chk"},
+        }
+        self._add("coinbase", [self.ts, "bofa", "fiat_deposit", "USD", -usd, tx])
+        self._add("coinbase", [self.ts, "coinbase", "fiat_deposit", "USD", usd, tx])
+        self._add("coinbase", [self.ts, "coinbase", "buy", "USD", -usd, tx])
+        self._add("coinbase", [self.ts, "coinbase", "buy", sym, qty, tx])
+        self._hold("coinbase", sym, qty)
+
+    def gdax_deposit(self):
+        usd = self._usd_amount(500, 10000)
+        tx = {
+            "id": self._id(),
+            "type": "fiat_deposit",
+            "created_at": self.ts.isoformat(),
+            "amount": {"amount": str(usd), "currency": "USD"},
+            "native_amount": {"amount": str(usd), "currency": "USD"},
+        }
+        self._add("coinbase", [self.ts, "coinbase", "fiat_deposit", "USD", usd, tx])
+        self._add("coinbase", [self.ts, "bofa", "fiat_deposit", "USD", -usd, tx])
+        self._hold("coinbase", "USD", usd)
+        self.transfer("coinbase", "gdax", "USD", usd, network_fee=False)
+
+    def gdax_trade(self):
+        base, quote = self.rnd.choice(GDAX_MARKETS)
+        buy = self.rnd.random() < 0.5
+        price = self.prices.gdax_price(f"{base}-{quote}", self.ts)
+        if buy:
+            if self._held("gdax", quote) <= 0:
+                return False
+            cost = self._portion("gdax", quote)
+            size = (cost / price).quantize(Q8)
+        else:
+            if self._held("gdax", base) <= 0:
+                return False
+            size = self._portion("gdax", base)
+            cost = (size * price).quantize(Q8)
+        if not size or not cost:
+            return False
+        fee = (cost * Decimal("0.0025")).quantize(Q8)
+        details = {"order_id": self._id(), "trade_id": self.seq, "product_id": f"{base}-{quote}"}
+        sign = 1 if buy else -1
+        self._add("gdax", [self.ts, "gdax", "match", base, sign * size, details])
+        self._add("gdax", [self.ts, "gdax", "match", quote, -sign * cost, details])
+        self._add("gdax", [self.ts, "gdax", "fee", quote, -fee, details])
+        self._hold("gdax", base, sign * size)
+        self._hold("gdax", quote, -sign * cost - fee)
+        return True
+
+    def binance_trade(self):
+        alt = self.rnd.choice(BINANCE_ALTS)
+        quote = "BTC"
+        price = self.prices.binance_price(f"{alt}{quote}", self.ts)
+        ts = self._local(self.ts)
+        if self._held("binance", alt) > 0 and self.rnd.random() < 0.4:
+            qty = self._portion("binance", alt)
+            side = "sell"
+        elif self._held("binance", quote) > 0:
+            qty = (self._portion("binance", quote) / price).quantize(Q8)
+            side = "buy"
+        else:
+            return False
+        if not qty:
+            return False
+        fills = self.rnd.choice([1, 1, 1, 2, 3])
+        for i in range(fills):
+            part = (qty / fills).quantize(Q8)
+            fts = ts + timedelta(milliseconds=i)
+            commission = (part * Decimal("0.001")).quantize(Q8)
+            if side == "buy":
+                self._add("binance", [fts, "binance", "buy", quote, -part * price])
+                self._add("binance", [fts, "binance", "buy", alt, part])
+                self._add("binance", [fts, "binance", "commission", alt, -commission])
+                self._hold("binance", quote, -part * price)
+                self._hold("binance", alt, part - commission)
+            else:
+                self._add("binance", [fts, "binance", "sell", quote, part * price])
+                self._add("binance", [fts, "binance", "sell", alt, -part])
+                self._add("binance", [fts, "binance", "commission", quote, -commission * price])
+                self._hold("binance", quote, part * price - commission * price)
+                self._hold("binance", alt, -part)
+        return True
+
+    def kraken_trade(self):
+        if self._held("kraken", "ETH") > 0 and self.rnd.random() < 0.5:
+            src, dst = "ETH", "BTC"
+        elif self._held("kraken", "BTC") > 0:
+            src, dst = "BTC", "ETH"
+        else:
+            return False
+        amount = self._portion("kraken", src)
+        got = (amount * Decimal(self.prices.usd(src, self.ts) / self.prices.usd(dst, self.ts))).quantize(Q8)
+        fee = (got * Decimal("0.0026")).quantize(Q8)
+        ts = self._local(self.ts)
+        self._add("kraken", [ts, "kraken", "trade", KRAKEN_SYMS[src], -amount])
+        self._add("kraken", [ts, "kraken", "trade", KRAKEN_SYMS[dst], got])
+        self._add("kraken", [ts, "kraken", "fee", KRAKEN_SYMS[dst], -fee])
+        self._hold("kraken", src, -amount)
+        self._hold("kraken", dst, got - fee)
+        return True
+
+    def bittrex_trade(self):
+        alt = self.rnd.choice(BITTREX_ALTS)
+        rate = Decimal(self.prices.usd(alt, self.ts) / self.prices.usd("BTC", self.ts))
+        if self._held("bittrex", alt) > 0 and self.rnd.random() < 0.4:
+            order = "LIMIT_SELL"
+            qty = self._portion("bittrex", alt)
+        elif self._held("bittrex", "BTC") > 0:
+            order = "LIMIT_BUY"
+            qty = (self._portion("bittrex", "BTC") / rate).quantize(Q8)
+        else:
+            return False
+        price = (qty * rate).quantize(Q8)
+        commission = (price * Decimal("0.0025")).quantize(Q8)
+        if not qty or not price:
+            return False
+        closed = self.ts.strftime("%m/%d/%Y %I:%M:%S %p")
+        rec = [self._id(), f"BTC-{alt}", order, str(qty), str(rate.quantize(Q8)), str(commission), str(price), closed, closed]
+        if order == "LIMIT_BUY":
+            self._add("bittrex", [self.ts, "bittrex", order, "BTC", -price, rec])
+            self._add("bittrex", [self.ts, "bittrex", "fee", "BTC", -commission, rec])
+            self._add("bittrex", [self.ts, "bittrex", order, alt, qty, rec])
+            self._hold("bittrex", "BTC", -price - commission)
+            self._hold("bittrex", alt, qty)
+        else:
+            self._add("bittrex", [self.ts, "bittrex", order, "BTC", price, rec])
+            self._add("bittrex", [self.ts, "bittrex", "fee", "BTC", -commission, rec])
+            self._add("bittrex", [self.ts, "bittrex", order, alt, -qty, rec])
+            self._hold("bittrex", "BTC", price - commission)
+            self._hold("bittrex", alt, -qty)
+        return True
+
+    def bithumb_trade(self):
+        sym = self.rnd.choice(BITHUMB_SYMS)
+        krw_price = Decimal(self.prices.usd(sym, self.ts) * KRW_PER_USD)
+        if self._held("bithumb", sym) > 0 and self.rnd.random() < 0.5:
+            order = "SELL"
+            qty = self._portion("bithumb", sym)
+        elif self._held("bithumb", "KRW") > 0:
+            order = "BUY"
+            qty = (self._portion("bithumb", "KRW") / krw_price).quantize(Q8)
+        else:
+            return False
+        settlement = (qty * krw_price).quantize(Decimal(1))
+        if not qty or not settlement:
+            return False
+        ts = self._local(self.ts).replace(microsecond=0)
+        rec = [
+            ts.strftime("%Y-%m-%d%H:%M:%S"),
+            sym,
+            order,
+            f"{qty} {sym}",
+            f"{krw_price:,.0f}KRW",
+            f"{settlement:,}KRW",
+            "-",
+            f"{settlement:,}KRW\n",
+        ]
+        if order == "BUY":
+            self._add("bithumb", [ts, "bithumb", order, sym, qty, rec])
+            self._add("bithumb", [ts, "bithumb", order, "KRW", -settlement, rec])
+            self._hold("bithumb", sym, qty)
+            self._hold("bithumb", "KRW", -settlement)
+        else:
+            self._add("bithumb", [ts, "bithumb", order, sym, -qty, rec])
+            self._add("bithumb", [ts, "bithumb", order, "KRW", settlement, rec])
+            self._hold("bithumb", sym, -qty)
+            self._hold("bithumb", "KRW", settlement)
+        return True
+
+    def _withdraw_row(self, exch, sym, amount, ts, txtype=None):
+        """row recording amount (negative) leaving exch"""
+        if txtype:
+            tx = {"id": self._id(), "type": txtype, "created_at": ts.isoformat(),
+                  "amount": {"amount": str(amount), "currency": sym}}
+            return exch, [ts, exch, txtype, sym, amount, tx]
+        if exch == "coinbase":
+            tx = {"id": self._id(), "type": "send", "created_at": ts.isoformat(),
+                  "amount": {"amount": str(amount), "currency": sym}}
+            return "coinbase", [ts, "coinbase", "send", sym, amount, tx]
+        if exch == "gdax":
+            return "gdax", [ts, "gdax", "transfer", sym, amount, {"transfer_id": self._id(), "transfer_type": "withdraw"}]
+        if exch == "binance":
+            ts = self._local(ts)
+            tx = {"asset": sym, "amount": float(-amount), "successTime": int(ts.timestamp() * 1000), "id": self._id()}
+            return "binance", [ts, "binance", "withdraw", sym, amount, tx]
+        if exch == "kraken":
+            return "kraken", [self._local(ts), "kraken", "withdrawal", KRAKEN_SYMS[sym], amount]
+        if exch == "bittrex":
+            tx = {"Currency": sym, "Amount": float(-amount), "Opened": ts.isoformat(), "PaymentUuid": self._id()}
+            return "bittrex", [ts, "bittrex", "withdrawal", sym, amount, tx]
+        if exch == "bithumb":
+            ts = self._local(ts).replace(microsecond=0)
+            rec = [ts.strftime("%Y-%m-%d%H:%M:%S"), sym, "WITHDRAWAL", f"{-amount} {sym}", "-", "-", "-", "0KRW\n"]
+            return "bithumb", [ts, "bithumb", "withdrawal", sym, amount, rec]
+        raise ValueError(exch)
+
+    def _deposit_row(self, exch, sym, amount, ts):
+        src, row = self._withdraw_row(exch, sym, -amount, ts)
+        row[2] = {
+            "coinbase": "send",
+            "gdax": "transfer",
+            "binance": "deposit",
+            "kraken": "deposit",
+            "bittrex": "deposit",
+            "bithumb": "deposit",
+        }[exch]
+        row[4] = amount
+        if exch == "bittrex":
+            row[0] = ts
+            row[5] = {"Currency": sym, "Amount": float(amount), "LastUpdated": ts.isoformat(), "TxId": self._id()}
+        if exch == "bithumb":
+            row[5][2] = "DEPOSIT"
+        return src, row
+
+    def transfer(self, src, dst, sym, amount, network_fee=True):
+        """move amount of sym from src to dst, the deposit lands a few
+        minutes later minus a network fee"""
+        if not amount:
+            return False
+        fee = (amount * Decimal(self.rnd.uniform(0.0005, 0.01))).quantize(Q8) if network_fee else Decimal(0)
+        arrival = self.ts + timedelta(seconds=self.rnd.randint(60, 1800))
+        # coinbase <-> gdax moves show up as exchange_withdrawal on coinbase
+        txtype = "exchange_withdrawal" if (src, dst) == ("coinbase", "gdax") else None
+        s, row = self._withdraw_row(src, sym, -amount, self.ts, txtype=txtype)
+        self._add(s, row)
+        d, row = self._deposit_row(dst, sym, amount - fee, arrival)
+        self._add(d, row)
+        self._hold(src, sym, -amount)
+        self._hold(dst, sym, amount - fee)
+        return True
+
+    def cross_transfer(self):
+        routes = [
+            ("coinbase", "gdax", "BTC"),
+            ("coinbase", "binance", "BTC"),
+            ("coinbase", "bittrex", "BTC"),
+            ("coinbase", "kraken", "ETH"),
+            ("coinbase", "bithumb", "BTC"),
+            ("gdax", "binance", "BTC"),
+            ("gdax", "kraken", "BTC"),
+            ("binance", "bittrex", "BTC"),
+            ("bittrex", "binance", "BTC"),
+            ("kraken", "gdax", "ETH"),
+            ("bithumb", "binance", "XRP"),
+            ("binance", "gdax", "BTC"),
+        ]
+        src, dst, sym = self.rnd.choice(routes)
+        if self._held(src, sym) <= 0:
+            return False
+        return self.transfer(src, dst, sym, self._portion(src, sym, 0.3, 0.9))
+
+    def misc(self):
+        if self.rnd.random() < 0.7:
+            sym = self.rnd.choice(["BTC", "ETH"])
+            amount = self._qty(self._usd_amount(5, 200), sym)
+            self._add("other", [self._local(self.ts), "wallet", "gift", sym, amount])
+            return True
+        exch = self.rnd.choice(["binance", "bittrex"])
+        sym = "BTC"
+        if self._held(exch, sym) <= 0:
+            return False
+        amount = self._portion(exch, sym, 0.01, 0.05)
+        self._add("other", [self._local(self.ts), exch, "loss", sym, -amount])
+        self._hold(exch, sym, -amount)
+        return True
+
+    def step(self):
+        self.ts += timedelta(seconds=self.rnd.randint(15, 900), microseconds=self.rnd.randint(0, 999999))
+        r = self.rnd.random()
+        if r < 0.06 or not self.holdings["coinbase"]:
+            self.coinbase_bank_buy()
+        elif r < 0.08:
+            self.gdax_deposit()
+        elif r < 0.16:
+            self.cross_transfer()
+        elif r < 0.18:
+            self.misc()
+        else:
+            self.rnd.choice(
+                [
+                    self.gdax_trade,
+                    self.gdax_trade,
+                    self.binance_trade,
+                    self.binance_trade,
+                    self.binance_trade,
+                    self.kraken_trade,
+                    self.bittrex_trade,
+                    self.bithumb_trade,
+                ]
+            )()
+
+    def generate(self, nrows):
+        while self.nrows < nrows:
+            self.step()
+        return self.rows
+
+
+def write_pickles(rows, directory="."):
+    """write rows in the {source}.pickle layout get_all_transactions reads"""
+    os.makedirs(directory, exist_ok=True)
+    for src, t in rows.items():
+        with open(os.path.join(directory, f"{src}.pickle"), "wb") as f:
+            pickle.dump(t, f)
+
+
+EXPORT_HEADERS = {
+    "bithumb": "Date\tCurrency\tType\tUnits\tPrice\tAmount\tFee\tSettlement\n",
+    "bittrex": "OrderUuid\tExchange\tType\tQuantity\tLimit\tCommissionPaid\tPrice\tOpened\tClosed\n",
+}
+
+
+def write_exports(rows, directory="."):
+    """write the bithumb and bittrex trades as the tsv exports those
+    exchanges hand out, each line once however many rows it made, returns
+    the number of lines"""
+    os.makedirs(directory, exist_ok=True)
+    n = 0
+    for src, header in EXPORT_HEADERS.items():
+        seen = set()
+        with open(os.path.join(directory, f"{src}.txt"), "w", encoding="utf-8") as f:
+            f.write(header)
+            for t in rows.get(src, []):
+                if not isinstance(t[-1], list) or id(t[-1]) in seen:
+                    continue
+                seen.add(id(t[-1]))
+                line = "\t".join(t[-1])
+                f.write(line if line.endswith("\n") else line + "\n")
+                n += 1
+    return n
+
+
+def generate(nrows, seed=0, start=None):
+    return SyntheticHistory(seed=seed, start=start).generate(nrows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="write a synthetic transaction history")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic")
+    parser.add_argument("--exports", action="store_true", help="also write the bithumb and bittrex tsv exports")
+    args = parser.parse_args()
+    rows = generate(args.rows, seed=args.seed)
+    write_pickles(rows, args.out)
+    if args.exports:
+        write_exports(rows, args.out)
+    for src, t in rows.items():
+        print(f"{src} {len(t)} rows")
@@ -1,17 +1,29 @@
 #!/usr/bin/env python
 
+import contextlib
+import io
+import json
+import os
 import sys
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from pprint import pprint
+from time import perf_counter
 from datetime import datetime
 from datetime import timedelta
 import dateutil.tz
 from decimal import Decimal
 from collections import defaultdict
+from itertools import takewhile
 from exchanges import (
     get_all_transactions,
+    SOURCES,
+    sources_for,
+    source_files,
     normalize_txtype,
     normalize_sym,
-    get_current_usd,
+    order_id,
+    get_current_usd_many,
 )
 from ledger import (
     AssetTradeMatcher,
@@ -22,6 +34,24 @@ from ledger import (
     AssetLedgerEntry,
     AssetBalance,
 )
+import stats
+import pricestore
+import ledger
+import exchanges as exchanges_module
+import txstore
+import resultcache
+
+# how long an entry may wait for its match before it is moved to the
+# unresolved log, the legs of one trade arrive within seconds but bank
+# transfers and slow withdrawals can take days
+TRADE_HORIZON = timedelta(days=1)
+TRANSFER_HORIZON = timedelta(days=30)
+# results cached by match_trades depend on the code in these too
+CODE_FILES = [ledger.__file__, exchanges_module.__file__, txstore.__file__, __file__]
+# where in a row of the replay the settled trades of a staged replay go,
+# before the row, in the resolve after it, expiry after that, and at the end
+SEAL, RESOLVE, EXPIRE, UNMATCHED = range(4)
+COSTBASIS_METHODS = ["trade", "buy", "sell", "buy_lot", "sell_from_lot", "fee", "loss", "transfer", "get_tx", "insert_tx"]
 
 
 class keydefaultdict(defaultdict):
@@ -34,30 +64,445 @@ class keydefaultdict(defaultdict):
         return ret
 
 
-def do_resolve(tradematchers, transfermatchers, costbasis):
+class Tee(object):
+    """a stream that also keeps a copy of what's written to it"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.copy = io.StringIO()
+
+    def write(self, s):
+        self.copy.write(s)
+        return self.stream.write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def do_resolve(tradematchers, transfermatchers, costbasis, now=None):
+    if stats.enabled:
+        stats.incr("do_resolve")
+        stats.sample("pending_trades", sum(len(tm.tx) for tm in tradematchers.values()))
+        stats.sample("pending_transfers", sum(len(tm.tx) for tm in transfermatchers.values()))
+        start = perf_counter()
     newtradematchers = defaultdict(AssetTradeMatcher)
     for exch, tm in tradematchers.items():
-        result = tm.resolve(costbasis)
+        result = tm.resolve(costbasis, now)
         if result > 0:
             newtradematchers[exch] = tm
+    if stats.enabled:
+        mid = perf_counter()
+        stats.add_time("matcher", "trade", mid - start)
     newtransfermatchers = defaultdict(AssetTransferMatcher)
     for sym, tm in transfermatchers.items():
         result = tm.resolve(costbasis)
         if result > 0:
             newtransfermatchers[sym] = tm
+    if stats.enabled:
+        stats.add_time("matcher", "transfer", perf_counter() - mid)
     return newtradematchers, newtransfermatchers, costbasis
 
 
-def match_trades(cutoff_date=None, reset_pl_date=None, costbasis_class=AssetLifoCostBasis):
-    transactions = get_all_transactions()
-    prev_date = None
-    tradematchers = defaultdict(AssetTradeMatcher)
-    transfermatchers = defaultdict(AssetTransferMatcher)
-    costbasis = keydefaultdict(costbasis_class)
-    exch_balance = defaultdict(lambda: keydefaultdict(AssetBalance))
-    deposits = Decimal(0)
+class TradeLog(object):
+    """stands in for the cost basis in a matching worker, the priced trades
+    a matcher settles are recorded instead of applied"""
+
+    def __init__(self):
+        self.ops = []
+        self.sym = None
+
+    def __getitem__(self, sym):
+        self.sym = sym
+        return self
+
+    def trade(self, amount, usd_unit_price, date):
+        self.ops.append((self.sym, amount, usd_unit_price, date))
+
+    def take(self):
+        ops, self.ops = self.ops, []
+        return ops
+
+
+def match_exchange(legs, clock, start, trade_horizon=TRADE_HORIZON):
+    """match and price the trade legs of one exchange exactly as a
+    LedgerReplay would, phase one of a staged replay
+
+    legs is [(index, row)] of the exchange's trade rows, clock the date of
+    every row of the replay and start the index of the first row followed
+    by a resolve. returns [(index, phase, rank, kind, payload)], kind
+    "trades" with [(sym, amount, usd, date)] to apply to the cost basis or
+    "expired"/"unmatched" with the entries given up on. rank is the index
+    of the row that put the matcher in the replay's dict, the order
+    matchers are resolved in"""
+    tm = AssetTradeMatcher()
+    log = TradeLog()
+    events = []
+    entries = {}
+    for index, t in legs:
+        entries[index] = AssetLedgerEntry(
+            date=t[0],
+            exchange=t[1],
+            txtype="trade",
+            sym=normalize_sym(t[3]),
+            amount=t[4],
+            order=order_id(t),
+        )
+    rank = None
+    filling = None
+
+    def emit(index, phase, kind, payload):
+        if payload:
+            events.append((index, phase, rank, kind, payload))
+
+    end = len(clock)
+    indices = sorted(entries)
+    index = indices[0] if indices else end
+    while index < end:
+        now = clock[index]
+        entry = entries.get(index)
+        leg = entry.date if entry is not None else None
+        if filling is not None and filling != leg and rank is not None:
+            tm.resolve(log, filling, sealed=True)
+            emit(index, SEAL, "trades", log.take())
+        filling = leg
+        if entry is not None:
+            if rank is None:
+                rank = index
+            tm.add(entry)
+        if index >= start and rank is not None:
+            pending = tm.resolve(log, now)
+            emit(index, RESOLVE, "trades", log.take())
+            if not pending:
+                rank = None
+            elif trade_horizon:
+                emit(index, EXPIRE, "expired", tm.expire(now - trade_horizon))
+                if not tm.tx:
+                    rank = None
+        # skip the rows nothing can happen at, only the next leg, the row
+        # after a leg and the rows the matcher's groups wait for matter
+        following = bisect_right(indices, index)
+        step = indices[following] if following < len(indices) else end
+        if filling is not None:
+            step = index + 1
+        elif rank is not None and index < start:
+            step = min(step, start)
+        elif rank is not None:
+            until = tm.quiet_until(now, trade_horizon)
+            if until is not None:
+                step = min(step, bisect_right(clock, until, index + 1))
+        index = step
+    if rank is not None:
+        pending = tm.resolve(log, None)
+        emit(end, RESOLVE, "trades", log.take())
+        if pending and trade_horizon:
+            emit(end, EXPIRE, "expired", tm.expire(clock[-1] - trade_horizon))
+        emit(end, UNMATCHED, "unmatched", tm.tx)
+    return events
+
+
+def init_matcher(db_path, collect_stats):
+    pricestore.use_store(pricestore.PriceStore(db_path, readonly=True))
+    pricestore.collect_misses()
+    if collect_stats:
+        stats.enable()
+
+
+def match_exchange_worker(legs, clock, start, trade_horizon):
+    """match_exchange in a worker, returns (events, misses, stats)
+    events is None if placeholder prices derailed the matching"""
+    pricestore.misses.clear()
+    stats.reset()
+    try:
+        events = match_exchange(legs, clock, start, trade_horizon)
+    except Exception:
+        if not pricestore.misses:
+            raise
+        events = None
+    return events, set(pricestore.misses), stats.snapshot() if stats.enabled else None
+
+
+def match_exchanges(rows, prev_date, trade_horizon=TRADE_HORIZON, workers=None, max_rounds=5):
+    """phase one of a staged replay, each exchange's trade legs matched
+    and priced in a worker process of its own
+
+    rows are the sorted rows the replay will apply and prev_date the date
+    its resolving counts from. the workers only read the price store and
+    list the prices it lacks, which are fetched here between rounds the
+    way batch.run does, so every api call goes through this process's
+    rate limits, and the exchanges that missed any are matched again.
+    offline a missing price raises PriceMiss, and when this process is
+    collecting misses itself they are passed on instead of fetched.
+    the events of all exchanges are merged into
+    {(index, phase): [(exchange, kind, payload)]} in the order the serial
+    replay would have applied them, for LedgerReplay(trades=)"""
+    clock = [t[0] for t in rows]
+    start = len(clock)
+    for index, date in enumerate(clock):
+        if date - prev_date > timedelta(seconds=10):
+            start = index
+            break
+    legs = defaultdict(list)
+    for index, t in enumerate(rows):
+        if normalize_txtype(t[2]) == "trade":
+            legs[t[1]].append((index, t))
+    if not legs:
+        return {}
+    store = pricestore.default_store()
+    matched = {}
+    todo = list(legs)
+    for attempt in range(max_rounds):
+        misses = set()
+        retry = []
+        with ProcessPoolExecutor(
+            max_workers=min(workers or len(todo), len(todo)),
+            initializer=init_matcher,
+            initargs=(store.path, stats.enabled),
+        ) as pool:
+            futures = {
+                exchange: pool.submit(match_exchange_worker, legs[exchange], clock, start, trade_horizon)
+                for exchange in todo
+            }
+            for exchange, future in futures.items():
+                events, missing, worker_stats = future.result()
+                if worker_stats is not None:
+                    stats.merge(worker_stats)
+                matched[exchange] = events
+                if missing:
+                    misses |= missing
+                    retry.append(exchange)
+        if not misses:
+            break
+        if pricestore.misses is not None:
+            # the placeholders stand, as they would in a serial replay
+            pricestore.misses.update(misses)
+            if any(matched[exchange] is None for exchange in retry):
+                raise LookupError(f"{len(misses)} prices missing, the trades can't be matched without them")
+            break
+        if pricestore.offline:
+            raise pricestore.PriceMiss(*min(misses, key=lambda m: (m[2], m[0], m[1])))
+        failed = exchanges_module.fetch_misses(store, misses)
+        if failed:
+            raise failed[min(failed, key=lambda m: (m[2], m[0], m[1]))]
+        todo = retry
+    else:
+        raise LookupError(f"prices still missing after {max_rounds} rounds of matching trades")
+    merged = []
+    for exchange, events in matched.items():
+        merged += [(index, phase, rank, exchange, kind, payload) for index, phase, rank, kind, payload in events]
+    merged.sort(key=lambda e: e[:3])
+    trades = defaultdict(list)
+    for index, phase, rank, exchange, kind, payload in merged:
+        trades[(index, phase)].append((exchange, kind, payload))
+    return trades
+
+
+def argval(name, default=None):
+    """value of a --name=value command line argument"""
+    for arg in sys.argv:
+        if arg.startswith(f"--{name}="):
+            return arg.split("=", 1)[1]
+    if f"--{name}" in sys.argv:
+        return default
+    return None
+
+
+def scope_transactions(transactions, symbols=None, exchanges=None, time_tolerance=timedelta(seconds=2)):
+    """the rows a replay of just symbols and/or exchanges depends on, sorted
+
+    rows of other exchanges are dropped. trade legs are grouped per
+    exchange into clusters of rows at most time_tolerance apart, the same
+    window the trade matcher pairs legs in, and a cluster is kept when any
+    leg is one of symbols so every kept leg still has its counter leg.
+    fees, transfers and the rest only move their own symbol's balance and
+    are kept when it is one of symbols
+    """
+    rows = sorted(transactions)
+    if exchanges:
+        rows = [t for t in rows if t[1] in exchanges]
+    if not symbols:
+        return rows
+    symbols = set(symbols)
+    keep = [False] * len(rows)
+    clusters = {}
+    for i, t in enumerate(rows):
+        sym = normalize_sym(t[3])
+        if normalize_txtype(t[2]) != "trade":
+            keep[i] = sym in symbols
+            continue
+        cluster = clusters.get(t[1])
+        if cluster is None or t[0] - cluster["last"] > time_tolerance:
+            cluster = clusters[t[1]] = {"rows": [], "wanted": False}
+        cluster["rows"].append(i)
+        cluster["last"] = t[0]
+        if sym in symbols:
+            cluster["wanted"] = True
+        if cluster["wanted"]:
+            for j in cluster["rows"]:
+                keep[j] = True
+            cluster["rows"] = []
+    return [t for t, k in zip(rows, keep) if k]
+
+
+def exchange_balances():
+    return keydefaultdict(AssetBalance)
+
+
+class UnresolvedLog(object):
+    """matcher entries that never found a match
+
+    entries are appended to a jsonl file as they leave the matchers, only
+    per (kind, exchange, sym) totals stay in memory. with no path just the
+    totals are kept
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.totals = {}
+        if path:
+            open(path, "w").close()
+
+    def add(self, kind, key, entries, reason):
+        if not entries:
+            return
+        if stats.enabled:
+            stats.incr("unresolved", f"{kind} {reason}")
+        for e in entries:
+            t = self.totals.setdefault((kind, e.exchange, e.sym), [0, Decimal(0), e.date, e.date])
+            t[0] += 1
+            t[1] += e.amount
+            t[2] = min(t[2], e.date)
+            t[3] = max(t[3], e.date)
+        if self.path:
+            with open(self.path, "a") as f:
+                for e in entries:
+                    rec = {
+                        "kind": kind,
+                        "matcher": key,
+                        "reason": reason,
+                        "date": e.date.isoformat(),
+                        "exchange": e.exchange,
+                        "txtype": e.txtype,
+                        "sym": e.sym,
+                        "amount": str(e.amount),
+                    }
+                    f.write(json.dumps(rec) + "\n")
 
-    for t in sorted(transactions):
+    def __len__(self):
+        return sum(t[0] for t in self.totals.values())
+
+    def as_dict(self):
+        return [
+            {
+                "kind": kind,
+                "exchange": exch,
+                "sym": sym,
+                "count": t[0],
+                "amount": str(t[1]),
+                "first": t[2].isoformat(),
+                "last": t[3].isoformat(),
+            }
+            for (kind, exch, sym), t in sorted(self.totals.items())
+        ]
+
+    def report(self, file=None):
+        file = file or sys.stdout
+        print(f"{len(self)} unresolved entries", file=file)
+        for (kind, exch, sym), t in sorted(self.totals.items()):
+            print(
+                f"  {kind:8} {exch:10} {sym:6} {t[0]:6} entries net {t[1]:0.8f}"
+                f" {t[2]:%Y-%m-%d} .. {t[3]:%Y-%m-%d}",
+                file=file,
+            )
+        if self.path:
+            print(f"every entry is listed in {self.path}", file=file)
+
+
+class LedgerReplay(object):
+    """the state match_trades builds while replaying transactions in
+    date order, kept as an object so it can be fed incrementally
+
+    entries older than their horizon are moved out of the matchers into
+    unresolved, so the pending lists stay small however long the history
+
+    with trades from match_exchanges the trade legs aren't matched here,
+    the settled trades are applied at the point of the replay they were
+    settled at instead
+    """
+
+    def __init__(
+        self,
+        costbasis_class=AssetLifoCostBasis,
+        reset_pl_date=None,
+        trade_horizon=TRADE_HORIZON,
+        transfer_horizon=TRANSFER_HORIZON,
+        unresolved=None,
+        trades=None,
+    ):
+        self.trade_horizon = trade_horizon
+        self.transfer_horizon = transfer_horizon
+        self.unresolved = unresolved if unresolved is not None else UnresolvedLog()
+        self.prev_date = None
+        self.last_date = None
+        # (exchange, date) of the last trade leg applied
+        self.filling = None
+        self.trades = trades
+        # rows applied so far
+        self.index = 0
+        self.reset_pl_date = reset_pl_date
+        self.tradematchers = defaultdict(AssetTradeMatcher)
+        self.transfermatchers = defaultdict(AssetTransferMatcher)
+        self.costbasis = keydefaultdict(costbasis_class)
+        self.exch_balance = defaultdict(exchange_balances)
+        self.deposits = Decimal(0)
+
+    def pending(self):
+        return sum(len(tm.tx) for tm in self.tradematchers.values()) + sum(
+            len(tm.tx) for tm in self.transfermatchers.values()
+        )
+
+    def resolve(self, final=False):
+        """final settles trades still open to more legs too"""
+        self.replay_trades(RESOLVE)
+        self.tradematchers, self.transfermatchers, self.costbasis = do_resolve(
+            self.tradematchers, self.transfermatchers, self.costbasis, None if final else self.last_date
+        )
+        if self.last_date:
+            self.replay_trades(EXPIRE)
+            self.expire(self.last_date)
+
+    def expire(self, now):
+        for kind, matchers, horizon in [
+            ("trade", self.tradematchers, self.trade_horizon),
+            ("transfer", self.transfermatchers, self.transfer_horizon),
+        ]:
+            if not horizon:
+                continue
+            for key in list(matchers):
+                self.unresolved.add(kind, key, matchers[key].expire(now - horizon), "expired")
+                if not matchers[key].tx:
+                    del matchers[key]
+
+    def finish(self):
+        """resolve what can be and log everything still pending"""
+        self.resolve(final=True)
+        self.replay_trades(UNMATCHED)
+        for kind, matchers in [("trade", self.tradematchers), ("transfer", self.transfermatchers)]:
+            for key, tm in matchers.items():
+                self.unresolved.add(kind, key, tm.tx, "unmatched")
+                tm.tx = []
+            matchers.clear()
+
+    def replay_trades(self, phase):
+        if self.trades is None:
+            return
+        for exchange, kind, payload in self.trades.pop((self.index, phase), ()):
+            if kind == "trades":
+                for sym, amount, usd, date in payload:
+                    self.costbasis[sym].trade(amount, usd, date)
+            else:
+                self.unresolved.add("trade", exchange, payload, kind)
+
+    def apply(self, t):
         entry = AssetLedgerEntry(
             date=t[0],
             exchange=t[1],
@@ -65,49 +510,224 @@ def match_trades(cutoff_date=None, reset_pl_date=None, costbasis_class=AssetLifo
             sym=normalize_sym(t[3]),
             amount=t[4],
         )
-        if cutoff_date and entry.date > cutoff_date:
-            break
-        if reset_pl_date and entry.date > reset_pl_date:
+        costbasis = self.costbasis
+        leg = (entry.exchange, entry.date) if entry.txtype == "trade" else None
+        self.replay_trades(SEAL)
+        if self.filling and self.filling != leg:
+            # rows come sorted, so the legs of the instant being filled are all in
+            exchange, date = self.filling
+            if exchange in self.tradematchers:
+                self.tradematchers[exchange].resolve(costbasis, date, sealed=True)
+        self.filling = leg
+        if self.reset_pl_date and entry.date > self.reset_pl_date:
             for cbsym, cb in costbasis.items():
                 cb.profit_loss = Decimal(0)
-            reset_pl_date = None
-        if not prev_date:
-            prev_date = entry.date
+                cb.short_term_pl = Decimal(0)
+                cb.long_term_pl = Decimal(0)
+            self.reset_pl_date = None
+        if not self.prev_date:
+            self.prev_date = entry.date
+        self.last_date = entry.date
 
-        exch_balance[entry.exchange][entry.sym].balance += entry.amount
+        self.exch_balance[entry.exchange][entry.sym].balance += entry.amount
         if entry.txtype == "gift":
             costbasis[entry.sym].transfer(entry.amount, entry.date)
             if entry.exchange == "bofa":
-                deposits += entry.amount
+                self.deposits += entry.amount
         elif entry.txtype == "transfer":
             if entry.exchange == "bofa":
-                deposits += entry.amount
+                self.deposits += entry.amount
             else:
                 costbasis[entry.sym].transfer(entry.amount, entry.date)
-            transfermatchers[entry.sym].tx.append(entry)
+            self.transfermatchers[entry.sym].tx.append(entry)
         elif entry.txtype in ["fee"]:
             costbasis[entry.sym].fee(entry.amount, entry.date, txtype="exchange_fee")
         elif entry.txtype in ["loss"]:
             costbasis[entry.sym].loss(entry.amount, entry.date)
         elif entry.txtype == "trade":
-            tradematchers[entry.exchange].tx.append(entry)
+            if self.trades is None:
+                entry.order = order_id(t)
+                self.tradematchers[entry.exchange].add(entry)
         else:
             print(f"unknown txtype {entry.txtype} for {entry}")
 
-        if entry.date - prev_date > timedelta(seconds=10):
-            tradematchers, transfermatchers, costbasis = do_resolve(
-                tradematchers, transfermatchers, costbasis
-            )
-    tradematchers, transfermatchers, costbasis = do_resolve(
-        tradematchers, transfermatchers, costbasis
-    )
-    if len(tradematchers) > 0:
-        print(f"unresolved trades! {tradematchers}")
-    if len(transfermatchers) > 0:
-        print(f"unresolved transfers! {transfermatchers}")
+        if entry.date - self.prev_date > timedelta(seconds=10):
+            self.resolve()
+        self.index += 1
+
+
+def match_trades(
+    cutoff_date=None,
+    reset_pl_date=None,
+    costbasis_class=AssetLifoCostBasis,
+    directory=".",
+    sources=SOURCES,
+    trade_horizon=TRADE_HORIZON,
+    transfer_horizon=TRANSFER_HORIZON,
+    unresolved_path="unresolved.jsonl",
+    symbols=None,
+    exchanges=None,
+    cache=None,
+    workers=None,
+):
+    """replay every transaction, returns (costbasis by sym, deposits)
+    entries that never match are written to unresolved_path, relative to
+    directory, and summarized at the end
+
+    symbols and exchanges narrow the replay to the rows those depend on,
+    see scope_transactions, and the result to the costbasis of symbols
+
+    with a ResultCache the result of a replay with the same arguments over
+    the same source files and price store version is reused, what the
+    replay printed is printed again and unresolved_path rewritten
+
+    with workers the trade legs of each exchange are matched and priced in
+    up to that many processes before the replay, see match_exchanges, the
+    result is the same as without"""
+    if stats.enabled:
+        stats.instrument(costbasis_class, COSTBASIS_METHODS)
+        # a profiled run wants the real work
+        cache = None
+    if exchanges:
+        sources = sources_for(exchanges, sources)
+    args = {
+        "cutoff_date": cutoff_date,
+        "reset_pl_date": reset_pl_date,
+        "costbasis_class": f"{costbasis_class.__module__}.{costbasis_class.__qualname__}",
+        "trade_horizon": trade_horizon,
+        "transfer_horizon": transfer_horizon,
+        "symbols": symbols,
+        "exchanges": exchanges,
+        "unresolved_path": unresolved_path,
+    }
+    unresolved_file = os.path.join(directory, unresolved_path) if unresolved_path else None
+    inputs = None
+    if cache is not None:
+        # taken before the replay reads the sources, rows appended while
+        # it runs must not be credited to its result
+        inputs = input_watermarks(directory, sources)
+        key = result_key(inputs, args) if inputs else None
+        hit = cache.get(key) if key else None
+        if hit is not None:
+            costbasis, deposits, unresolved, output, unresolved_lines = hit
+            sys.stdout.write(output)
+            if unresolved_file:
+                with open(unresolved_file, "w") as f:
+                    f.write(unresolved_lines)
+            if len(unresolved):
+                unresolved.report()
+            return costbasis, deposits
+    # the cost basis classes print the report as they go, a cached
+    # result has to be able to print it again
+    tee = Tee(sys.stdout) if cache is not None else None
+    with contextlib.redirect_stdout(tee) if tee else contextlib.nullcontext():
+        costbasis, deposits, unresolved = replay_transactions(
+            directory,
+            sources,
+            cutoff_date=cutoff_date,
+            reset_pl_date=reset_pl_date,
+            costbasis_class=costbasis_class,
+            trade_horizon=trade_horizon,
+            transfer_horizon=transfer_horizon,
+            unresolved_file=unresolved_file,
+            symbols=symbols,
+            exchanges=exchanges,
+            workers=workers,
+        )
+    if len(unresolved):
+        unresolved.report()
+    # placeholder prices never make it into the cache
+    if cache is not None and not pricestore.misses:
+        key = result_key(inputs, args) if inputs else None
+        if key:
+            unresolved_lines = ""
+            if unresolved_file:
+                with open(unresolved_file) as f:
+                    unresolved_lines = f.read()
+            cache.put(key, (costbasis, deposits, unresolved, tee.copy.getvalue(), unresolved_lines))
     return costbasis, deposits
 
 
+def replay_transactions(
+    directory,
+    sources,
+    cutoff_date=None,
+    reset_pl_date=None,
+    costbasis_class=AssetLifoCostBasis,
+    trade_horizon=TRADE_HORIZON,
+    transfer_horizon=TRANSFER_HORIZON,
+    unresolved_file=None,
+    symbols=None,
+    exchanges=None,
+    workers=None,
+):
+    """the replay match_trades runs, returns (costbasis, deposits, unresolved)"""
+    transactions = get_all_transactions(directory=directory, sources=sources)
+    first_date = min((t[0] for t in transactions), default=None)
+    if symbols or exchanges:
+        transactions = scope_transactions(transactions, symbols=symbols, exchanges=exchanges)
+    else:
+        transactions = sorted(transactions)
+    unresolved = UnresolvedLog(unresolved_file)
+    replay = LedgerReplay(
+        costbasis_class=costbasis_class,
+        reset_pl_date=reset_pl_date,
+        trade_horizon=trade_horizon,
+        transfer_horizon=transfer_horizon,
+        unresolved=unresolved,
+    )
+    # resolving starts 10s into the history, not into the scoped rows
+    replay.prev_date = first_date
+
+    if cutoff_date:
+        transactions = list(takewhile(lambda t: t[0] <= cutoff_date, transactions))
+    if workers:
+        replay.trades = match_exchanges(transactions, first_date, trade_horizon, workers)
+    for t in transactions:
+        replay.apply(t)
+    replay.finish()
+    costbasis = replay.costbasis
+    if symbols:
+        # counter leg symbols only saw part of their history
+        costbasis = {sym: replay.costbasis[sym] for sym in symbols}
+    return costbasis, replay.deposits, unresolved
+
+
+def input_watermarks(directory, sources):
+    """what a match_trades run's sources look like now, None when a source
+    would come from an exchange's api"""
+    inputs = {}
+    for src in sources:
+        files = source_files(src, directory)
+        if files is None:
+            return None
+        inputs[src] = [resultcache.watermark(f) for f in files]
+    # watermarks only name files, copies of a portfolio can share them
+    return {"directory": os.path.abspath(directory), "files": inputs}
+
+
+def result_key(inputs, args):
+    """cache key of a match_trades run over input_watermarks inputs, with
+    the price store's version as it is now"""
+    store = pricestore.default_store()
+    return resultcache.ResultCache.key(
+        inputs=inputs,
+        prices=[os.path.abspath(store.path), store.version()],
+        code=code_version(),
+        args=args,
+    )
+
+
+_code_version = None
+
+
+def code_version():
+    global _code_version
+    if _code_version is None:
+        _code_version = resultcache.code_version(CODE_FILES)
+    return _code_version
+
+
 if __name__ == "__main__":
     # TODO add date range args for date range report
     c = None
@@ -138,20 +758,61 @@ if __name__ == "__main__":
     else:
         cb_class = AssetLifoCostBasis
 
-    costbasis, deposits = match_trades(cutoff_date=c, reset_pl_date=r, costbasis_class=cb_class)
+    if "--offline" in sys.argv:
+        pricestore.set_offline()
+    if "--stats" in sys.argv or argval("stats-json"):
+        stats.enable()
+    # hours, 0 keeps entries pending for the whole replay
+    horizons = {}
+    for kind in ["trade", "transfer"]:
+        if argval(f"{kind}-horizon"):
+            horizons[f"{kind}_horizon"] = timedelta(hours=float(argval(f"{kind}-horizon")))
+    opts = {}
+    if argval("symbols"):
+        opts["symbols"] = [normalize_sym(s.upper()) for s in argval("symbols").split(",")]
+    if argval("exchanges"):
+        opts["exchanges"] = argval("exchanges").lower().split(",")
+    if argval("workers"):
+        opts["workers"] = int(argval("workers"))
+    if "--no-cache" not in sys.argv:
+        size = argval("cache-size")
+        opts["cache"] = resultcache.ResultCache(
+            max_bytes=int(float(size) * (1 << 20)) if size else resultcache.DEFAULT_MAX_BYTES
+        )
+    profile = argval("profile", default="cprofile")
+    if profile:
+        with stats.profile(profile, path=argval("profile-out")):
+            costbasis, deposits = match_trades(cutoff_date=c, reset_pl_date=r, costbasis_class=cb_class, **horizons, **opts)
+    else:
+        costbasis, deposits = match_trades(cutoff_date=c, reset_pl_date=r, costbasis_class=cb_class, **horizons, **opts)
     if "detail" in sys.argv:
         totalcb = 0
         currvalue = 0
         profit_loss = 0
+        short_term_pl = 0
+        long_term_pl = 0
+        now = c or datetime.now(tz=dateutil.tz.tzlocal())
         print(f"total deposits: {deposits}")
+        prices = get_current_usd_many(list(costbasis.keys()), ts=c)
         for sym, cb in costbasis.items():
-            usd = cb.balance * Decimal(get_current_usd(cb, ts=c))
-            print(f"{sym} {cb.balance:0.2f} cost_basis ${cb.usd_avg_cost_basis*cb.balance:0.2f} value ${usd:0.2f} P/L ${cb.profit_loss:0.2f}")
+            if prices[sym].error:
+                print(f"ERROR can't get price for {sym}: {prices[sym].error}")
+            usd = cb.balance * Decimal(prices[sym].price or 0)
+            print(f"{sym} {cb.balance:0.2f} cost_basis ${cb.usd_avg_cost_basis*cb.balance:0.2f} value ${usd:0.2f} P/L ${cb.profit_loss:0.2f} (short-term ${cb.short_term_pl:0.2f}, long-term ${cb.long_term_pl:0.2f})")
+            turning = cb.holding.turning_long_term(now, now + timedelta(days=30))
+            if turning and sym != "USD":
+                print(f"  {turning:0.8f} {sym} turns long-term within 30 days")
             profit_loss += cb.profit_loss
+            short_term_pl += cb.short_term_pl
+            long_term_pl += cb.long_term_pl
             if sym == "USD":
                 continue
             currvalue += usd
             totalcb += cb.usd_avg_cost_basis * cb.balance
         print(f"all crypto ${currvalue:0.2f} current value cost basis ${totalcb:0.2f}")
         print(f"unrealized p/l: ${currvalue-totalcb:0.2f}")
-        print(f"realized p/l: ${profit_loss:0.2f}")
+        print(f"realized p/l: ${profit_loss:0.2f} (short-term ${short_term_pl:0.2f}, long-term ${long_term_pl:0.2f})")
+    if "--stats" in sys.argv:
+        stats.report()
+    if argval("stats-json"):
+        stats.dump(argval("stats-json"))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+from itertools import islice
+from time import perf_counter
+
+CHUNK_LINES = 20000
+# how much of the start of an export is compared to tell an appended
+# export from a different one
+HEAD_BYTES = 4096
+
+
+class TxStore(object):
+    """transaction rows appended to one file as pickled chunks, with a json
+    index next to it listing each chunk's offset, size, row count, date
+    range, exchanges and symbols
+
+    a chunk only exists once the index lists it, so a crash during an
+    append leaves the store as it was before
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.index = {"chunks": [], "source": None}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    @property
+    def end(self):
+        chunks = self.index["chunks"]
+        return chunks[-1]["offset"] + chunks[-1]["size"] if chunks else 0
+
+    def save_index(self):
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+
+    def append(self, rows, source=None):
+        """add a chunk of rows, and record how far the import that produced
+        them got in the same index update"""
+        if rows:
+            end = self.end
+            mode = "r+b" if os.path.exists(self.path) else "wb"
+            with open(self.path, mode) as f:
+                # drop whatever an interrupted append left behind
+                f.truncate(end)
+                f.seek(end)
+                pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell() - end
+                f.flush()
+                os.fsync(f.fileno())
+            dates = [t[0] for t in rows]
+            self.index["chunks"].append(
+                {
+                    "offset": end,
+                    "size": size,
+                    "rows": len(rows),
+                    "first": min(dates).isoformat(),
+                    "last": max(dates).isoformat(),
+                    "exchanges": sorted({t[1] for t in rows}),
+                    "symbols": sorted({t[3] for t in rows}),
+                }
+            )
+        if source is not None:
+            self.index["source"] = source
+        if rows or source is not None:
+            self.save_index()
+
+    def chunks(self):
+        if not self.index["chunks"]:
+            return
+        with open(self.path, "rb") as f:
+            for chunk in self.index["chunks"]:
+                f.seek(chunk["offset"])
+                yield pickle.load(f)
+
+    def drop_last(self, source=None):
+        """forget the last chunk, its bytes are overwritten by the next
+        append. source is recorded in the same index update"""
+        chunk = self.index["chunks"].pop()
+        if source is not None:
+            self.index["source"] = source
+        self.save_index()
+        return chunk["rows"]
+
+    def rows(self):
+        rows = []
+        for chunk in self.chunks():
+            rows += chunk
+        return rows
+
+    def clear(self):
+        self.index = {"chunks": [], "source": None}
+        self.save_index()
+        if os.path.exists(self.path):
+            os.truncate(self.path, 0)
+
+    def __len__(self):
+        return sum(c["rows"] for c in self.index["chunks"])
+
+
+def head_digest(f, size):
+    f.seek(0)
+    return hashlib.sha1(f.read(size)).hexdigest()
+
+
+def import_export(store, path, parse_chunk, header=False, chunk_lines=CHUNK_LINES, errors=None):
+    """stream the lines of an export added since the last import into store
+
+    parse_chunk(lines, lineno, errors) turns a list of lines, the first of
+    them line lineno, into rows. when the export only grew since the last
+    import just the new lines are read, otherwise the store is rebuilt.
+    a last line without a newline is imported on its own chunk when it
+    parses cleanly, but not counted as read, if the export grows past it
+    that chunk is dropped and the line read again. returns the number of
+    rows added
+    """
+    st = os.stat(path)
+    with open(path, "rb") as f:
+        source = store.index["source"]
+        resume = (
+            source is not None
+            and source["path"] == os.path.abspath(path)
+            and st.st_size >= source["offset"]
+            and head_digest(f, source["head"]) == source["digest"]
+        )
+        if not resume:
+            store.clear()
+            source = {"path": os.path.abspath(path), "offset": 0, "lineno": 0, "head": 0, "digest": None, "malformed": 0}
+        elif st.st_size == source["offset"] + source.get("tail", 0):
+            return 0
+        added = 0
+        if source.get("tail"):
+            # the unterminated line imported last time has grown
+            source["tail"] = 0
+            added -= store.drop_last(source=dict(source))
+        f.seek(source["offset"])
+        while True:
+            raw = list(islice(f, chunk_lines))
+            if not raw:
+                break
+            tail = None
+            if not raw[-1].endswith(b"\n"):
+                tail = raw.pop()
+                if not raw:
+                    added += import_tail(store, source, tail, parse_chunk, header)
+                    break
+            lineno = source["lineno"] + 1
+            lines = [line.decode("utf-8") for line in raw]
+            if header and lineno == 1:
+                lines[0] = ""
+            chunk_errors = []
+            rows = parse_chunk(lines, lineno, chunk_errors)
+            source["offset"] += sum(len(line) for line in raw)
+            source["lineno"] += len(raw)
+            source["malformed"] += len(chunk_errors)
+            if source["digest"] is None or source["head"] < HEAD_BYTES:
+                source["head"] = min(source["offset"], HEAD_BYTES)
+                source["digest"] = head_digest(f, source["head"])
+                f.seek(source["offset"])
+            store.append(rows, source=dict(source))
+            added += len(rows)
+            if errors is not None:
+                errors += chunk_errors
+            if tail is not None:
+                added += import_tail(store, source, tail, parse_chunk, header)
+                break
+            if len(raw) < chunk_lines:
+                break
+    return added
+
+
+def import_tail(store, source, line, parse_chunk, header):
+    """store the rows of an export's last line when it has no newline yet
+    but parses cleanly, an export written without a final newline is
+    complete. returns the number of rows added"""
+    lineno = source["lineno"] + 1
+    try:
+        text = "" if header and lineno == 1 else line.decode("utf-8")
+    except UnicodeDecodeError:
+        # cut in the middle of a character
+        return 0
+    errors = []
+    rows = parse_chunk([text], lineno, errors)
+    if errors or not rows:
+        return 0
+    source["tail"] = len(line)
+    store.append(rows, source=dict(source))
+    return len(rows)
+
+
+def report_errors(path, errors, limit=10, file=None):
+    file = file or sys.stderr
+    for lineno, line, reason in errors[:limit]:
+        print(f"  {path}:{lineno}: malformed row {line.rstrip()!r}: {reason}", file=file)
+    if len(errors) > limit:
+        print(f"  {path}: {len(errors) - limit} more malformed rows", file=file)
+
+
+if __name__ == "__main__":
+    import exchanges
+
+    parser = argparse.ArgumentParser(description="import a bithumb or bittrex tsv export into a transaction store")
+    parser.add_argument("source", choices=sorted(exchanges.EXPORTS))
+    parser.add_argument("export", nargs="?", help="export file (default: the one get_all_transactions reads)")
+    parser.add_argument("--store", help="store file (default: {source}.tx next to the export)")
+    parser.add_argument("--rebuild", action="store_true", help="reimport the whole export")
+    args = parser.parse_args()
+
+    name, parse_chunk = exchanges.EXPORTS[args.source]
+    path = args.export or name
+    store = TxStore(args.store or os.path.join(os.path.dirname(path), f"{args.source}.tx"))
+    if args.rebuild:
+        store.clear()
+    errors = []
+    start = perf_counter()
+    n = import_export(store, path, parse_chunk, header=True, errors=errors)
+    elapsed = perf_counter() - start
+    print(f"{path}: {n} new rows, {len(store)} in {store.path}, {elapsed:0.2f}s")
+    report_errors(path, errors)